@@ -1,6 +1,7 @@
 # py -m pip install requirements
 import sys
 import os
+import multiprocessing
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QTabWidget, QLabel, QSplashScreen)
 from PyQt6.QtCore import Qt, QTimer
@@ -94,6 +95,9 @@ def set_dark_theme(app):
         app.setPalette(palette)
 
 if __name__ == "__main__":
+    # Sprite conversion uses a process pool (needed for frozen builds)
+    multiprocessing.freeze_support()
+
     app = QApplication(sys.argv)
     
     set_dark_theme(app)
@@ -0,0 +1,864 @@
+import io
+import operator
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from dat_handler import (
+    DAT_HEADER,
+    FLAG_READERS,
+    FRAME_DURATION,
+    LAST_FLAG,
+    MARKET_FLAG,
+    METADATA_FLAGS,
+    PAYLOAD_ARITY,
+    REVERSE_METADATA_FLAGS,
+    TEXTURE_PATTERN,
+    U16,
+    U32,
+    FlagIndex,
+    SpriteUsageIndex,
+    TextureError,
+    ThingTexture,
+    ThingType,
+    remap_sprite_ids,
+    set_flag,
+    thing_texture,
+    unset_flag,
+)
+
+# Reading, editing and writing a .dat without any GUI dependency: the
+# editor tab (datspr) and the headless tools share these classes.
+
+
+class LazyThings(MutableMapping):
+    """
+    things[category] of a lazily loaded DAT: only the byte span of every
+    thing is kept (one array('I') of start offsets); a thing is parsed on
+    first access and cached. Things that were never accessed can be saved
+    by copying their span as-is (raw_span).
+    """
+
+    def __init__(self, editor, data, category, first_id, starts):
+        self._editor = editor
+        self._data = data
+        self._category = category
+        self._first_id = first_id
+        self._starts = starts  # starts[n] = span of first_id + n, starts[-1] = end
+        self._last_id = first_id + len(starts) - 2
+        self._parsed = {}
+        self._deleted = set()
+        self._corrupt = set() # parsed at load: couldn't be skipped
+
+    def _in_file(self, thing_id):
+        return self._first_id <= thing_id <= self._last_id and thing_id not in self._deleted
+
+    def raw_span(self, thing_id):
+        """Bytes of a thing exactly as in the file, or None once it was accessed/replaced."""
+        if thing_id in self._parsed or not self._in_file(thing_id):
+            return None
+        n = thing_id - self._first_id
+        return self._data[self._starts[n]:self._starts[n + 1]]
+
+    def index_arrays(self):
+        """(starts, IDs parsed at load because they were corrupt) as uint32 arrays."""
+        starts = np.frombuffer(self._starts, dtype=np.uint32).copy()
+        corrupt = np.array(sorted(self._corrupt), dtype=np.uint32)
+        return starts, corrupt
+
+    def raw_bounds(self, thing_id):
+        """(start, end) of a never-accessed thing in the file buffer, or None."""
+        if thing_id in self._parsed or not self._in_file(thing_id):
+            return None
+        n = thing_id - self._first_id
+        return self._starts[n], self._starts[n + 1]
+
+    def raw_bytes(self, start, end):
+        return memoryview(self._data)[start:end]
+
+    def raw_texture(self, thing_id):
+        """Texture bytes of a thing that was never accessed (None otherwise), without parsing it."""
+        if thing_id in self._parsed or not self._in_file(thing_id):
+            return None
+        n = thing_id - self._first_id
+        start = self._editor._skip_flags(self._data, self._starts[n])
+        return self._data[start:self._starts[n + 1]]
+
+    def peek(self, thing_id):
+        """A thing without caching it: never-accessed ones are parsed into a throwaway copy."""
+        thing = self._parsed.get(thing_id)
+        if thing is not None:
+            return thing
+        if not self._in_file(thing_id):
+            raise KeyError(thing_id)
+        n = thing_id - self._first_id
+        return self._editor._parse_thing_at(self._data, self._starts[n], self._category)[0]
+
+    def loaded_items(self):
+        """(thing_id, thing) of every thing parsed or assigned so far."""
+        return list(self._parsed.items())
+
+    def __getitem__(self, thing_id):
+        thing = self._parsed.get(thing_id)
+        if thing is not None:
+            return thing
+        if not self._in_file(thing_id):
+            raise KeyError(thing_id)
+
+        n = thing_id - self._first_id
+        thing, _ = self._editor._parse_thing_at(self._data, self._starts[n], self._category)
+        self._parsed[thing_id] = thing
+        return thing
+
+    def __setitem__(self, thing_id, thing):
+        self._deleted.discard(thing_id)
+        self._parsed[thing_id] = thing
+
+    def __delitem__(self, thing_id):
+        if not self._in_file(thing_id) and thing_id not in self._parsed:
+            raise KeyError(thing_id)
+        self._parsed.pop(thing_id, None)
+        if self._first_id <= thing_id <= self._last_id:
+            self._deleted.add(thing_id)
+
+    def __contains__(self, thing_id):
+        if thing_id in self._parsed:
+            return True
+        try:
+            thing_id = operator.index(thing_id) # numpy integer IDs too
+        except TypeError:
+            return False
+        return self._in_file(thing_id)
+
+    def __iter__(self):
+        for thing_id in range(self._first_id, self._last_id + 1):
+            if thing_id not in self._deleted:
+                yield thing_id
+        for thing_id in list(self._parsed):
+            if not self._first_id <= thing_id <= self._last_id:
+                yield thing_id
+
+    def __len__(self):
+        in_file = max(0, self._last_id - self._first_id + 1) - len(self._deleted)
+        extra = sum(1 for t in self._parsed if not self._first_id <= t <= self._last_id)
+        return in_file + extra
+
+
+class DatEditor:
+    def __init__(self, dat_path, extended=False, lazy=False):
+        self.dat_path = dat_path
+        self.signature = 0
+        self.extended = extended
+        self.lazy = lazy # Index spans on load, parse things on first access
+
+        self.counts = {"items": 0, "outfits": 0, "effects": 0, "missiles": 0}
+        self.things = {"items": {}, "outfits": {}, "effects": {}, "missiles": {}}
+        self.usage = None # SpriteUsageIndex, built on first sprite_usage()
+        self.flag_indexes = {} # category -> FlagIndex, built on first flag_index()
+
+    def load(self, progress_callback=None, index=None):
+        """
+        index: sections of a SessionCache of this file (see index_sections);
+        with lazy=True the thing spans come from it instead of a walk.
+        """
+        # One read, then the parser walks the buffer with unpack_from
+        with open(self.dat_path, "rb") as f:
+            data = f.read()
+        self.usage = None
+        self.flag_indexes = {}
+
+        if self.lazy and index and "dat.header" in index:
+            self._load_index(data, index)
+            if progress_callback:
+                total = sum(len(things) for things in self.things.values())
+                progress_callback(total, total)
+            return
+
+        (
+            self.signature,
+            item_count,
+            outfit_count,
+            effect_count,
+            missile_count,
+        ) = DAT_HEADER.unpack_from(data)
+        self.counts = {
+            "items": item_count,
+            "outfits": outfit_count,
+            "effects": effect_count,
+            "missiles": missile_count,
+        }
+
+        total = max(0, item_count - 99) + outfit_count + effect_count + missile_count
+        done = 0
+        pos = DAT_HEADER.size
+
+        for category, first_id in (
+            ("items", 100),
+            ("outfits", 1),
+            ("effects", 1),
+            ("missiles", 1),
+        ):
+            if self.lazy:
+                starts = array("I")
+                corrupt = {}
+            else:
+                things = self.things[category] = {}
+
+            for thing_id in range(first_id, self.counts[category] + 1):
+                if self.lazy:
+                    starts.append(pos)
+                    try:
+                        pos = self._skip_thing(data, pos, category)
+                    except (IndexError, struct.error):
+                        corrupt[thing_id], pos = self._parse_thing_at(data, pos, category)
+                else:
+                    things[thing_id], pos = self._parse_thing_at(data, pos, category)
+
+                done += 1
+                if progress_callback and done % 5000 == 0:
+                    progress_callback(done, total)
+
+            if self.lazy:
+                starts.append(pos)
+                things = self.things[category] = LazyThings(self, data, category, first_id, starts)
+                # Things that couldn't be skipped are kept parsed (saved the normal way)
+                for thing_id, thing in corrupt.items():
+                    things[thing_id] = thing
+                things._corrupt.update(corrupt)
+
+        if progress_callback:
+            progress_callback(total, total)
+
+    def _load_index(self, data, index):
+        self.signature, *counts = (int(v) for v in index["dat.header"])
+        self.counts = dict(zip(("items", "outfits", "effects", "missiles"), counts))
+        for category, first_id in (
+            ("items", 100),
+            ("outfits", 1),
+            ("effects", 1),
+            ("missiles", 1),
+        ):
+            starts = array("I", index["dat.starts." + category].tobytes())
+            things = self.things[category] = LazyThings(self, data, category, first_id, starts)
+            for thing_id in index["dat.corrupt." + category].tolist():
+                n = thing_id - first_id
+                things[thing_id], _ = self._parse_thing_at(data, starts[n], category)
+                things._corrupt.add(thing_id)
+
+    def index_sections(self):
+        """
+        The spans of a lazily loaded DAT as SessionCache sections ({} for an
+        eager load): header, start of every thing in the file and the IDs
+        that had to be parsed at load.
+        """
+        sections = {
+            "dat.header": np.array(
+                [self.signature] + [self.counts[c] for c in ("items", "outfits", "effects", "missiles")],
+                dtype=np.uint32,
+            )
+        }
+        for category, things in self.things.items():
+            if not isinstance(things, LazyThings):
+                return {}
+            starts, corrupt = things.index_arrays()
+            sections["dat.starts." + category] = starts
+            sections["dat.corrupt." + category] = corrupt
+        return sections
+
+    def _skip_flags(self, data, pos):
+        """Returns where the texture of the thing at data[pos] starts."""
+        while True:
+            flag = data[pos]
+            pos += 1
+            if flag == LAST_FLAG:
+                break
+
+            reader = FLAG_READERS.get(flag)
+            if reader is None:
+                continue
+            if flag == MARKET_FLAG:
+                pos += 8 + U16.unpack_from(data, pos + 6)[0] + 4
+            elif reader[2]:
+                pos += reader[2].size
+        return pos
+
+    def _skip_thing(self, data, pos, category):
+        """Returns where the thing at data[pos] ends, without building its props."""
+        pos = self._skip_flags(data, pos)
+        spr_size = 4 if self.extended else 2
+        groups = 1
+        if category == "outfits":
+            groups = data[pos]
+            pos += 1
+
+        for _ in range(groups):
+            if category == "outfits":
+                pos += 1 # Frame group type
+            w = data[pos]
+            h = data[pos + 1]
+            pos += 2
+            if w > 1 or h > 1:
+                pos += 1
+            layers, px, py, pz, frames = TEXTURE_PATTERN.unpack_from(data, pos)
+            pos += TEXTURE_PATTERN.size
+            if frames > 1:
+                pos += 6 + frames * FRAME_DURATION.size
+            pos += w * h * px * py * pz * layers * frames * spr_size
+
+        if pos > len(data):
+            raise IndexError("truncated thing")
+        return pos
+
+    def _parse_thing_at(self, data, pos, category):
+        """
+        Parses the thing starting at data[pos] into a ThingType and returns
+        (thing, next_pos). texture_bytes is one slice of the buffer.
+        Truncated or corrupt things go through the stream parser
+        (_parse_thing), which keeps the exact old behaviour for them.
+        """
+        start = pos
+        try:
+            thing = ThingType()
+            flags = 0
+            data_flags = 0
+            payload = None
+            last_flag = -1
+            props = None  # ThingProps, only for flags out of order / repeated
+
+            # --- 1. LEITURA DAS FLAGS ---
+            while True:
+                flag = data[pos]
+                pos += 1
+                if flag == LAST_FLAG:
+                    break
+
+                reader = FLAG_READERS.get(flag)
+                if reader is None:
+                    continue
+                name, data_key, fmt = reader
+
+                if flag == MARKET_FLAG:
+                    # [Category:2][TradeAs:2][ShowAs:2][NameLen:2][Name][Voc:2][Level:2]
+                    size = 8 + U16.unpack_from(data, pos + 6)[0] + 4
+                    if pos + size > len(data):
+                        raise IndexError("truncated MarketItem")
+                    value = data[pos:pos + size]
+                    pos += size
+                elif fmt:
+                    value = fmt.unpack_from(data, pos)
+                    pos += fmt.size
+                else:
+                    value = None
+
+                if flag > last_flag and props is None:
+                    # Usual case: flags in ascending order, payloads appended
+                    flags |= 1 << flag
+                    last_flag = flag
+                    if flag == MARKET_FLAG:
+                        thing.market = value
+                    elif value is not None:
+                        if payload is None:
+                            payload = array("i")
+                        payload.extend(value)
+                        data_flags |= 1 << flag
+                    continue
+
+                if props is None:
+                    thing.flags, thing.data_flags, thing.payload = flags, data_flags, payload
+                    props = thing["props"]
+                props[name] = True
+                if value is not None:
+                    props[data_key] = value
+
+            if props is None:
+                thing.flags, thing.data_flags, thing.payload = flags, data_flags, payload
+
+            # --- 2. TEXTURA ---
+            texture_start = pos
+            spr_size = 4 if self.extended else 2
+
+            if category == "outfits":
+                fg_count = data[pos]
+                pos += 1
+                thing.frame_group_count = fg_count
+                groups = range(fg_count)
+            else:
+                groups = (None,)
+
+            for i in groups:
+                if i is not None:
+                    # Type (Idle/Walk)
+                    if i == 0:
+                        thing.frame_group_type = data[pos]
+                    pos += 1
+
+                w = data[pos]
+                h = data[pos + 1]
+                pos += 2
+                first = i is None or i == 0
+                if first:
+                    thing.width = w
+                    thing.height = h
+                if i is None:
+                    thing.crop_size = 0
+
+                # Crop Size (Se maior que 1x1)
+                if w > 1 or h > 1:
+                    if first:
+                        thing.crop_size = data[pos]
+                    pos += 1
+
+                layers, px, py, pz, frames = TEXTURE_PATTERN.unpack_from(data, pos)
+                pos += TEXTURE_PATTERN.size
+                if first:
+                    thing.layers = layers
+                    thing.pattern_x = px
+                    thing.pattern_y = py
+                    thing.pattern_z = pz
+                    thing.frames = frames
+
+                # Animation Details: Async(1) + Loop(4) + Start(1) + Durations(frames * 8)
+                if frames > 1:
+                    thing.anim_async = data[pos]
+                    thing.anim_loop = U32.unpack_from(data, pos + 1)[0]
+                    thing.anim_start = data[pos + 5]
+                    pos += 6
+
+                    durations_end = pos + frames * FRAME_DURATION.size
+                    if durations_end > len(data):
+                        raise IndexError("truncated frame durations")
+                    durations = array("I")
+                    durations.frombytes(data[pos:durations_end])
+                    if sys.byteorder == "big":
+                        durations.byteswap()
+                    thing.durations = durations
+                    pos = durations_end
+
+                # Sprite IDs
+                pos += w * h * px * py * pz * layers * frames * spr_size
+                if pos > len(data):
+                    raise IndexError("truncated sprite IDs")
+
+            thing.texture = data[texture_start:pos]
+            return thing, pos
+
+        except (IndexError, struct.error):
+            f = io.BytesIO(data)
+            f.seek(start)
+            thing = self._parse_thing(f, category)
+            return ThingType.from_dict(thing), f.tell()
+
+    def _parse_thing(self, f, category):
+        props = OrderedDict()
+
+        # --- 1. LEITURA DAS FLAGS ---
+        while True:
+            byte = f.read(1)
+            # Se acabar o arquivo ou flag de fim (0xFF)
+            if not byte or byte[0] == LAST_FLAG:
+                break
+
+            flag = byte[0]
+
+            if flag in METADATA_FLAGS:
+                name, fmt = METADATA_FLAGS[flag]
+
+                if name == "MarketItem":
+                    # Lógica específica do Market
+                    header = f.read(8)
+                    if len(header) == 8:
+                        # header: [Category:2][TradeAs:2][ShowAs:2][NameLen:2]
+                        name_len = struct.unpack("<H", header[6:8])[0]
+                        # Resto: [Name:Len][Voc:2][Level:2] = Len + 4 bytes
+                        rest = f.read(name_len + 4)
+                        props[name] = True
+                        props[name + "_data"] = header + rest
+                else:
+                    props[name] = True
+                    if fmt:
+                        size = struct.calcsize(fmt)
+                        data = f.read(size)
+                        if len(data) < size:
+                            break
+                        props[name + "_data"] = struct.unpack(fmt, data)
+
+        texture_bytes = bytearray()
+
+        if category == "outfits":
+            b = f.read(1)
+            if not b:
+                return {"props": props, "texture_bytes": bytes(texture_bytes)}
+            texture_bytes.extend(b)
+            fg_count = b[0]
+            props["FrameGroupCount"] = fg_count
+
+            for i in range(fg_count):
+                # Type (Idle/Walk)
+                b = f.read(1)
+                texture_bytes.extend(b)
+                if i == 0:
+                    props["FrameGroupType"] = b[0]
+
+                # Width / Height
+                # Width / Height
+                b = f.read(2)
+                if len(b) < 2:
+                    return {"props": props, "texture_bytes": bytes(texture_bytes)}
+                texture_bytes.extend(b)
+                w, h = struct.unpack("<BB", b)
+
+                if i == 0:
+                    props["Width"] = w
+                    props["Height"] = h
+
+                # Crop Size (Se maior que 1x1)
+                if w > 1 or h > 1:
+                    b = f.read(1)
+                    texture_bytes.extend(b)
+                    if i == 0:
+                        props["CropSize"] = b[0]
+
+                # Headers de Animação
+                b = f.read(5)  # Layers, Px, Py, Pz, Frames
+                if len(b) < 5:
+                    return {"props": props, "texture_bytes": bytes(texture_bytes)}
+                texture_bytes.extend(b)
+                layers, px, py, pz, frames = struct.unpack("<BBBBB", b)
+
+                if i == 0:
+                    props["Layers"] = layers
+                    props["PatternX"] = px
+                    props["PatternY"] = py
+                    props["PatternZ"] = pz
+                    props["Animation"] = frames
+
+                # Animation Details (Timing)
+                if frames > 1:
+                    # Async(1) + Loop(4) + Start(1) + Durations(frames * 8)
+                    # detail_size = 1 + 4 + 1 + (frames * 8)
+                    # b = f.read(detail_size)
+                    
+                    # 1. Async
+                    b = f.read(1)
+                    texture_bytes.extend(b)
+                    props["AnimAsync"] = b[0]
+                    
+                    # 2. Loop Count
+                    b = f.read(4)
+                    texture_bytes.extend(b)
+                    props["AnimLoop"] = struct.unpack("<I", b)[0]
+                    
+                    # 3. Start Frame
+                    b = f.read(1)
+                    texture_bytes.extend(b)
+                    props["AnimStart"] = b[0]
+                    
+                    # 4. Frame Durations (8 bytes each: 4 min, 4 max)
+                    durations = []
+                    for _ in range(frames):
+                         b = f.read(8)
+                         texture_bytes.extend(b)
+                         min_dur, max_dur = struct.unpack("<II", b)
+                         durations.append((min_dur, max_dur))
+                    props["FrameDurations"] = durations
+
+                # Sprite IDs
+                total_sprites = w * h * px * py * pz * layers * frames
+                spr_size = 4 if self.extended else 2
+
+                b = f.read(total_sprites * spr_size)
+                texture_bytes.extend(b)
+
+        else:
+            # --- ITEM / EFFECT / MISSILE STRUCTURE ---
+            # Width / Height
+            b = f.read(2)
+            if len(b) < 2:
+                return {"props": props, "texture_bytes": bytes(texture_bytes)}
+            texture_bytes.extend(b)
+
+            w, h = struct.unpack("<BB", b)
+            props["Width"] = w
+            props["Height"] = h
+            props["CropSize"] = 0
+
+            # Crop Size
+            if w > 1 or h > 1:
+                b = f.read(1)
+                texture_bytes.extend(b)
+                props["CropSize"] = b[0]
+
+            # Headers
+            b = f.read(5)
+            if len(b) < 5:
+                return {"props": props, "texture_bytes": bytes(texture_bytes)}
+            texture_bytes.extend(b)
+            layers, px, py, pz, frames = struct.unpack("<BBBBB", b)
+
+            props["Layers"] = layers
+            props["PatternX"] = px
+            props["PatternY"] = py
+            props["PatternZ"] = pz
+            props["Animation"] = frames
+
+            # Animation Details
+            if frames > 1:
+                # detail_size = 1 + 4 + 1 + (frames * 8)
+                # b = f.read(detail_size)
+
+                # 1. Async
+                b = f.read(1)
+                texture_bytes.extend(b)
+                props["AnimAsync"] = b[0]
+
+                # 2. Loop Count
+                b = f.read(4)
+                texture_bytes.extend(b)
+                props["AnimLoop"] = struct.unpack("<I", b)[0]
+
+                # 3. Start Frame
+                b = f.read(1)
+                texture_bytes.extend(b)
+                props["AnimStart"] = b[0]
+
+                # 4. Frame Durations
+                durations = []
+                for _ in range(frames):
+                     b = f.read(8)
+                     texture_bytes.extend(b)
+                     min_dur, max_dur = struct.unpack("<II", b)
+                     durations.append((min_dur, max_dur))
+                props["FrameDurations"] = durations
+
+            # Sprite IDs
+            total_sprites = w * h * px * py * pz * layers * frames
+            spr_size = 4 if self.extended else 2
+
+            b = f.read(total_sprites * spr_size)
+            texture_bytes.extend(b)
+
+        return {"props": props, "texture_bytes": bytes(texture_bytes)}
+
+    def apply_changes(
+        self, item_ids, attributes_to_set, attributes_to_unset, category="items"
+    ):
+        if category not in self.things:
+            return
+
+        # One pass per attribute; a built FlagIndex is updated in the same call
+        index = self.flag_indexes.get(category)
+        things = self.things[category]
+        for attr in attributes_to_set:
+            if attr in REVERSE_METADATA_FLAGS:
+                if index:
+                    index.bulk_set(item_ids, attr)
+                else:
+                    set_flag(things, item_ids, attr)
+
+        for attr in attributes_to_unset:
+            if attr in REVERSE_METADATA_FLAGS:
+                if index:
+                    index.bulk_unset(item_ids, attr)
+                else:
+                    unset_flag(things, item_ids, attr)
+
+    def flag_index(self, category="items"):
+        """FlagIndex of a category, built on first use."""
+        index = self.flag_indexes.get(category)
+        if index is None:
+            index = self.flag_indexes[category] = FlagIndex(self.things[category])
+        return index
+
+    def mark_changed(self, category, thing_ids):
+        """Tells the indexes that things were edited, added or removed outside apply_changes."""
+        index = self.flag_indexes.get(category)
+        if index is not None:
+            index.update(thing_ids)
+
+    def remap_sprites(self, table):
+        """
+        Rewrites the sprite IDs of every thing through a lookup table
+        (new_id = lookup[old_id], e.g. from SprEditor.drop_sprites) or an
+        {old_id: new_id} dict, in one bulk pass (see remap_sprite_ids).
+        Returns the number of things changed.
+        """
+        changed = remap_sprite_ids(self.things, table, self.extended)
+        for category, thing_ids in changed.items():
+            if thing_ids:
+                self.mark_changed(category, thing_ids)
+        self.usage = None  # references moved: rebuilt on the next query
+        return sum(len(thing_ids) for thing_ids in changed.values())
+
+    def save(self, output_path):
+        """
+        Writes the DAT. Only a lazy load (lazy=True) keeps the original
+        spans: things it never parsed are copied byte for byte, in runs.
+        An eager load holds no spans and re-serializes every thing.
+        """
+        # Every category is assembled in one bytearray and written at once
+        empty_thing = bytes([LAST_FLAG]) + b"\x01" * 7 + b"\x00" * (4 if self.extended else 2)
+
+        with open(output_path, "wb") as f:
+            f.write(
+                DAT_HEADER.pack(
+                    self.signature,
+                    self.counts["items"],
+                    self.counts["outfits"],
+                    self.counts["effects"],
+                    self.counts["missiles"],
+                )
+            )
+
+            for category, start_id in (
+                ("items", 100),
+                ("outfits", 1),
+                ("effects", 1),
+                ("missiles", 1),
+            ):
+                things = self.things[category]
+                lazy = isinstance(things, LazyThings)
+                out = bytearray()
+                run_start = run_end = 0
+
+                for tid in range(start_id, self.counts[category] + 1):
+                    if lazy:
+                        # Never touched: extend the run of original bytes
+                        bounds = things.raw_bounds(tid)
+                        if bounds is not None:
+                            if bounds[0] != run_end:
+                                out += things.raw_bytes(run_start, run_end)
+                                run_start = bounds[0]
+                            run_end = bounds[1]
+                            continue
+
+                    if run_end > run_start:
+                        out += things.raw_bytes(run_start, run_end)
+                        run_start = run_end = 0
+
+                    thing = things.get(tid)
+                    texture = thing.get("texture_bytes", b"") if thing else b""
+                    if texture:
+                        if isinstance(thing, ThingType) and not thing.extra:
+                            self._serialize_flags(out, thing)
+                        else:
+                            self._write_thing_properties(out, thing["props"])
+                        out.append(LAST_FLAG)
+                        out += texture
+                    else:
+                        out += empty_thing
+
+                if run_end > run_start:
+                    out += things.raw_bytes(run_start, run_end)
+                f.write(out)
+
+    @staticmethod
+    def _serialize_flags(out, thing):
+        """Flags of a ThingType: only the bits that are set, payloads packed with FLAG_READERS."""
+        flags = thing.flags
+        data_flags = thing.data_flags
+        payload = thing.payload
+        offset = 0
+        counted = 0 # data flags below the current one, already added to offset
+        while flags:
+            low = flags & -flags
+            flags ^= low
+            flag = low.bit_length() - 1
+            out.append(flag)
+
+            if flag == MARKET_FLAG:
+                if thing.market is not None:
+                    out += thing.market
+                continue
+
+            reader = FLAG_READERS[flag][2]
+            if reader is None:
+                continue
+            # Payload values are stored in flag order: skip the ones of lower data flags
+            pending = data_flags & (low - 1) & ~counted
+            while pending:
+                bit = pending & -pending
+                pending ^= bit
+                counted |= bit
+                offset += PAYLOAD_ARITY[bit.bit_length() - 1]
+            if data_flags & low:
+                values = payload[offset:offset + PAYLOAD_ARITY[flag]]
+                try:
+                    out += reader.pack(*values)
+                except struct.error as e:
+                    print(f"Erro salvando flag {FLAG_READERS[flag][0]} ({hex(flag)}): {e}")
+
+    @staticmethod
+    def _write_thing_properties(out, props):
+        for flag, (name, data_key, reader) in FLAG_READERS.items():
+            if name in props:
+                if props[name] is True:
+                    out.append(flag)
+
+                    if data_key in props:
+                        data = props[data_key]
+
+                        if reader:
+                            try:
+                                out += reader.pack(*data)
+                            except Exception as e:
+                                print(f"Erro salvando flag {name} ({hex(flag)}): {e}")
+                        else:
+                            if isinstance(data, bytes):
+                                out += data
+                            else:
+                                print(f"Erro: Dados de {name} não são bytes.")
+
+    @staticmethod
+    def extract_sprite_ids_from_texture_bytes(texture_bytes):
+        """Sprite IDs of the first frame group; item or outfit layout and ID width are detected."""
+        if not texture_bytes:
+            return []
+        try:
+            return ThingTexture.parse(texture_bytes).group_ids(0).tolist()
+        except TextureError:
+            return []
+
+    @staticmethod
+    def extract_sprite_ids_from_outfit_texture(texture_bytes):
+        return DatEditor.extract_outfit_group_sprites(texture_bytes, 0, extended=None)
+
+    @staticmethod
+    def extract_outfit_group_sprites(texturebytes, target_fg_index=0, extended=True):
+        if not texturebytes:
+            return []
+        try:
+            texture = ThingTexture.parse(texturebytes, outfit=True, extended=extended)
+        except TextureError as e:
+            print(f"ERROR extract_outfit_group_sprites: {e}")
+            return []
+        if not 0 <= target_fg_index < len(texture.groups):
+            return []
+        return texture.group_ids(target_fg_index).tolist()
+
+    def sprite_usage(self):
+        """
+        Reverse index sprite ID -> things. Built on the first call (so a lazy
+        load stays fast); later calls only re-index the things that changed.
+        """
+        if self.usage is None:
+            self.usage = SpriteUsageIndex(self.things, self.extended)
+        else:
+            self.usage.refresh()
+        return self.usage
+
+    def thing_sprite_ids(self, category, thing, group=0):
+        """
+        Sprite IDs of one frame group of a thing, as a uint32 array. The
+        texture is parsed once per thing and cached. Empty if unreadable.
+        """
+        try:
+            texture = thing_texture(thing, category == "outfits", self.extended)
+        except TextureError:
+            return np.zeros(0, dtype=np.uint32)
+        if not 0 <= group < len(texture.groups):
+            return np.zeros(0, dtype=np.uint32)
+        return texture.group_ids(group)
@@ -0,0 +1,1298 @@
+import struct
+import zlib
+from array import array
+from collections import OrderedDict, namedtuple
+from collections.abc import MutableMapping
+
+import numpy as np
+
+METADATA_FLAGS = {
+    0x00: ("Ground", "<H"),
+    0x01: ("GroundBorder", ""),
+    0x02: ("OnBottom", ""),
+    0x03: ("OnTop", ""),
+    0x04: ("Container", ""),
+    0x05: ("Stackable", ""),
+    0x06: ("ForceUse", ""),
+    0x07: ("MultiUse", ""),
+    0x08: ("Writable", "<H"),
+    0x09: ("WritableOnce", "<H"),
+    0x0A: ("FluidContainer", ""),
+    0x0B: ("IsFluid", ""),
+    0x0C: ("Unpassable", ""),
+    0x0D: ("Unmoveable", ""),
+    0x0E: ("BlockMissile", ""),
+    0x0F: ("BlockPathfind", ""),
+    0x10: ("NoMoveAnimation", ""),
+    0x11: ("Pickupable", ""),
+    0x12: ("Hangable", ""),
+    0x13: ("HookVertical", ""),
+    0x14: ("HookHorizontal", ""),
+    0x15: ("Rotatable", ""),
+    0x16: ("HasLight", "<HH"),
+    0x17: ("DontHide", ""),
+    0x18: ("Translucent", ""),
+    0x19: ("HasOffset", "<hh"),
+    0x1A: ("HasElevation", "<H"),
+    0x1B: ("LyingObject", ""),
+    0x1C: ("AnimateAlways", ""),
+    0x1D: ("ShowOnMinimap", "<H"),
+    0x1E: ("LensHelp", "<H"),
+    0x1F: ("FullGround", ""),
+    0x20: ("IgnoreLook", ""),
+    0x21: ("IsCloth", "<H"),
+    0x22: ("MarketItem", None),
+    0x23: ("DefaultAction", "<H"),
+    0x24: ("Wrappable", ""),
+    0x25: ("Unwrappable", ""),
+    0x26: ("TopEffect", ""),
+    0x27: ("Usable", ""),
+    0x28: ("ChangedToExpire", "<H"),
+    0x29: ("Corpse", ""),
+    0x2A: ("PlayerCorpse", ""),
+    0x2B: ("CyclopediaItem", "<H"),
+    0x2C: ("Ammo", ""),
+    0x2D: ("ShowOffSocket", ""),
+    0x2E: ("Reportable", ""),
+    0x2F: ("UpgradeClassification", "<H"),
+    0x30: ("Wearout", ""),
+    0x31: ("ClockExpire", ""),
+    0x32: ("Expire", ""),
+    0x33: ("ExpireStop", ""),
+}
+REVERSE_METADATA_FLAGS = {info[0]: flag for flag, info in METADATA_FLAGS.items()}
+LAST_FLAG = 0xFF
+
+# Precompiled layouts for the buffer parser: flag -> (name, data key, Struct or None)
+FLAG_READERS = {
+    flag: (name, name + "_data", struct.Struct(fmt) if fmt else None)
+    for flag, (name, fmt) in METADATA_FLAGS.items()
+}
+MARKET_FLAG = REVERSE_METADATA_FLAGS["MarketItem"]
+DAT_HEADER = struct.Struct("<IHHHH")  # [Signature:4][Items:2][Outfits:2][Effects:2][Missiles:2]
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+THING_CATEGORIES = ("items", "outfits", "effects", "missiles")
+TEXTURE_PATTERN = struct.Struct("<BBBBB")  # Layers, PatternX, PatternY, PatternZ, Frames
+FRAME_DURATION = struct.Struct("<II")  # min, max
+
+# Flags with a numeric payload, in file order, and how many values each holds
+PAYLOAD_ARITY = {
+    flag: len(FLAG_READERS[flag][2].unpack(bytes(FLAG_READERS[flag][2].size)))
+    for flag in METADATA_FLAGS
+    if FLAG_READERS[flag][2]
+}
+DATA_KEY_FLAGS = {name + "_data": flag for flag, (name, _fmt) in METADATA_FLAGS.items()}
+
+# props key -> ThingType slot, in the order the parser adds them
+TEXTURE_FIELDS = OrderedDict(
+    [
+        ("FrameGroupCount", "frame_group_count"),
+        ("FrameGroupType", "frame_group_type"),
+        ("Width", "width"),
+        ("Height", "height"),
+        ("CropSize", "crop_size"),
+        ("Layers", "layers"),
+        ("PatternX", "pattern_x"),
+        ("PatternY", "pattern_y"),
+        ("PatternZ", "pattern_z"),
+        ("Animation", "frames"),
+        ("AnimAsync", "anim_async"),
+        ("AnimLoop", "anim_loop"),
+        ("AnimStart", "anim_start"),
+        ("FrameDurations", "durations"),
+    ]
+)
+
+_INT32_MIN, _INT32_MAX = -(2 ** 31), 2 ** 31 - 1
+
+
+class ThingType(MutableMapping):
+    """
+    One DAT thing (item, outfit, effect or missile) in slots instead of a
+    dict + OrderedDict of props:
+
+    - flags: bitmask of the metadata flags that are set (bit = flag code)
+    - data_flags / payload: which flags carry numeric data and their values,
+      flattened in flag order in an array('i')
+    - market: raw MarketItem data
+    - width, height, ..., durations: header of the (first) texture
+    - texture: the raw texture bytes, as written to the DAT
+
+    It still behaves like the old {"props": ..., "texture_bytes": ...} dict:
+    thing["props"] is a ThingProps view with the old keys, so apply_changes,
+    _write_thing_properties and the tabs work unchanged. Keys the slots
+    can't hold (unknown names, odd values) go to `extra`.
+    """
+
+    __slots__ = (
+        "flags",
+        "data_flags",
+        "payload",
+        "market",
+        "frame_group_count",
+        "frame_group_type",
+        "width",
+        "height",
+        "crop_size",
+        "layers",
+        "pattern_x",
+        "pattern_y",
+        "pattern_z",
+        "frames",
+        "anim_async",
+        "anim_loop",
+        "anim_start",
+        "durations",
+        "texture",
+        "texture_cache",
+        "extra",
+    )
+
+    def __init__(self, texture=b""):
+        self.flags = 0
+        self.data_flags = 0
+        self.payload = None
+        self.market = None
+        for slot in TEXTURE_FIELDS.values():
+            setattr(self, slot, None)
+        self.texture = texture
+        self.texture_cache = None
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, thing):
+        """Builds a ThingType from an old-style {"props", "texture_bytes"} dict."""
+        obj = cls(thing.get("texture_bytes", b""))
+        props = ThingProps(obj)
+        for key, value in thing.get("props", {}).items():
+            props[key] = value
+        return obj
+
+    # --- dict-like access: "props" / "texture_bytes" ---
+
+    def __getitem__(self, key):
+        if key == "props":
+            return ThingProps(self)
+        if key == "texture_bytes":
+            return self.texture
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "texture_bytes":
+            self.texture = value
+        elif key == "props":
+            if isinstance(value, ThingProps) and value.thing is self:
+                return
+            items = list(value.items())
+            self.clear_props()
+            props = ThingProps(self)
+            for k, v in items:
+                props[k] = v
+        else:
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        raise TypeError("ThingType keys can't be removed")
+
+    def __iter__(self):
+        yield "props"
+        yield "texture_bytes"
+
+    def __len__(self):
+        return 2
+
+    def __repr__(self):
+        return f"ThingType(props={dict(ThingProps(self))!r}, texture_bytes=<{len(self.texture)} bytes>)"
+
+    # --- flags and payloads ---
+
+    def has_flag(self, flag):
+        return bool(self.flags >> flag & 1)
+
+    def _payload_offset(self, flag):
+        offset = 0
+        for other, arity in PAYLOAD_ARITY.items():
+            if other >= flag:
+                break
+            if self.data_flags >> other & 1:
+                offset += arity
+        return offset
+
+    def get_payload(self, flag):
+        """Values of a numeric flag, as struct.unpack would return them, or None."""
+        if not self.data_flags >> flag & 1:
+            return None
+        start = self._payload_offset(flag)
+        return tuple(self.payload[start:start + PAYLOAD_ARITY[flag]])
+
+    def set_payload(self, flag, values):
+        """Stores the values of a numeric flag; returns False if they don't fit."""
+        arity = PAYLOAD_ARITY.get(flag)
+        if arity is None or not isinstance(values, (tuple, list)) or len(values) != arity:
+            return False
+        for v in values:
+            if not isinstance(v, int) or isinstance(v, bool) or not _INT32_MIN <= v <= _INT32_MAX:
+                return False
+
+        if self.payload is None:
+            self.payload = array("i")
+        start = self._payload_offset(flag)
+        if self.data_flags >> flag & 1:
+            self.payload[start:start + arity] = array("i", values)
+        else:
+            self.payload[start:start] = array("i", values)
+            self.data_flags |= 1 << flag
+        return True
+
+    def clear_payload(self, flag):
+        if not self.data_flags >> flag & 1:
+            return
+        start = self._payload_offset(flag)
+        del self.payload[start:start + PAYLOAD_ARITY[flag]]
+        self.data_flags &= ~(1 << flag)
+        if not self.data_flags:
+            self.payload = None
+
+    def clear_props(self):
+        texture = self.texture
+        self.__init__(texture)
+
+    def store_texture(self, texture):
+        """Writes an edited ThingTexture back to texture_bytes and keeps it cached."""
+        texture.source = self.texture = texture.to_bytes()
+        self.texture_cache = texture
+
+    def texture_info(self, extended=None):
+        """
+        The texture parsed as a ThingTexture, cached until texture_bytes
+        changes.
+        """
+        cached = self.texture_cache
+        if cached is None or cached.source is not self.texture or (
+            extended is not None and cached.extended != extended
+        ):
+            cached = ThingTexture.parse(
+                self.texture, outfit=self.frame_group_count is not None, extended=extended
+            )
+            self.texture_cache = cached
+        return cached
+
+
+class ThingProps(MutableMapping):
+    """
+    thing["props"] of a ThingType: the old props OrderedDict keys (flag
+    names, "<flag>_data", Width, Height, ...) mapped onto the slots.
+    """
+
+    __slots__ = ("thing",)
+
+    def __init__(self, thing):
+        self.thing = thing
+
+    def __getitem__(self, key):
+        thing = self.thing
+        if thing.extra and key in thing.extra:
+            return thing.extra[key]
+
+        flag = REVERSE_METADATA_FLAGS.get(key)
+        if flag is not None:
+            if thing.flags >> flag & 1:
+                return True
+            raise KeyError(key)
+
+        flag = DATA_KEY_FLAGS.get(key)
+        if flag is not None:
+            if flag == MARKET_FLAG:
+                if thing.market is not None:
+                    return thing.market
+                raise KeyError(key)
+            value = thing.get_payload(flag)
+            if value is not None:
+                return value
+            raise KeyError(key)
+
+        slot = TEXTURE_FIELDS.get(key)
+        if slot is not None:
+            value = getattr(thing, slot)
+            if value is not None:
+                if slot == "durations":
+                    return [tuple(value[i:i + 2]) for i in range(0, len(value), 2)]
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        thing = self.thing
+        stored = False
+
+        flag = REVERSE_METADATA_FLAGS.get(key)
+        data_flag = DATA_KEY_FLAGS.get(key)
+        slot = TEXTURE_FIELDS.get(key)
+
+        if flag is not None:
+            if value is True:
+                thing.flags |= 1 << flag
+                stored = True
+            else:
+                thing.flags &= ~(1 << flag)
+        elif data_flag is not None:
+            if data_flag == MARKET_FLAG:
+                if isinstance(value, bytes):
+                    thing.market = value
+                    stored = True
+                else:
+                    thing.market = None
+            else:
+                stored = thing.set_payload(data_flag, value)
+                if not stored:
+                    thing.clear_payload(data_flag)
+        elif slot is not None:
+            if value is None:
+                setattr(thing, slot, None)
+            elif slot == "durations":
+                try:
+                    flat = array("I")
+                    for min_dur, max_dur in value:
+                        flat.append(min_dur)
+                        flat.append(max_dur)
+                    thing.durations = flat
+                    stored = True
+                except (TypeError, ValueError, OverflowError):
+                    thing.durations = None
+            else:
+                setattr(thing, slot, value)
+                stored = True
+
+        if stored:
+            if thing.extra and key in thing.extra:
+                del thing.extra[key]
+        else:
+            if thing.extra is None:
+                thing.extra = OrderedDict()
+            thing.extra[key] = value
+
+    def __delitem__(self, key):
+        thing = self.thing
+        found = False
+        if thing.extra and key in thing.extra:
+            del thing.extra[key]
+            found = True
+
+        flag = REVERSE_METADATA_FLAGS.get(key)
+        data_flag = DATA_KEY_FLAGS.get(key)
+        slot = TEXTURE_FIELDS.get(key)
+        if flag is not None and thing.flags >> flag & 1:
+            thing.flags &= ~(1 << flag)
+            found = True
+        elif data_flag is not None:
+            if data_flag == MARKET_FLAG and thing.market is not None:
+                thing.market = None
+                found = True
+            elif thing.data_flags >> data_flag & 1:
+                thing.clear_payload(data_flag)
+                found = True
+        elif slot is not None and getattr(thing, slot) is not None:
+            setattr(thing, slot, None)
+            found = True
+
+        if not found:
+            raise KeyError(key)
+
+    def __iter__(self):
+        thing = self.thing
+        extra = thing.extra or {}
+        for flag, (name, _fmt) in METADATA_FLAGS.items():
+            if thing.flags >> flag & 1:
+                yield name
+            if flag == MARKET_FLAG:
+                if thing.market is not None:
+                    yield name + "_data"
+            elif thing.data_flags >> flag & 1:
+                yield name + "_data"
+        for key, slot in TEXTURE_FIELDS.items():
+            if getattr(thing, slot) is not None and key not in extra:
+                yield key
+        yield from extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"ThingProps({dict(self)!r})"
+
+
+class TextureError(ValueError):
+    pass
+
+
+# Header fields of one frame group; its IDs are sprite_ids[first:first + count]
+FrameGroup = namedtuple(
+    "FrameGroup",
+    "type width height crop_size layers pattern_x pattern_y pattern_z frames first count",
+)
+
+
+class ThingTexture:
+    """
+    A thing's texture bytes parsed once: the header of every frame group
+    plus all sprite IDs in one uint32 numpy array (groups back to back).
+    Edit sprite_ids (or use set_group_ids / remap) and call to_bytes() to
+    serialize it back; headers are copied as they were.
+    """
+
+    __slots__ = ("source", "outfit", "extended", "headers", "groups", "sprite_ids")
+
+    def __init__(self, source, outfit, extended, headers, groups, sprite_ids):
+        self.source = source  # texture bytes this was parsed from
+        self.outfit = outfit
+        self.extended = extended
+        self.headers = headers  # raw header bytes of each frame group
+        self.groups = groups  # FrameGroup of each group, with its ID range
+        self.sprite_ids = sprite_ids
+
+    @classmethod
+    def parse(cls, data, outfit=None, extended=None):
+        """
+        Parses texture bytes. outfit/extended=None means unknown: every
+        layout is tried and the one that uses up exactly all bytes wins
+        (what the old per-call-site parsers guessed from the leftover length).
+        Raises TextureError if nothing fits.
+        """
+        outfits = (False, True) if outfit is None else (outfit,)
+        widths = (False, True) if extended is None else (extended,)
+        for is_outfit in outfits:
+            for is_extended in widths:
+                try:
+                    return cls._parse(data, is_outfit, is_extended)
+                except (IndexError, struct.error, TextureError):
+                    continue
+        raise TextureError("Texture doesn't match any known layout.")
+
+    @classmethod
+    def _parse(cls, data, outfit, extended):
+        view = memoryview(data)
+        size = len(view)
+        id_size = 4 if extended else 2
+
+        pos = 0
+        group_count = 1
+        if outfit:
+            group_count = view[0]
+            pos = 1
+
+        headers = []
+        groups = []
+        id_chunks = []
+        id_total = 0
+        for _ in range(group_count):
+            header_start = pos
+            group_type = 0
+            if outfit:
+                group_type = view[pos]
+                pos += 1
+
+            width, height = view[pos], view[pos + 1]
+            pos += 2
+            crop_size = 0
+            if width > 1 or height > 1:
+                crop_size = view[pos]
+                pos += 1
+
+            layers, px, py, pz, frames = TEXTURE_PATTERN.unpack_from(view, pos)
+            pos += TEXTURE_PATTERN.size
+            if frames > 1:
+                pos += 6 + frames * FRAME_DURATION.size
+
+            count = width * height * layers * px * py * pz * frames
+            ids_end = pos + count * id_size
+            if ids_end > size:
+                raise TextureError("Texture is truncated.")
+
+            headers.append(bytes(view[header_start:pos]))
+            groups.append(
+                FrameGroup(group_type, width, height, crop_size, layers, px, py, pz, frames,
+                           id_total, count)
+            )
+            id_chunks.append(view[pos:ids_end])
+            id_total += count
+            pos = ids_end
+
+        if pos != size:
+            raise TextureError("Texture has trailing bytes.")
+
+        dtype = "<u4" if extended else "<u2"
+        sprite_ids = np.empty(id_total, dtype=np.uint32)
+        for group, chunk in zip(groups, id_chunks):
+            sprite_ids[group.first:group.first + group.count] = np.frombuffer(chunk, dtype=dtype)
+
+        return cls(data, outfit, extended, headers, groups, sprite_ids)
+
+    def group_ids(self, index=0):
+        """Sprite IDs of one frame group (a view into sprite_ids)."""
+        group = self.groups[index]
+        return self.sprite_ids[group.first:group.first + group.count]
+
+    def set_group_ids(self, index, ids):
+        """
+        Replaces the sprite IDs of one frame group. A different number of
+        IDs is allowed; the group header is not changed.
+        """
+        group = self.groups[index]
+        ids = np.asarray(ids, dtype=np.uint32).reshape(-1)
+        self.sprite_ids = np.concatenate(
+            (
+                self.sprite_ids[:group.first],
+                ids,
+                self.sprite_ids[group.first + group.count:],
+            )
+        )
+        delta = len(ids) - group.count
+        self.groups[index] = group._replace(count=len(ids))
+        for n in range(index + 1, len(self.groups)):
+            self.groups[n] = self.groups[n]._replace(first=self.groups[n].first + delta)
+
+    def remap(self, remap_table):
+        """
+        Applies {old_id: new_id} to every sprite ID at once; returns True if
+        anything changed.
+        """
+        if not remap_table or not len(self.sprite_ids):
+            return False
+        keys = np.fromiter(remap_table.keys(), dtype=np.int64, count=len(remap_table))
+        values = np.fromiter(remap_table.values(), dtype=np.int64, count=len(remap_table))
+        order = np.argsort(keys)
+        keys, values = keys[order], values[order]
+
+        pos = np.searchsorted(keys, self.sprite_ids)
+        pos[pos == len(keys)] = 0
+        hit = keys[pos] == self.sprite_ids
+        if not hit.any():
+            return False
+        self.sprite_ids = self.sprite_ids.copy()
+        self.sprite_ids[hit] = values[pos[hit]]
+        return True
+
+    def to_bytes(self):
+        """Serializes headers and sprite IDs back to texture bytes in one pass."""
+        if not self.extended and len(self.sprite_ids) and self.sprite_ids.max() > 0xFFFF:
+            raise TextureError("Sprite ID does not fit a non-extended DAT.")
+
+        return self.assemble(self.sprite_ids.astype("<u4" if self.extended else "<u2").tobytes())
+
+    def assemble(self, ids):
+        """Texture bytes from the headers and already packed sprite IDs (the group IDs back to back)."""
+        id_size = 4 if self.extended else 2
+        out = bytearray()
+        if self.outfit:
+            out.append(len(self.groups))
+        for header, group in zip(self.headers, self.groups):
+            out += header
+            out += ids[group.first * id_size:(group.first + group.count) * id_size]
+        return bytes(out)
+
+
+def thing_texture(thing, outfit=None, extended=None):
+    """ThingTexture of a thing: cached for a ThingType, parsed for a plain dict."""
+    if isinstance(thing, ThingType):
+        return thing.texture_info(extended)
+    return ThingTexture.parse(thing.get("texture_bytes", b""), outfit, extended)
+
+
+def store_texture(thing, texture):
+    """Saves an edited ThingTexture into a thing (ThingType or plain dict)."""
+    if isinstance(thing, ThingType):
+        thing.store_texture(texture)
+    else:
+        thing["texture_bytes"] = texture.to_bytes()
+
+
+def sprite_lookup(table):
+    """
+    {old_id: new_id} as a uint32 lookup array (new_id = lookup[old_id],
+    identity for IDs not in the table). Arrays are returned as they are.
+    """
+    if not isinstance(table, dict):
+        return np.asarray(table, dtype=np.uint32)
+    if not table:
+        return np.zeros(0, dtype=np.uint32)
+    keys = np.fromiter(table.keys(), dtype=np.int64, count=len(table))
+    values = np.fromiter(table.values(), dtype=np.int64, count=len(table))
+    lookup = np.arange(int(keys.max()) + 1, dtype=np.uint32)
+    lookup[keys] = values
+    return lookup
+
+
+def single_group_id_spans(raw, starts, ends, extended=False):
+    """
+    Header walk of many single frame group textures (items, effects,
+    missiles) stored back to back in `raw`, done with array ops instead of
+    one parse per thing. Returns (ids_pos, counts, fits): where each
+    texture's sprite IDs start in raw, how many there are, and a mask of
+    the textures whose layout uses up exactly their bytes (the others need
+    ThingTexture.parse).
+    """
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if not len(buf):
+        zeros = np.zeros(len(starts), dtype=np.int64)
+        return zeros, zeros, np.zeros(len(starts), dtype=bool)
+
+    def byte_at(pos):
+        return buf[np.minimum(pos, len(buf) - 1)].astype(np.int64)
+
+    width, height = byte_at(starts), byte_at(starts + 1)
+    pos = starts + 2 + ((width > 1) | (height > 1))
+    layers, px, py, pz, frames = (byte_at(pos + n) for n in range(TEXTURE_PATTERN.size))
+    pos = pos + TEXTURE_PATTERN.size
+    pos = pos + np.where(frames > 1, 6 + frames * FRAME_DURATION.size, 0)
+
+    counts = width * height * layers * px * py * pz * frames
+    fits = (ends - starts > TEXTURE_PATTERN.size) & (pos + counts * (4 if extended else 2) == ends)
+    return pos, counts, fits
+
+
+def _gather_sprite_ids(raw, ids_pos, counts, extended):
+    """The sprite IDs at ids_pos[n] (counts[n] of them) of every span, back to back."""
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    id_size = 4 if extended else 2
+    total = int(counts.sum())
+    if not total:
+        return np.zeros(0, dtype=np.uint32)
+    first = np.cumsum(counts) - counts
+    src = np.repeat(ids_pos - first * id_size, counts) + np.arange(total, dtype=np.int64) * id_size
+    ids = buf[src].astype(np.uint32) | buf[src + 1].astype(np.uint32) << 8
+    if extended:
+        ids |= buf[src + 2].astype(np.uint32) << 16 | buf[src + 3].astype(np.uint32) << 24
+    return ids
+
+
+def remap_sprite_ids(things, table, extended=False):
+    """
+    Rewrites the sprite IDs of every thing of every category (all outfit
+    frame groups included) through a lookup table or {old_id: new_id}.
+    IDs past the end of the table are left alone.
+
+    The textures of all things are joined into one buffer: single-group
+    ones are read with single_group_id_spans, outfits (and anything odd)
+    with ThingTexture.parse. All IDs are mapped with a single numpy take
+    and packed once; only things whose IDs changed get new texture bytes.
+    Lazy things are read from the file and only parsed if they change.
+    Returns {category: [changed thing ids]}.
+    """
+    lookup = sprite_lookup(table)
+    changed = {category: [] for category in THING_CATEGORIES}
+    if not len(lookup):
+        return changed
+
+    owners = []
+    blobs = []
+    outfit = []
+    for category in THING_CATEGORIES:
+        category_things = things.get(category, {})
+        raw_texture = getattr(category_things, "raw_texture", None)
+        for thing_id in category_things:
+            data = raw_texture(thing_id) if raw_texture else None
+            if data is None:
+                data = category_things[thing_id].get("texture_bytes", b"")
+            owners.append((category, thing_id))
+            blobs.append(data)
+            outfit.append(category == "outfits")
+    if not owners:
+        return changed
+
+    raw = b"".join(blobs)
+    lengths = np.fromiter((len(data) for data in blobs), dtype=np.int64, count=len(blobs))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    ids_pos, counts, fits = single_group_id_spans(raw, starts, ends, extended)
+    fits &= ~np.array(outfit, dtype=bool)
+
+    textures = {}
+    for n in np.flatnonzero(~fits).tolist():
+        try:
+            texture = ThingTexture.parse(blobs[n], outfit[n], extended)
+        except TextureError:
+            continue
+        if len(texture.sprite_ids):
+            textures[n] = texture
+
+    fast = np.flatnonzero(fits & (counts > 0))
+    slow = list(textures)
+    segment_owner = fast.tolist() + slow
+    if not segment_owner:
+        return changed
+    segment_len = np.concatenate(
+        (counts[fast], np.array([len(textures[n].sprite_ids) for n in slow], dtype=np.int64))
+    )
+    segment_end = np.cumsum(segment_len)
+    segment_start = segment_end - segment_len
+
+    old_ids = np.concatenate(
+        [_gather_sprite_ids(raw, ids_pos[fast], counts[fast], extended)]
+        + [textures[n].sprite_ids for n in slow]
+    )
+    new_ids = old_ids.copy()
+    inside = old_ids < len(lookup)
+    new_ids[inside] = lookup[old_ids[inside]]
+    moved = np.flatnonzero(np.add.reduceat(new_ids != old_ids, segment_start) > 0)
+    if not len(moved):
+        return changed
+    if not extended and new_ids.max() > 0xFFFF:
+        raise TextureError("Sprite ID does not fit a non-extended DAT.")
+
+    id_size = 4 if extended else 2
+    packed = new_ids.astype("<u4" if extended else "<u2").tobytes()
+    for k in moved.tolist():
+        n = segment_owner[k]
+        start, end = int(segment_start[k]), int(segment_end[k])
+        ids = packed[start * id_size:end * id_size]
+        texture = textures.get(n)
+        if texture is None:
+            # Single group: the IDs close the texture, the header stays as is
+            data = raw[starts[n]:ids_pos[n]] + ids
+        else:
+            texture.sprite_ids = new_ids[start:end]
+            data = texture.assemble(ids)
+        category, thing_id = owners[n]
+        things[category][thing_id]["texture_bytes"] = data
+        changed[category].append(thing_id)
+    return changed
+
+
+class SpriteUsageIndex:
+    """
+    Reverse index sprite ID -> things that use it.
+
+    Built once as CSR arrays: every (sprite, owner) pair sorted by sprite,
+    owner = category index << 32 | thing id, and indptr[sid]:indptr[sid + 1]
+    is the slice of one sprite. Edits don't rebuild it: the owner's base
+    pairs are masked out and its new IDs go to a small overlay. use counts
+    are kept per sprite, so is_used() and orphan checks are array lookups.
+    """
+
+    def __init__(self, things, extended=False):
+        self.things = things  # DatEditor.things (dicts or LazyThings)
+        self.extended = extended
+        self.build()
+
+    def _texture_ids(self, data, category):
+        """Unique non-zero sprite IDs of texture bytes (empty if unreadable)."""
+        try:
+            ids = ThingTexture.parse(data, category == "outfits", self.extended).sprite_ids
+        except TextureError:
+            return np.zeros(0, dtype=np.uint32)
+        ids = np.unique(ids)
+        return ids[1:] if len(ids) and ids[0] == 0 else ids
+
+    def build(self):
+        id_chunks = []
+        owner_list = []
+        lengths = []
+        self._sources = {}  # owner -> (texture bytes indexed, or None if read raw, crc32)
+        for cat_index, category in enumerate(THING_CATEGORIES):
+            things = self.things.get(category, {})
+            raw_texture = getattr(things, "raw_texture", None)
+            for thing_id in things:
+                # Unparsed lazy things are read straight from the file buffer
+                data = raw_texture(thing_id) if raw_texture else None
+                source = None
+                if data is None:
+                    source = data = things[thing_id].get("texture_bytes", b"")
+                owner = cat_index << 32 | thing_id
+                self._sources[owner] = (source, zlib.crc32(data))
+
+                try:
+                    ids = ThingTexture.parse(data, category == "outfits", self.extended).sprite_ids
+                except TextureError:
+                    continue
+                id_chunks.append(ids)
+                owner_list.append(owner)
+                lengths.append(len(ids))
+
+        sprites = np.concatenate(id_chunks) if id_chunks else np.zeros(0, dtype=np.uint32)
+        owners = np.repeat(np.array(owner_list, dtype=np.int64), lengths)
+        keep = sprites != 0
+        sprites, owners = sprites[keep], owners[keep]
+
+        # Sort by (sprite, owner) and drop repeats of a sprite inside one thing
+        order = np.lexsort((owners, sprites))
+        sprites, owners = sprites[order], owners[order]
+        if len(sprites):
+            first = np.ones(len(sprites), dtype=bool)
+            first[1:] = (sprites[1:] != sprites[:-1]) | (owners[1:] != owners[:-1])
+            sprites, owners = sprites[first], owners[first]
+
+        self._sprites = sprites
+        self._owners = owners
+        self._alive = np.ones(len(sprites), dtype=bool)
+        top = int(sprites[-1]) if len(sprites) else 0
+        self._indptr = np.searchsorted(sprites, np.arange(top + 2, dtype=np.int64))
+
+        # Base pairs of one owner, for masking them out on edits
+        self._owner_order = np.argsort(owners, kind="stable")
+        self._owner_sorted = owners[self._owner_order]
+
+        self._counts = np.bincount(sprites, minlength=top + 1).astype(np.int32)
+        self._stale = set()  # owners whose base pairs are masked out
+        self._overlay = {}  # owner -> ids added after build
+        self._extra = {}  # sprite -> owners from the overlay
+
+    def _drop(self, owner):
+        if owner not in self._stale:
+            self._stale.add(owner)
+            lo = np.searchsorted(self._owner_sorted, owner, "left")
+            hi = np.searchsorted(self._owner_sorted, owner, "right")
+            if hi > lo:
+                pairs = self._owner_order[lo:hi]
+                self._alive[pairs] = False
+                np.subtract.at(self._counts, self._sprites[pairs], 1)
+
+        ids = self._overlay.pop(owner, None)
+        if ids is not None:
+            np.subtract.at(self._counts, ids, 1)
+            for sprite_id in ids.tolist():
+                users = self._extra[sprite_id]
+                users.discard(owner)
+                if not users:
+                    del self._extra[sprite_id]
+
+    def _add(self, owner, ids):
+        if not len(ids):
+            return
+        top = int(ids[-1])
+        if top >= len(self._counts):
+            self._counts = np.concatenate(
+                (self._counts, np.zeros(top + 1 - len(self._counts), dtype=np.int32))
+            )
+        self._overlay[owner] = ids
+        np.add.at(self._counts, ids, 1)
+        for sprite_id in ids.tolist():
+            self._extra.setdefault(sprite_id, set()).add(owner)
+
+    def _reindex(self, owner, category, data):
+        self._drop(owner)
+        self._add(owner, self._texture_ids(data, category))
+        self._sources[owner] = (data, zlib.crc32(data))
+
+    def update_thing(self, category, thing_id):
+        """Re-indexes one thing after its texture changed, was added or removed."""
+        owner = THING_CATEGORIES.index(category) << 32 | thing_id
+        thing = self.things[category].get(thing_id)
+        if thing is None:
+            self._drop(owner)
+            self._sources.pop(owner, None)
+            return
+        self._reindex(owner, category, thing.get("texture_bytes", b""))
+
+    def refresh(self):
+        """
+        Picks up edits made straight to things: a thing whose texture_bytes
+        is another object with other contents is re-indexed, removed things
+        are dropped. Unparsed lazy things can't have changed and are skipped.
+        """
+        for cat_index, category in enumerate(THING_CATEGORIES):
+            things = self.things.get(category, {})
+            loaded = getattr(things, "loaded_items", None)
+            for thing_id, thing in (loaded() if loaded else things.items()):
+                owner = cat_index << 32 | thing_id
+                data = thing.get("texture_bytes", b"")
+                known = self._sources.get(owner)
+                if known is not None:
+                    if known[0] is data:
+                        continue
+                    if known[1] == zlib.crc32(data):
+                        self._sources[owner] = (data, known[1])
+                        continue
+                self._reindex(owner, category, data)
+
+        for owner in list(self._sources):
+            things = self.things.get(THING_CATEGORIES[owner >> 32], {})
+            if (owner & 0xFFFFFFFF) not in things:
+                self._drop(owner)
+                del self._sources[owner]
+
+    def _users(self, sprite_id):
+        owners = []
+        if 0 < sprite_id < len(self._indptr) - 1:
+            lo, hi = self._indptr[sprite_id], self._indptr[sprite_id + 1]
+            owners = self._owners[lo:hi][self._alive[lo:hi]].tolist()
+        owners.extend(self._extra.get(sprite_id, ()))
+        return sorted(owners)
+
+    def things_using(self, category, first, last):
+        """Sorted IDs of the things of one category using any sprite in first..last."""
+        cat_index = THING_CATEGORIES.index(category)
+        first = max(first, 1)
+        top = min(last, len(self._indptr) - 2)
+        owners = np.zeros(0, dtype=np.int64)
+        if first <= top:
+            lo, hi = self._indptr[first], self._indptr[top + 1]
+            owners = self._owners[lo:hi][self._alive[lo:hi]]
+        extra = [
+            owner
+            for sprite_id, users in self._extra.items()
+            if first <= sprite_id <= last
+            for owner in users
+        ]
+        if extra:
+            owners = np.concatenate((owners, np.array(extra, dtype=np.int64)))
+        owners = owners[(owners >> 32) == cat_index]
+        return np.unique(owners & 0xFFFFFFFF)
+
+    def where_used(self, sprite_id):
+        """[(category, thing_id), ...] of every thing that uses a sprite."""
+        return [(THING_CATEGORIES[owner >> 32], owner & 0xFFFFFFFF) for owner in self._users(sprite_id)]
+
+    def use_count(self, sprite_id):
+        """Number of things that use a sprite."""
+        if 0 < sprite_id < len(self._counts):
+            return int(self._counts[sprite_id])
+        return 0
+
+    def is_used(self, sprite_id):
+        return self.use_count(sprite_id) > 0
+
+    def use_counts(self, sprite_count):
+        """Things per sprite for IDs 0..sprite_count, as an int32 array."""
+        counts = np.zeros(sprite_count + 1, dtype=np.int32)
+        size = min(len(counts), len(self._counts))
+        counts[:size] = self._counts[:size]
+        counts[0] = 0
+        return counts
+
+    def used_sprites(self):
+        """Sorted array of every sprite ID used by some thing."""
+        return np.flatnonzero(self._counts).astype(np.uint32)
+
+    def orphans(self, sprite_count):
+        """Sprite IDs 1..sprite_count that no thing uses."""
+        return (np.flatnonzero(self.use_counts(sprite_count)[1:] == 0) + 1).astype(np.uint32)
+
+
+# Numeric payloads kept as FlagIndex columns: name -> (flag, value index)
+NUMERIC_COLUMNS = OrderedDict(
+    [
+        ("GroundSpeed", (REVERSE_METADATA_FLAGS["Ground"], 0)),
+        ("LightLevel", (REVERSE_METADATA_FLAGS["HasLight"], 0)),
+        ("LightColor", (REVERSE_METADATA_FLAGS["HasLight"], 1)),
+        ("OffsetX", (REVERSE_METADATA_FLAGS["HasOffset"], 0)),
+        ("OffsetY", (REVERSE_METADATA_FLAGS["HasOffset"], 1)),
+        ("Elevation", (REVERSE_METADATA_FLAGS["HasElevation"], 0)),
+        ("MinimapColor", (REVERSE_METADATA_FLAGS["ShowOnMinimap"], 0)),
+    ]
+)
+
+# Texture header fields kept as FlagIndex columns too (props key -> ThingType slot)
+TEXTURE_COLUMNS = OrderedDict(
+    (key, TEXTURE_FIELDS[key])
+    for key in (
+        "Width",
+        "Height",
+        "CropSize",
+        "Layers",
+        "PatternX",
+        "PatternY",
+        "PatternZ",
+        "Animation",
+        "FrameGroupCount",
+    )
+)
+
+_FLAG_SHIFTS = np.arange(len(METADATA_FLAGS), dtype=np.uint64)
+
+COMPARE_OPS = {
+    "==": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+
+def set_flag(things, thing_ids, name, values=None):
+    """
+    Sets a metadata flag on every thing in thing_ids (missing IDs are
+    skipped). A numeric flag gets `values`, or zeros if it had no data yet,
+    like DatEditor.apply_changes always did. Returns the IDs changed.
+    """
+    flag = REVERSE_METADATA_FLAGS[name]
+    arity = PAYLOAD_ARITY.get(flag)
+    if values is None and arity:
+        zeros = (0,) * arity
+    data_key = name + "_data"
+    done = []
+    for thing_id in thing_ids:
+        thing = things.get(thing_id)
+        if thing is None:
+            continue
+        if isinstance(thing, ThingType):
+            thing.flags |= 1 << flag
+            if arity and values is not None:
+                ThingProps(thing)[data_key] = tuple(values)
+            elif arity and not thing.data_flags >> flag & 1:
+                if not (thing.extra and data_key in thing.extra):
+                    thing.set_payload(flag, zeros)
+        else:
+            props = thing["props"]
+            props[name] = True
+            if arity:
+                if values is not None:
+                    props[data_key] = tuple(values)
+                elif data_key not in props:
+                    props[data_key] = zeros
+        done.append(thing_id)
+    return done
+
+
+def unset_flag(things, thing_ids, name):
+    """Removes a metadata flag and its data from things that have it set."""
+    flag = REVERSE_METADATA_FLAGS[name]
+    data_key = name + "_data"
+    done = []
+    for thing_id in thing_ids:
+        thing = things.get(thing_id)
+        if thing is None:
+            continue
+        props = thing["props"]
+        if name in props:
+            del props[name]
+            if data_key in props:
+                del props[data_key]
+            done.append(thing_id)
+    return done
+
+
+class FlagIndex:
+    """
+    Columnar flags of one category, for queries and mass edits without
+    walking props ID by ID:
+
+    - ids: thing IDs, sorted; row n of every column is ids[n]
+    - bitsets: one packed bitset (np.packbits order) per metadata flag
+    - flags: the full flag mask of every row (uint64)
+    - columns: int32 column per NUMERIC_COLUMNS entry (0 when there's no
+      data) and per TEXTURE_COLUMNS entry
+
+    Query results are packed bitsets too: combine them with & | and
+    invert(), then ids_of(). bulk_set / bulk_unset / set_column write to
+    the things and update the columns in the same call. Edits made
+    straight to things must be reported with update(ids).
+    """
+
+    def __init__(self, things):
+        self.things = things  # one category: dict or LazyThings
+        self.build()
+
+    def _read_row(self, row, thing):
+        if isinstance(thing, ThingType):
+            flags = thing.flags
+            for name, (flag, index) in NUMERIC_COLUMNS.items():
+                values = thing.get_payload(flag) if thing.data_flags >> flag & 1 else None
+                self.columns[name][row] = values[index] if values else 0
+            for name, slot in TEXTURE_COLUMNS.items():
+                self.columns[name][row] = getattr(thing, slot) or 0
+        else:
+            props = thing.get("props", {})
+            flags = 0
+            for name, flag in REVERSE_METADATA_FLAGS.items():
+                if name in props:
+                    flags |= 1 << flag
+            for name, (flag, index) in NUMERIC_COLUMNS.items():
+                values = props.get(METADATA_FLAGS[flag][0] + "_data")
+                ok = isinstance(values, (tuple, list)) and len(values) > index
+                self.columns[name][row] = values[index] if ok else 0
+            for name in TEXTURE_COLUMNS:
+                value = props.get(name)
+                self.columns[name][row] = value if isinstance(value, int) else 0
+        self.flags[row] = flags
+
+    def build(self):
+        things = self.things
+        # Lazy things are read without caching them, so building stays cheap on memory
+        peek = getattr(things, "peek", things.__getitem__)
+        self.ids = np.array(sorted(things), dtype=np.int64)
+        self.flags = np.zeros(len(self.ids), dtype=np.uint64)
+        self.columns = {
+            name: np.zeros(len(self.ids), dtype=np.int32)
+            for name in list(NUMERIC_COLUMNS) + list(TEXTURE_COLUMNS)
+        }
+        for row, thing_id in enumerate(self.ids.tolist()):
+            self._read_row(row, peek(thing_id))
+        self.present = np.packbits(np.ones(len(self.ids), dtype=bool))
+        self._pack_all()
+
+    def _pack_all(self):
+        bits = (self.flags[None, :] >> _FLAG_SHIFTS[:, None]) & np.uint64(1)
+        self.bitsets = np.packbits(bits.astype(bool), axis=1)
+        self.present = np.packbits(self._present_mask())
+
+    def _present_mask(self):
+        mask = np.zeros(len(self.ids), dtype=bool)
+        if len(self.ids):
+            mask[:] = np.unpackbits(self.present, count=len(self.ids)).astype(bool)
+        return mask
+
+    def _pack_flag(self, flag):
+        self.bitsets[flag] = np.packbits(((self.flags >> np.uint64(flag)) & np.uint64(1)).astype(bool))
+
+    def _locate(self, thing_ids):
+        thing_ids = np.asarray(thing_ids, dtype=np.int64).reshape(-1)
+        if not len(self.ids):
+            return np.zeros(len(thing_ids), dtype=np.int64), np.zeros(len(thing_ids), dtype=bool)
+        rows = np.searchsorted(self.ids, thing_ids)
+        rows[rows == len(self.ids)] = 0
+        hit = self.ids[rows] == thing_ids
+        hit &= self._present_mask()[rows]
+        return rows, hit
+
+    def rows(self, thing_ids):
+        """Rows of the given IDs; IDs not in the index are dropped."""
+        rows, hit = self._locate(thing_ids)
+        return rows[hit]
+
+    def update(self, thing_ids):
+        """Re-reads things that were changed, added or removed elsewhere."""
+        peek = getattr(self.things, "peek", self.things.__getitem__)
+        thing_ids = sorted(set(int(t) for t in thing_ids))
+        known = set(self.ids.tolist())
+        if any(t not in known and t in self.things for t in thing_ids):
+            # New rows: rebuild the arrays in ID order
+            self.build()
+            return
+
+        present = self._present_mask()
+        for thing_id in thing_ids:
+            row = int(np.searchsorted(self.ids, thing_id))
+            if row == len(self.ids) or self.ids[row] != thing_id:
+                continue
+            if thing_id in self.things:
+                self._read_row(row, peek(thing_id))
+                present[row] = True
+            else:
+                present[row] = False
+                self.flags[row] = 0
+                for column in self.columns.values():
+                    column[row] = 0
+        self.present = np.packbits(present)
+        self._pack_all()
+
+    # --- queries ---
+
+    def flag_bits(self, name):
+        """Packed bitset of the rows that have a flag set."""
+        return self.bitsets[REVERSE_METADATA_FLAGS[name]]
+
+    def compare(self, column, op, value):
+        """
+        Packed bitset of rows where column <op> value; for a payload column
+        the flag must be set too.
+        """
+        hit = np.packbits(COMPARE_OPS[op](self.columns[column], value))
+        if column in NUMERIC_COLUMNS:
+            return hit & self.bitsets[NUMERIC_COLUMNS[column][0]]
+        return hit & self.present
+
+    def id_bits(self, op, value):
+        """Packed bitset of rows whose thing ID <op> value."""
+        return np.packbits(COMPARE_OPS[op](self.ids, value)) & self.present
+
+    def bits_of(self, thing_ids):
+        """Packed bitset of the rows of the given IDs."""
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[self.rows(thing_ids)] = True
+        return np.packbits(mask)
+
+    def invert(self, bits):
+        return ~bits & self.present
+
+    def ids_of(self, bits):
+        """Thing IDs of the rows set in a packed bitset."""
+        mask = np.unpackbits(bits, count=len(self.ids)).astype(bool)
+        return self.ids[mask]
+
+    def select(self, all_of=(), none_of=(), where=()):
+        """
+        IDs with every flag in all_of, none of none_of and every
+        (column, op, value) in where, e.g.
+        select(["Pickupable"], ["Stackable"], [("GroundSpeed", ">", 150)]).
+        """
+        bits = self.present.copy()
+        for name in all_of:
+            bits &= self.flag_bits(name)
+        for name in none_of:
+            bits &= ~self.flag_bits(name)
+        for column, op, value in where:
+            bits &= self.compare(column, op, value)
+        return self.ids_of(bits)
+
+    def count(self, bits):
+        return int(np.unpackbits(bits, count=len(self.ids)).sum())
+
+    # --- mass edits ---
+
+    def bulk_set(self, thing_ids, name, values=None):
+        """Sets a flag (and its data, see set_flag) on many things at once."""
+        done = set_flag(self.things, thing_ids, name, values)
+        rows = self.rows(done)
+        flag = REVERSE_METADATA_FLAGS[name]
+        self.flags[rows] |= np.uint64(1 << flag)
+        self._pack_flag(flag)
+        if values is not None:
+            for column, (column_flag, index) in NUMERIC_COLUMNS.items():
+                if column_flag == flag and index < len(values):
+                    self.columns[column][rows] = values[index]
+        return done
+
+    def bulk_unset(self, thing_ids, name):
+        """Removes a flag and its data from many things at once."""
+        done = unset_flag(self.things, thing_ids, name)
+        rows = self.rows(done)
+        flag = REVERSE_METADATA_FLAGS[name]
+        self.flags[rows] &= ~np.uint64(1 << flag)
+        self._pack_flag(flag)
+        for column, (column_flag, _index) in NUMERIC_COLUMNS.items():
+            if column_flag == flag:
+                self.columns[column][rows] = 0
+        return done
+
+    def set_column(self, thing_ids, column, values):
+        """
+        Writes one numeric column (a scalar or one value per ID) and sets its
+        flag; the other values of the same payload are kept.
+        """
+        flag, index = NUMERIC_COLUMNS[column]
+        name = METADATA_FLAGS[flag][0]
+        arity = PAYLOAD_ARITY[flag]
+        thing_ids = np.asarray(thing_ids, dtype=np.int64).reshape(-1)
+        values = np.broadcast_to(np.asarray(values, dtype=np.int64), thing_ids.shape)
+
+        done = []
+        done_values = []
+        for thing_id, value in zip(thing_ids.tolist(), values.tolist()):
+            thing = self.things.get(thing_id)
+            if thing is None:
+                continue
+            props = thing["props"]
+            old = props.get(name + "_data")
+            payload = list(old) if isinstance(old, (tuple, list)) and len(old) == arity else [0] * arity
+            payload[index] = value
+            props[name] = True
+            props[name + "_data"] = tuple(payload)
+            done.append(thing_id)
+            done_values.append(value)
+
+        rows, hit = self._locate(done)
+        rows = rows[hit]
+        self.columns[column][rows] = np.array(done_values, dtype=np.int64)[hit]
+        self.flags[rows] |= np.uint64(1 << flag)
+        self._pack_flag(flag)
+        return done
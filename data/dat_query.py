@@ -0,0 +1,272 @@
+# Small query language over the DAT indexes, for selecting and mass editing
+# things by property instead of typing ID ranges.
+#
+#   Pickupable and not Stackable and GroundSpeed > 150
+#   (HasLight or LightLevel >= 5) and Width == 2
+#   sprite in 1000..2000 and id >= 5000
+#   Animation > 1 and not (Hangable or Rotatable)
+#
+# Terms: a flag name (set or not), <column> <op> <number>, <column> in A..B,
+# id <op> / in A..B, sprite == N / in A..B (things using those sprites).
+# Columns are the FlagIndex ones (GroundSpeed, LightLevel, LightColor,
+# OffsetX, OffsetY, Elevation, MinimapColor, Width, Height, CropSize,
+# Layers, PatternX, PatternY, PatternZ, Animation, FrameGroupCount).
+# Names are case-insensitive; ops are == != < <= > >= (= means ==).
+
+import re
+from collections import OrderedDict
+
+from dat_handler import (
+    NUMERIC_COLUMNS,
+    REVERSE_METADATA_FLAGS,
+    TEXTURE_COLUMNS,
+    ThingType,
+)
+
+COLUMN_ALIASES = {"frames": "Animation", "framegroups": "FrameGroupCount"}
+
+_TOKEN = re.compile(
+    r"\s*(?:(?P<number>-?(?:0x[0-9a-fA-F]+|\d+))(?!\w)|(?P<range>\.\.)|(?P<op>==|!=|<=|>=|<|>|=)"
+    r"|(?P<paren>[()])|(?P<name>[A-Za-z_]\w*))"
+)
+
+_FLAGS = {name.lower(): name for name in REVERSE_METADATA_FLAGS}
+_COLUMNS = {name.lower(): name for name in list(NUMERIC_COLUMNS) + list(TEXTURE_COLUMNS)}
+_COLUMNS.update(COLUMN_ALIASES)
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if not match or match.end() == pos:
+            raise QueryError(f"Unexpected character at {pos}: {text[pos:pos + 10]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "number":
+            value = int(value, 16) if "x" in value else int(value)
+        elif kind == "op" and value == "=":
+            value = "=="
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class Query:
+    """
+    A parsed query. The expression is compiled once into a tree of
+    closures; evaluate() runs it on a category's FlagIndex (and the sprite
+    usage index for sprite terms) and returns the matching IDs.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.uses_sprites = False
+        self._tokens = _tokenize(text)
+        self._pos = 0
+        if not self._tokens:
+            raise QueryError("Empty query.")
+        self._root = self._parse_or()
+        if self._pos != len(self._tokens):
+            raise QueryError(f"Unexpected {self._tokens[self._pos][1]!r}.")
+        del self._tokens
+
+    # --- parser (or > and > not > term) ---
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return (None, None)
+
+    def _next(self, kind=None, what=None):
+        token = self._peek()
+        if token[0] is None or (kind and token[0] != kind):
+            raise QueryError(f"Expected {what or kind} in {self.text!r}.")
+        self._pos += 1
+        return token[1]
+
+    def _keyword(self, word):
+        kind, value = self._peek()
+        if kind == "name" and value.lower() == word:
+            self._pos += 1
+            return True
+        return False
+
+    def _parse_or(self):
+        left = self._parse_and()
+        while self._keyword("or"):
+            right = self._parse_and()
+            left = (lambda a, b: lambda ctx: a(ctx) | b(ctx))(left, right)
+        return left
+
+    def _parse_and(self):
+        left = self._parse_not()
+        while self._keyword("and"):
+            right = self._parse_not()
+            left = (lambda a, b: lambda ctx: a(ctx) & b(ctx))(left, right)
+        return left
+
+    def _parse_not(self):
+        if self._keyword("not"):
+            inner = self._parse_not()
+            return lambda ctx: ctx.index.invert(inner(ctx))
+        return self._parse_term()
+
+    def _parse_range_or_op(self):
+        """Returns (op, value) or ("in", (first, last))."""
+        if self._keyword("in"):
+            first = self._next("number", "a number")
+            self._next("range", "'..'")
+            last = self._next("number", "a number")
+            return "in", (first, last)
+        op = self._next("op", "a comparison")
+        return op, self._next("number", "a number")
+
+    def _parse_term(self):
+        kind, value = self._peek()
+        if kind == "paren" and value == "(":
+            self._pos += 1
+            node = self._parse_or()
+            if self._next("paren", "')'") != ")":
+                raise QueryError("Expected ')'.")
+            return node
+
+        name = self._next("name", "a flag, column, id or sprite").lower()
+        if name == "id":
+            op, arg = self._parse_range_or_op()
+            if op == "in":
+                return lambda ctx: ctx.index.id_bits(">=", arg[0]) & ctx.index.id_bits("<=", arg[1])
+            return lambda ctx: ctx.index.id_bits(op, arg)
+
+        if name == "sprite":
+            op, arg = self._parse_range_or_op()
+            if op == "in":
+                first, last = arg
+            elif op == "==":
+                first = last = arg
+            elif op in (">", ">="):
+                first, last = arg + (op == ">"), 2 ** 32 - 1
+            elif op in ("<", "<="):
+                first, last = 1, arg - (op == "<")
+            else:
+                raise QueryError("sprite supports ==, <, <=, >, >= and 'in A..B'.")
+            self.uses_sprites = True
+            return lambda ctx: ctx.index.bits_of(ctx.usage.things_using(ctx.category, first, last))
+
+        if name in _COLUMNS:
+            column = _COLUMNS[name]
+            op, arg = self._parse_range_or_op()
+            if op == "in":
+                return lambda ctx: ctx.index.compare(column, ">=", arg[0]) & ctx.index.compare(
+                    column, "<=", arg[1]
+                )
+            return lambda ctx: ctx.index.compare(column, op, arg)
+
+        if name in _FLAGS:
+            flag = _FLAGS[name]
+            return lambda ctx: ctx.index.flag_bits(flag)
+
+        raise QueryError(f"Unknown flag or column {name!r}.")
+
+    # --- evaluation ---
+
+    def evaluate(self, editor, category="items"):
+        """Matching thing IDs of a category, as a sorted int64 array."""
+        ctx = _Context(editor, category, self.uses_sprites)
+        return ctx.index.ids_of(self._root(ctx) & ctx.index.present)
+
+
+class _Context:
+    __slots__ = ("index", "usage", "category")
+
+    def __init__(self, editor, category, uses_sprites):
+        self.index = editor.flag_index(category)
+        self.usage = editor.sprite_usage() if uses_sprites else None
+        self.category = category
+
+
+def select(editor, query, category="items"):
+    """IDs of the things matching a query (text or Query)."""
+    if not isinstance(query, Query):
+        query = Query(query)
+    return query.evaluate(editor, category).tolist()
+
+
+def _snapshot(thing):
+    copy = {"props": OrderedDict(thing["props"]), "texture_bytes": thing["texture_bytes"]}
+    return ThingType.from_dict(copy) if isinstance(thing, ThingType) else copy
+
+
+def mass_edit(editor, query, set_attrs=(), unset_attrs=(), columns=None, category="items"):
+    """
+    Selects things with a query and edits them as one batch: flags go
+    through DatEditor.apply_changes, columns ({"GroundSpeed": 200}) through
+    FlagIndex.set_column. Names are checked before anything is touched,
+    and if an edit fails every selected thing is put back as it was.
+    Returns the edited IDs.
+    """
+    set_attrs = [_flag_name(attr) for attr in set_attrs]
+    unset_attrs = [_flag_name(attr) for attr in unset_attrs]
+    columns = OrderedDict(
+        (_payload_column(name), value) for name, value in (columns or {}).items()
+    )
+
+    ids = select(editor, query, category)
+    if not ids:
+        return ids
+
+    things = editor.things[category]
+    snapshot = {thing_id: _snapshot(things[thing_id]) for thing_id in ids}
+    try:
+        editor.apply_changes(ids, set_attrs, unset_attrs, category)
+        index = editor.flag_index(category)
+        for column, value in columns.items():
+            index.set_column(ids, column, value)
+    except Exception:
+        for thing_id, thing in snapshot.items():
+            things[thing_id] = thing
+        editor.mark_changed(category, ids)
+        raise
+    return ids
+
+
+def _flag_name(name):
+    flag = _FLAGS.get(name.lower())
+    if flag is None:
+        raise QueryError(f"Unknown flag {name!r}.")
+    return flag
+
+
+def _payload_column(name):
+    column = _COLUMNS.get(name.lower())
+    if column not in NUMERIC_COLUMNS:
+        raise QueryError(f"{name!r} is not an editable numeric column.")
+    return column
+
+
+def parse_assignments(text):
+    """'GroundSpeed=200, LightLevel=7' -> {"GroundSpeed": 200, "LightLevel": 7}."""
+    columns = OrderedDict()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, value = part.partition("=")
+        if not sep:
+            raise QueryError(f"Expected column=value, got {part!r}.")
+        try:
+            columns[_payload_column(name.strip())] = int(value.strip(), 0)
+        except ValueError:
+            raise QueryError(f"Invalid number in {part!r}.")
+    return columns
+
+
+def is_query(text):
+    """True if text looks like a query rather than an ID list (100-200, 305)."""
+    return bool(re.search(r"[A-Za-z_]", text or ""))
@@ -1,14 +1,20 @@
 import atexit
+import hashlib
 import io
+import mmap
 import os
 import re
 import shutil
 import struct
 import sys
+import threading
 import uuid
 
+from bisect import bisect_right
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from copy import deepcopy
+from functools import partial
 
 from particleEditor import ParticleGenerator
 from shaderEditor import ShaderEditor
@@ -18,15 +24,40 @@ from looktype_generator import LookTypeGeneratorWindow
 from monster_generator import MonsterGeneratorWindow
 from spriteEditor import SliceWindow
 from spriteOptmizer import SpriteOptimizerWindow
+from spr_handler import (
+    CONVERT_CHUNK,
+    SAVE_BUFFER_SIZE,
+    SprIndex,
+    SpriteCache,
+    SpriteStore,
+    convert_sprite_records,
+    decode_rle,
+    decode_sprite_records,
+    encode_rle,
+    encode_sprite_array,
+    hash_sprite_records,
+    load_spr_part,
+    map_spr_records,
+    open_spr_buffer,
+    ordered_map,
+    patch_spr_file,
+    read_spr_header,
+    recover_spr_journal,
+    scan_spr_headers,
+    split_sprite_record,
+)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ICON_PATH = os.path.join(BASE_DIR, "..", "assets", "window")
+SPR_COMPACT_RATIO = 0.25 # Compact the .spr once this fraction of it is dead space
+SESSION_CACHE_THUMBNAILS = True # Session cache also keeps the first ID page's thumbnails
 
 from interface_utils import ToggleSwitch, ModernLabel
 
 
+import numpy as np
 from PIL import Image, ImageDraw, ImageFilter
-from PyQt6.QtCore import Qt, QTimer, QSize, QSettings, QPoint, pyqtSignal, QRect, QMetaObject, Q_ARG, QUrl
+from PyQt6.QtCore import Qt, QThread, QTimer, QSize, QSettings, QPoint, pyqtSignal, QRect, QMetaObject, Q_ARG, QUrl
 from PyQt6.QtGui import (
     QColor,
     QContextMenuEvent,
@@ -78,62 +109,22 @@ from PyQt6.QtWidgets import (
     QWidget,
 )
 
-METADATA_FLAGS = {
-    0x00: ("Ground", "<H"),
-    0x01: ("GroundBorder", ""),
-    0x02: ("OnBottom", ""),
-    0x03: ("OnTop", ""),
-    0x04: ("Container", ""),
-    0x05: ("Stackable", ""),
-    0x06: ("ForceUse", ""),
-    0x07: ("MultiUse", ""),
-    0x08: ("Writable", "<H"),
-    0x09: ("WritableOnce", "<H"),
-    0x0A: ("FluidContainer", ""),
-    0x0B: ("IsFluid", ""),
-    0x0C: ("Unpassable", ""),
-    0x0D: ("Unmoveable", ""),
-    0x0E: ("BlockMissile", ""),
-    0x0F: ("BlockPathfind", ""),
-    0x10: ("NoMoveAnimation", ""),
-    0x11: ("Pickupable", ""),
-    0x12: ("Hangable", ""),
-    0x13: ("HookVertical", ""),
-    0x14: ("HookHorizontal", ""),
-    0x15: ("Rotatable", ""),
-    0x16: ("HasLight", "<HH"),
-    0x17: ("DontHide", ""),
-    0x18: ("Translucent", ""),
-    0x19: ("HasOffset", "<hh"),
-    0x1A: ("HasElevation", "<H"),
-    0x1B: ("LyingObject", ""),
-    0x1C: ("AnimateAlways", ""),
-    0x1D: ("ShowOnMinimap", "<H"),
-    0x1E: ("LensHelp", "<H"),
-    0x1F: ("FullGround", ""),
-    0x20: ("IgnoreLook", ""),
-    0x21: ("IsCloth", "<H"),
-    0x22: ("MarketItem", None),
-    0x23: ("DefaultAction", "<H"),
-    0x24: ("Wrappable", ""),
-    0x25: ("Unwrappable", ""),
-    0x26: ("TopEffect", ""),
-    0x27: ("Usable", ""),
-    0x28: ("ChangedToExpire", "<H"),
-    0x29: ("Corpse", ""),
-    0x2A: ("PlayerCorpse", ""),
-    0x2B: ("CyclopediaItem", "<H"),
-    0x2C: ("Ammo", ""),
-    0x2D: ("ShowOffSocket", ""),
-    0x2E: ("Reportable", ""),
-    0x2F: ("UpgradeClassification", "<H"),
-    0x30: ("Wearout", ""),
-    0x31: ("ClockExpire", ""),
-    0x32: ("Expire", ""),
-    0x33: ("ExpireStop", ""),
-}
-REVERSE_METADATA_FLAGS = {info[0]: flag for flag, info in METADATA_FLAGS.items()}
-LAST_FLAG = 0xFF
+from dat_editor import DatEditor, LazyThings
+from dat_handler import (
+    METADATA_FLAGS,
+    REVERSE_METADATA_FLAGS,
+    TextureError,
+    ThingTexture,
+)
+from dat_query import QueryError, is_query, select
+from session_cache import SessionCache
+from sprite_clusters import (
+    HASH_INDEX_SUFFIX,
+    TRANSFORMS,
+    SpriteHashIndex,
+    image_tiles,
+    perceptual_hash_records,
+)
 
 
 def ob_index_to_rgb(idx):
@@ -154,573 +145,92 @@ def rgb16_to_ob_index(val):
     return max(0, min(215, ri + gi * 6 + bi * 36))
 
 
-class DatEditor:
-    def __init__(self, dat_path, extended=False):
-        self.dat_path = dat_path
-        self.signature = 0
-        self.extended = extended
-
-        self.counts = {"items": 0, "outfits": 0, "effects": 0, "missiles": 0}
-        self.things = {"items": {}, "outfits": {}, "effects": {}, "missiles": {}}
-
-    def load(self, progress_callback=None):
-        with open(self.dat_path, "rb") as f:
-            self.signature = struct.unpack("<I", f.read(4))[0]
-            item_count, outfit_count, effect_count, missile_count = struct.unpack(
-                "<HHHH", f.read(8)
-            )
-            self.counts = {
-                "items": item_count,
-                "outfits": outfit_count,
-                "effects": effect_count,
-                "missiles": missile_count,
-            }
-
-            for item_id in range(100, self.counts["items"] + 1):
-                self.things["items"][item_id] = self._parse_thing(f, "items")
-
-            for outfit_id in range(1, self.counts["outfits"] + 1):
-                self.things["outfits"][outfit_id] = self._parse_thing(f, "outfits")
-
-            for effect_id in range(1, self.counts["effects"] + 1):
-                self.things["effects"][effect_id] = self._parse_thing(f, "effects")
-
-            for missile_id in range(1, self.counts["missiles"] + 1):
-                self.things["missiles"][missile_id] = self._parse_thing(f, "missiles")
-
-    def _parse_thing(self, f, category):
-        props = OrderedDict()
-
-        # --- 1. LEITURA DAS FLAGS ---
-        while True:
-            byte = f.read(1)
-            # Se acabar o arquivo ou flag de fim (0xFF)
-            if not byte or byte[0] == LAST_FLAG:
-                break
-
-            flag = byte[0]
-
-            if flag in METADATA_FLAGS:
-                name, fmt = METADATA_FLAGS[flag]
-
-                if name == "MarketItem":
-                    # Lógica específica do Market
-                    header = f.read(8)
-                    if len(header) == 8:
-                        # header: [Category:2][TradeAs:2][ShowAs:2][NameLen:2]
-                        name_len = struct.unpack("<H", header[6:8])[0]
-                        # Resto: [Name:Len][Voc:2][Level:2] = Len + 4 bytes
-                        rest = f.read(name_len + 4)
-                        props[name] = True
-                        props[name + "_data"] = header + rest
-                else:
-                    props[name] = True
-                    if fmt:
-                        size = struct.calcsize(fmt)
-                        data = f.read(size)
-                        if len(data) < size:
-                            break
-                        props[name + "_data"] = struct.unpack(fmt, data)
-
-        texture_bytes = bytearray()
-
-        if category == "outfits":
-            b = f.read(1)
-            if not b:
-                return {"props": props, "texture_bytes": bytes(texture_bytes)}
-            texture_bytes.extend(b)
-            fg_count = b[0]
-            props["FrameGroupCount"] = fg_count
-
-            for i in range(fg_count):
-                # Type (Idle/Walk)
-                b = f.read(1)
-                texture_bytes.extend(b)
-                if i == 0:
-                    props["FrameGroupType"] = b[0]
-
-                # Width / Height
-                # Width / Height
-                b = f.read(2)
-                if len(b) < 2:
-                    return {"props": props, "texture_bytes": bytes(texture_bytes)}
-                texture_bytes.extend(b)
-                w, h = struct.unpack("<BB", b)
-
-                if i == 0:
-                    props["Width"] = w
-                    props["Height"] = h
-
-                # Crop Size (Se maior que 1x1)
-                if w > 1 or h > 1:
-                    b = f.read(1)
-                    texture_bytes.extend(b)
-                    if i == 0:
-                        props["CropSize"] = b[0]
-
-                # Headers de Animação
-                b = f.read(5)  # Layers, Px, Py, Pz, Frames
-                if len(b) < 5:
-                    return {"props": props, "texture_bytes": bytes(texture_bytes)}
-                texture_bytes.extend(b)
-                layers, px, py, pz, frames = struct.unpack("<BBBBB", b)
-
-                if i == 0:
-                    props["Layers"] = layers
-                    props["PatternX"] = px
-                    props["PatternY"] = py
-                    props["PatternZ"] = pz
-                    props["Animation"] = frames
-
-                # Animation Details (Timing)
-                if frames > 1:
-                    # Async(1) + Loop(4) + Start(1) + Durations(frames * 8)
-                    # detail_size = 1 + 4 + 1 + (frames * 8)
-                    # b = f.read(detail_size)
-                    
-                    # 1. Async
-                    b = f.read(1)
-                    texture_bytes.extend(b)
-                    props["AnimAsync"] = b[0]
-                    
-                    # 2. Loop Count
-                    b = f.read(4)
-                    texture_bytes.extend(b)
-                    props["AnimLoop"] = struct.unpack("<I", b)[0]
-                    
-                    # 3. Start Frame
-                    b = f.read(1)
-                    texture_bytes.extend(b)
-                    props["AnimStart"] = b[0]
-                    
-                    # 4. Frame Durations (8 bytes each: 4 min, 4 max)
-                    durations = []
-                    for _ in range(frames):
-                         b = f.read(8)
-                         texture_bytes.extend(b)
-                         min_dur, max_dur = struct.unpack("<II", b)
-                         durations.append((min_dur, max_dur))
-                    props["FrameDurations"] = durations
-
-                # Sprite IDs
-                total_sprites = w * h * px * py * pz * layers * frames
-                spr_size = 4 if self.extended else 2
-
-                b = f.read(total_sprites * spr_size)
-                texture_bytes.extend(b)
-
-        else:
-            # --- ITEM / EFFECT / MISSILE STRUCTURE ---
-            # Width / Height
-            b = f.read(2)
-            if len(b) < 2:
-                return {"props": props, "texture_bytes": bytes(texture_bytes)}
-            texture_bytes.extend(b)
-
-            w, h = struct.unpack("<BB", b)
-            props["Width"] = w
-            props["Height"] = h
-            props["CropSize"] = 0
-
-            # Crop Size
-            if w > 1 or h > 1:
-                b = f.read(1)
-                texture_bytes.extend(b)
-                props["CropSize"] = b[0]
-
-            # Headers
-            b = f.read(5)
-            if len(b) < 5:
-                return {"props": props, "texture_bytes": bytes(texture_bytes)}
-            texture_bytes.extend(b)
-            layers, px, py, pz, frames = struct.unpack("<BBBBB", b)
-
-            props["Layers"] = layers
-            props["PatternX"] = px
-            props["PatternY"] = py
-            props["PatternZ"] = pz
-            props["Animation"] = frames
-
-            # Animation Details
-            if frames > 1:
-                # detail_size = 1 + 4 + 1 + (frames * 8)
-                # b = f.read(detail_size)
-
-                # 1. Async
-                b = f.read(1)
-                texture_bytes.extend(b)
-                props["AnimAsync"] = b[0]
-
-                # 2. Loop Count
-                b = f.read(4)
-                texture_bytes.extend(b)
-                props["AnimLoop"] = struct.unpack("<I", b)[0]
-
-                # 3. Start Frame
-                b = f.read(1)
-                texture_bytes.extend(b)
-                props["AnimStart"] = b[0]
-
-                # 4. Frame Durations
-                durations = []
-                for _ in range(frames):
-                     b = f.read(8)
-                     texture_bytes.extend(b)
-                     min_dur, max_dur = struct.unpack("<II", b)
-                     durations.append((min_dur, max_dur))
-                props["FrameDurations"] = durations
-
-            # Sprite IDs
-            total_sprites = w * h * px * py * pz * layers * frames
-            spr_size = 4 if self.extended else 2
-
-            b = f.read(total_sprites * spr_size)
-            texture_bytes.extend(b)
-
-        return {"props": props, "texture_bytes": bytes(texture_bytes)}
-
-    def apply_changes(
-        self, item_ids, attributes_to_set, attributes_to_unset, category="items"
-    ):
-        if category not in self.things:
-            return
-
-        for item_id in item_ids:
-            if item_id not in self.things[category]:
-                continue
-
-            item_props = self.things[category][item_id]["props"]
-
-            for attr in attributes_to_set:
-                if attr in REVERSE_METADATA_FLAGS:
-                    item_props[attr] = True
-                    flag_val = REVERSE_METADATA_FLAGS[attr]
-                    _name, fmt = METADATA_FLAGS[flag_val]
-                    if fmt:
-                        data_key = attr + "_data"
-                        if data_key not in item_props:
-                            num_bytes = struct.calcsize(fmt)
-                            num_values = len(struct.unpack(fmt, b"\x00" * num_bytes))
-                            item_props[data_key] = tuple([0] * num_values)
-
-            for attr in attributes_to_unset:
-                if attr in REVERSE_METADATA_FLAGS and attr in item_props:
-                    del item_props[attr]
-                    if attr + "_data" in item_props:
-                        del item_props[attr + "_data"]
-
-    def save(self, output_path):
-        with open(output_path, "wb") as f:
-            f.write(struct.pack("<I", self.signature))
-
-            count_items = self.counts["items"]
-            count_outfits = self.counts["outfits"]
-            count_effects = self.counts["effects"]
-            count_missiles = self.counts["missiles"]
-
-            f.write(
-                struct.pack(
-                    "<HHHH", count_items, count_outfits, count_effects, count_missiles
-                )
-            )
-
-            def write_category(start_id, end_id, category_name):
-                for tid in range(start_id, end_id + 1):
-                    thing = self.things[category_name].get(tid)
-
-                    if thing and len(thing.get("texture_bytes", b"")) > 0:
-                        self._write_thing_properties(f, thing["props"])
-
-                        f.write(struct.pack("<B", LAST_FLAG))
-
-                        f.write(thing["texture_bytes"])
-                    else:
-                        f.write(struct.pack("<B", LAST_FLAG))
-                        f.write(b"\x01\x01\x01\x01\x01\x01\x01")
-
-                        if self.extended:
-                            f.write(b"\x00\x00\x00\x00")
-                        else:
-                            f.write(b"\x00\x00")
-
-            #  Items
-            write_category(100, count_items, "items")
-
-            #  Outfits
-            write_category(1, count_outfits, "outfits")
-
-            #  Effects
-            write_category(1, count_effects, "effects")
-
-            #  Missiles (
-            write_category(1, count_missiles, "missiles")
-
-    def _write_thing_properties(self, f, props):
-        for flag, (name, fmt) in METADATA_FLAGS.items():
-            if name in props:
-                if props[name] is True:
-                    f.write(struct.pack("<B", flag))
-
-                    data_key = name + "_data"
-                    if data_key in props:
-                        data = props[data_key]
-
-                        if fmt:
-                            try:
-                                f.write(struct.pack(fmt, *data))
-                            except Exception as e:
-                                print(f"Erro salvando flag {name} ({hex(flag)}): {e}")
-                        else:
-                            if isinstance(data, bytes):
-                                f.write(data)
-                            else:
-                                print(f"Erro: Dados de {name} não são bytes.")
-
-    @staticmethod
-    def extract_sprite_ids_from_texture_bytes(texture_bytes):
-        if not texture_bytes:
-            return []
-
-        def try_parse(offset):
-            ids = []
-            try:
-                w, h = struct.unpack_from("<BB", texture_bytes, offset)
-                curr = offset + 2
-                if w > 1 or h > 1:
-                    curr += 1
-                layers, px, py, pz, frames = struct.unpack_from(
-                    "<BBBBB", texture_bytes, curr
-                )
-                curr += 5
-
-                if frames > 1:
-                    curr += 1 + 4 + 1 + (frames * 8)
-
-                total = w * h * px * py * pz * layers * frames
-                remaining = len(texture_bytes) - curr
-
-                if total == 0:
-                    return []
-
-                spr_size = remaining // total
-                if spr_size not in (2, 4):
-                    return []
-
-                fmt = "<I" if spr_size == 4 else "<H"
-                for _ in range(total):
-                    val = struct.unpack_from(fmt, texture_bytes, curr)[0]
-                    ids.append(val)
-                    curr += spr_size
-                return ids
-            except:
-                return []
-
-        result = try_parse(0)
-        if result:
-            return result
-
-        result_outfit = try_parse(2)
-        if result_outfit:
-            return result_outfit
-
-        return []
-
-    @staticmethod
-    def extract_sprite_ids_from_outfit_texture(texture_bytes):
-
-        if not texture_bytes or len(texture_bytes) < 3:
-            return []
-
-        try:
-            fg_count = texture_bytes[0]
-            offset = 1
-
-            for i in range(fg_count):
-                if offset >= len(texture_bytes):
-                    return []
-
-                fg_type = texture_bytes[offset]
-                offset += 1
-
-                if offset + 2 > len(texture_bytes):
-                    return []
-                w, h = struct.unpack_from("BB", texture_bytes, offset)
-                offset += 2
-
-                if w > 1 or h > 1:
-                    offset += 1
-
-                if offset + 5 > len(texture_bytes):
-                    return []
-                layers, px, py, pz, frames = struct.unpack_from(
-                    "<BBBBB", texture_bytes, offset
-                )
-                offset += 5
-
-                if frames > 1:
-                    offset += 1 + 4 + 1 + (frames * 8)
-
-                if i == 0:
-                    total_sprites = w * h * px * py * pz * layers * frames
-                    remaining = len(texture_bytes) - offset
-
-                    if total_sprites == 0:
-                        return []
-
-                    if remaining >= total_sprites * 4:
-                        spr_size = 4
-                    elif remaining >= total_sprites * 2:
-                        spr_size = 2
-                    else:
-                        print(
-                            f"DEBUG Outfit: Not enough bytes. Need {total_sprites * 2}, have {remaining}"
-                        )
-                        return []
-
-                    fmt = "<I" if spr_size == 4 else "<H"
-                    ids = []
-
-                    for _ in range(total_sprites):
-                        if offset + spr_size > len(texture_bytes):
-                            break
-                        sprite_id = struct.unpack_from(fmt, texture_bytes, offset)[0]
-                        ids.append(sprite_id)
-                        offset += spr_size
-
-                    print(
-                        f"DEBUG Outfit: w={w}, h={h}, layers={layers}, frames={frames}, total_sprites={total_sprites}, extracted={len(ids)}"
-                    )
-                    return ids
-                else:
-                    total_sprites = w * h * px * py * pz * layers * frames
-                    if total_sprites > 0:
-                        remaining = len(texture_bytes) - offset
-                        spr_size = 4 if remaining >= total_sprites * 4 else 2
-                        offset += total_sprites * spr_size
-
-            return []
-
-        except Exception as e:
-            print(f"DEBUG: Error extracting outfit sprites: {e}")
-            import traceback
-
-            traceback.print_exc()
-            return []
-
-    @staticmethod
-    def extract_outfit_group_sprites(texturebytes, target_fg_index=0, extended=True):
-
-        if not texturebytes or len(texturebytes) < 3:
-            return []
-
-        try:
-            fgcount = texturebytes[0]
-            offset = 1
-
-            for i in range(fgcount):
-                if offset >= len(texturebytes):
-                    return []
-
-                # Frame Group Type
-                fgtype = texturebytes[offset]
-                offset += 1
-
-                # Width/Height
-                if offset + 2 > len(texturebytes):
-                    return []
-                w, h = struct.unpack_from("BB", texturebytes, offset)
-                offset += 2
-
-                # Crop size (se w>1 ou h>1)
-                if w > 1 or h > 1:
-                    if offset + 1 > len(texturebytes):
-                        return []
-                    offset += 1
-
-                # Layers, PatternX/Y/Z, Frames
-                if offset + 5 > len(texturebytes):
-                    return []
-                layers, px, py, pz, frames = struct.unpack_from(
-                    "BBBBB", texturebytes, offset
-                )
-                offset += 5
-
-                # Animation details
-                if frames > 1:
-                    detailsize = 1 + 4 + 1 + (frames * 8)
-                    if offset + detailsize > len(texturebytes):
-                        return []
-                    offset += detailsize
-
-                # Calcular total de sprites
-                totalsprites = w * h * px * py * pz * layers * frames
-                if totalsprites <= 0:
-                    continue
-
-                # Se não é o grupo alvo, pular os IDs
-                if i != target_fg_index:
-                    sprsize = 4 if extended else 2
-                    offset += totalsprites * sprsize
-                    continue
-
-                # Extrair IDs do grupo alvo
-                remaining = len(texturebytes) - offset
-                sprsize = 4 if remaining >= totalsprites * 4 else 2
-                fmt = "I" if sprsize == 4 else "H"
-
-                ids = []
-                for _ in range(totalsprites):
-                    if offset + sprsize > len(texturebytes):
-                        break
-                    spriteid = struct.unpack_from(fmt, texturebytes, offset)[0]
-                    ids.append(spriteid)
-                    offset += sprsize
-
-                return ids
-
-            return []
-        except Exception as e:
-            print(f"ERROR extract_outfit_group_sprites: {e}")
-            return []
-
-
 class MultiFileWrapper:
-    """Wraps multiple file parts into a single seekable stream."""
-    def __init__(self, file_paths):
+    """
+    Wraps multiple file parts into a single seekable stream.
+    Part boundaries are kept as cumulative offsets (found with bisect) and
+    reads fill one preallocated buffer; with use_mmap=True every part is
+    memory-mapped and reads are plain slice copies.
+    """
+    def __init__(self, file_paths, use_mmap=False):
         self.file_paths = sorted(file_paths) # Ensure numerical/lexical order
         self.files = [open(p, "rb") for p in self.file_paths]
-        self.sizes = [os.path.getsize(p) for p in self.file_paths]
-        self.total_size = sum(self.sizes)
+        self.sizes = [os.fstat(f.fileno()).st_size for f in self.files]
+        # starts[i] = absolute position of part i, starts[-1] = total size
+        self.starts = [0]
+        for size in self.sizes:
+            self.starts.append(self.starts[-1] + size)
+        self.total_size = self.starts[-1]
         self.current_pos = 0
 
+        self.maps = [
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap and size > 0 else None
+            for f, size in zip(self.files, self.sizes)
+        ]
+        self._file_pos = [0] * len(self.files) # Avoids a seek per sequential read
+
     def read(self, size=-1):
-        if size == -1:
-            size = self.total_size - self.current_pos
-        
+        remaining = self.total_size - self.current_pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+
         if size == 0:
             return b""
 
-        # Locate start file index and offset
+        # Fast path: the whole read is inside one part
         file_idx, offset_in_file = self._get_location(self.current_pos)
-        
-        data = b""
-        remaining = size
+        if offset_in_file + size <= self.sizes[file_idx]:
+            self.current_pos += size
+            part_map = self.maps[file_idx]
+            if part_map is not None:
+                return part_map[offset_in_file:offset_in_file + size]
+            return self._read_part(file_idx, offset_in_file, size)
+
+        data = bytearray(size)
+        read = self.readinto(data)
+        return bytes(data) if read == size else bytes(data[:read])
+
+    def readinto(self, buffer):
+        """Fills buffer from the current position; returns the bytes read."""
+        view = memoryview(buffer).cast("B")
+        size = min(len(view), self.total_size - self.current_pos)
+        done = 0
+        if size <= 0:
+            return 0
+
+        file_idx, offset_in_file = self._get_location(self.current_pos)
+        while done < size:
+            chunk_size = min(size - done, self.sizes[file_idx] - offset_in_file)
+            target = view[done:done + chunk_size]
+
+            part_map = self.maps[file_idx]
+            if part_map is not None:
+                target[:] = part_map[offset_in_file:offset_in_file + chunk_size]
+                read = chunk_size
+            else:
+                f = self.files[file_idx]
+                if self._file_pos[file_idx] != offset_in_file:
+                    f.seek(offset_in_file)
+                read = f.readinto(target) or 0
+                self._file_pos[file_idx] = offset_in_file + read
+
+            done += read
+            if read < chunk_size:
+                break # Part shrank on disk
 
-        while remaining > 0 and file_idx < len(self.files):
-            f = self.files[file_idx]
-            f.seek(offset_in_file)
-            
-            chunk_size = min(remaining, self.sizes[file_idx] - offset_in_file)
-            chunk = f.read(chunk_size)
-            data += chunk
-            remaining -= len(chunk)
-            
-            self.current_pos += len(chunk)
-            
             # Move to next file
             file_idx += 1
             offset_in_file = 0 # Start of next file
-            
+
+        self.current_pos += done
+        return done
+
+    def _read_part(self, file_idx, offset_in_file, size):
+        f = self.files[file_idx]
+        if self._file_pos[file_idx] != offset_in_file:
+            f.seek(offset_in_file)
+        data = f.read(size)
+        self._file_pos[file_idx] = offset_in_file + len(data)
         return data
 
     def seek(self, offset, whence=0):
@@ -738,206 +248,676 @@ class MultiFileWrapper:
         return self.current_pos
 
     def close(self):
+        for part_map in self.maps:
+            if part_map is not None:
+                part_map.close()
+        self.maps = [None] * len(self.files)
         for f in self.files:
             f.close()
-            
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     def _get_location(self, absolute_pos):
-        accumulated = 0
-        for i, size in enumerate(self.sizes):
-            if absolute_pos < accumulated + size:
-                return i, absolute_pos - accumulated
-            accumulated += size
-        return len(self.files) - 1, self.sizes[-1] # End of last file
+        if not self.files:
+            raise ValueError("No file parts to read.")
+        # Last part whose start is <= absolute_pos, skipping empty parts
+        file_idx = bisect_right(self.starts, absolute_pos, 0, len(self.files)) - 1
+        if absolute_pos >= self.total_size:
+            return len(self.files) - 1, self.sizes[-1] # End of last file
+        return file_idx, absolute_pos - self.starts[file_idx]
 
 
 class SprEditor:
     
-    def __init__(self, spr_source, transparency=False, sprite_size=32):
+    def __init__(
+        self, spr_source, transparency=False, sprite_size=32, use_mmap=True,
+        cache_budget=64 * 1024 * 1024,
+    ):
         self.spr_source = spr_source # Can be path (str) or list of paths (list)
         self.transparency = transparency
         self.sprite_size = sprite_size
+        self.use_mmap = use_mmap # False copies the whole file into RAM instead
         self.signature = 0
         self.sprite_count = 0
-        self.sprites_data = {}
+        self.part_ranges = [] # (first_id, last_id) of each part of a partitioned SPR
+        self.index = SprIndex.empty()
+        self.cache = SpriteCache(cache_budget) # Decoded images, bytes budget
+        self.sprites_data = SpriteStore.empty()
+        self.hash_index = None # SpriteHashIndex, see sprite_hash_index()
+        self.sprites_data.on_write = self._sprite_written
+        self.thumbnails = None # (sorted ids, pixels) atlas from a session cache
+        self.renumbered = False # drop_sprites() changed the IDs: only a full save fits
         self.modified = False
 
-
-    def load(self, progress_callback=None):
+    def load(self, progress_callback=None, index=None):
+        """index: SessionCache sections of this file (see index_sections), single files only."""
         # Handle partitioned vs single file
         if isinstance(self.spr_source, list):
              self._load_partitioned(self.spr_source, progress_callback)
         elif os.path.exists(self.spr_source):
-             self._load_single(self.spr_source, progress_callback)
+             self._load_single(self.spr_source, progress_callback, index)
+
+    def index_sections(self):
+        """Header and offset table as SessionCache sections ({} for partitioned SPRs)."""
+        if isinstance(self.spr_source, list) or self.index.parts is not None:
+            return {}
+        return {
+            "spr.header": np.array([self.signature, len(self.index)], dtype=np.uint32),
+            "spr.offsets": self.index.offsets.copy(),
+            "spr.lengths": self.index.lengths.copy(),
+        }
+
+    def close(self):
+        """Releases the file mappings. Sprites are not readable afterwards."""
+        self.sprites_data.close()
+        self.thumbnails = None # views of a SessionCache mapping
     
-    def _load_single(self, path, progress_callback=None):
+    def thumbnail_records(self, sprite_ids):
+        """(ids, records) of the non-empty sprites among sprite_ids, copied out of the store."""
+        ids = np.unique(np.asarray(sprite_ids, dtype=np.int64))
+        ids = ids[(ids > 0) & (ids <= self.sprite_count)].tolist()
+        records = [bytes(self.sprites_data.get(i, b"")) for i in ids]
+        kept = [n for n, record in enumerate(records) if record]
+        return [ids[n] for n in kept], [records[n] for n in kept]
+
+    def thumbnail_sections(self, ids, records):
+        """
+        Records from thumbnail_records decoded as SessionCache sections (a
+        thumbnail atlas). Only reads the given records, so any thread may
+        run it while the sprites are edited.
+        """
+        return {
+            "thumbs.meta": np.array([self.sprite_size, int(self.transparency)], dtype=np.uint32),
+            "thumbs.ids": np.array(ids, dtype=np.uint32),
+            "thumbs.pixels": decode_sprite_records(records, self.sprite_size, self.transparency),
+        }
+
+    def attach_thumbnails(self, sections):
+        """Serves get_sprite from a cached atlas while the sprites are unchanged."""
+        meta = sections.get("thumbs.meta")
+        if meta is None or meta.tolist() != [self.sprite_size, int(self.transparency)]:
+            return
+        self.thumbnails = (sections["thumbs.ids"], sections["thumbs.pixels"])
+
+    def _thumbnail(self, sprite_id):
+        if self.thumbnails is None or sprite_id in self.sprites_data.overlay:
+            return None
+        ids, pixels = self.thumbnails
+        row = int(np.searchsorted(ids, sprite_id))
+        if row == len(ids) or ids[row] != sprite_id:
+            return None
+        size = self.sprite_size
+        return Image.frombytes("RGBA", (size, size), pixels[row].tobytes())
+
+    def _load_single(self, path, progress_callback=None, index=None):
         try:
+            if recover_spr_journal(path):
+                print(f"SPR: rolled back an interrupted save of {path}")
+                index = None # The cache was made for the file before the rollback
+
             with open(path, "rb") as f:
-                header = f.read(8)
-                if len(header) < 8:
-                    raise ValueError("Invalid SPR file.")
+                if index and "spr.header" in index:
+                    self.signature, self.sprite_count = (int(v) for v in index["spr.header"])
+                    self.index = SprIndex(index["spr.offsets"], index["spr.lengths"])
+                else:
+                    self.signature, self.sprite_count = read_spr_header(f)
 
-                self.signature, self.sprite_count = struct.unpack("<II", header)
+                    file_size = os.fstat(f.fileno()).st_size
+                    self.index = SprIndex.read(f, self.sprite_count, file_size)
+                buffer = open_spr_buffer(f, self.use_mmap)
 
-                offsets = []
-                for _ in range(self.sprite_count):
-                    offsets.append(struct.unpack("<I", f.read(4))[0])
+            self._set_store(SpriteStore([buffer], self.index))
 
-                file_size = f.seek(0, 2)
-                total_iter = len(offsets)
-                
-                for i, offset in enumerate(offsets):
-                    if progress_callback and i % 5000 == 0:
-                         progress_callback(i, total_iter)
-                         
-                    sprite_id = i + 1
-                    if offset == 0:
-                        self.sprites_data[sprite_id] = b""
-                        continue
-
-                    next_offset = 0
-                    for j in range(i + 1, len(offsets)):
-                        if offsets[j] != 0:
-                            next_offset = offsets[j]
-                            break
-
-                    if next_offset == 0:
-                        size = file_size - offset
-                    else:
-                        size = next_offset - offset
+            if progress_callback:
+                progress_callback(self.sprite_count, self.sprite_count)
 
-                    f.seek(offset)
-                    self.sprites_data[sprite_id] = f.read(size)
-                    
         except Exception as e:
             print(f"Error loading SPR: {e}")
             raise
 
-    def _load_partitioned(self, paths, progress_callback=None):
-        # Reset
-        self.sprite_count = 0
-        self.sprites_data = {}
-        
-        total_files = len(paths)
-        
-        current_global_id = 0
-        
-        for file_idx, path in enumerate(paths):
+    def _load_partitioned(self, paths, progress_callback=None, workers=None):
+        # Headers first: exact total and global ID range of every part
+        try:
+            headers = scan_spr_headers(paths)
+        except Exception as e:
+            print(f"Error reading SPR part headers: {e}")
+            raise
+
+        total = sum(count for _, count, _ in headers)
+        loaded = 0
+        lock = threading.Lock()
+
+        def load_part(path, count):
+            nonlocal loaded
             try:
-                with open(path, "rb") as f:
-                    header = f.read(8)
-                    sig, count = struct.unpack("<II", header)
-                    
-                    if file_idx == 0:
-                        self.signature = sig
-                    
-                    # Read offsets
-                    offsets = []
-                    for _ in range(count):
-                        offsets.append(struct.unpack("<I", f.read(4))[0])
-                        
-                    file_size = f.seek(0, 2)
-                    
-                    # Read Sprites
-                    for i, offset in enumerate(offsets):
-                        # Global ID calculation
-                        current_global_id += 1
-                        
-                        if progress_callback and current_global_id % 5000 == 0:
-                             # Roughly estimate total? We don't know total count yet easily without pre-read.
-                             # Just show current count
-                             progress_callback(current_global_id, 0) 
-
-                        if offset == 0:
-                            self.sprites_data[current_global_id] = b""
-                            continue
-
-                        next_offset = 0
-                        for j in range(i + 1, len(offsets)):
-                            if offsets[j] != 0:
-                                next_offset = offsets[j]
-                                break
-
-                        if next_offset == 0:
-                            size = file_size - offset
-                        else:
-                            size = next_offset - offset
-
-                        f.seek(offset)
-                        self.sprites_data[current_global_id] = f.read(size)
-            
+                result = load_spr_part(path, count, self.use_mmap)
             except Exception as e:
                 print(f"Error loading part {path}: {e}")
-                # Continue or raise? raise to warn user
-                raise 
-        
-        self.sprite_count = current_global_id
+                raise
+
+            with lock:
+                loaded += count
+                if progress_callback:
+                    progress_callback(loaded, total)
+            return result
+
+        # Parts are indexed in parallel: file reads release the GIL
+        if workers is None:
+            workers = min(len(paths), os.cpu_count() or 4, 8)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [
+                pool.submit(load_part, path, count)
+                for path, (_, count, _) in zip(paths, headers)
+            ]
+
+        results = []
+        errors = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            for _, buffer in results:
+                if isinstance(buffer, mmap.mmap):
+                    buffer.close()
+            raise errors[0]
+
+        self.signature = headers[0][0] if headers else 0
+        self.sprite_count = total
+        self.part_ranges = [(first, first + count - 1) for _, count, first in headers]
+        self.index = SprIndex.concat([index for index, _ in results])
+        self._set_store(SpriteStore([buffer for _, buffer in results], self.index))
+
+    def _set_store(self, store):
+        self.sprites_data.close()
+        self.cache.clear()
+        self.thumbnails = None
+        self.renumbered = False
+        self.hash_index = None
+        # Any write into the store (replace_sprite, optimizer...) drops the cached image
+        store.on_write = self._sprite_written
+        self.sprites_data = store
+
+    def _sprite_written(self, sprite_id):
+        self.cache.invalidate(sprite_id)
+        if self.hash_index is not None:
+            self.hash_index.mark_stale(sprite_id)
+
+    def _reload(self, keep_hashes=True):
+        """load() after writing our own file: same sprites, so the hash index is kept."""
+        hash_index = self.hash_index
+        self.load()
+        if keep_hashes and hash_index is not None and len(hash_index) == self.sprite_count:
+            self.hash_index = hash_index
+
+    def _source_paths(self):
+        if isinstance(self.spr_source, list):
+            return self.spr_source
+        return [self.spr_source]
+
+    def _is_source_path(self, path):
+        for src in self._source_paths():
+            if os.path.exists(src) and os.path.exists(path) and os.path.samefile(src, path):
+                return True
+        return False
 
     # Removed old load body... keeping save method below
-    def save(self, output_path, target_sprite_size=0):
-        
-        with open(output_path, "wb") as f:
-            f.write(struct.pack("<II", self.signature, self.sprite_count))
+    def save(self, output_path, target_sprite_size=0, progress_callback=None, workers=None):
+        # Sprites are read straight from the source file, so it can't be
+        # truncated while writing: overwrite it through a temp file instead.
+        overwrite_source = self._is_source_path(output_path)
+        write_path = output_path + ".tmp" if overwrite_source else output_path
 
-            current_offset = 8 + (self.sprite_count * 4)
+        records = None
+        if target_sprite_size > 0 and target_sprite_size != self.sprite_size:
+            records = self._converted_records(target_sprite_size, workers)
+
+        with open(write_path, "wb", buffering=SAVE_BUFFER_SIZE) as f:
+            f.write(struct.pack("<II", self.signature, self.sprite_count))
 
             offsets_start_pos = f.tell()
             f.write(b"\x00\x00\x00\x00" * self.sprite_count)
 
-            final_offsets = []
-
-            for sprite_id in range(1, self.sprite_count + 1):
-                # Get raw data
-                raw_data = self.sprites_data.get(sprite_id, b"")
-                
-                # Conversion Logic
-                final_data = raw_data
-                if target_sprite_size > 0 and target_sprite_size != self.sprite_size:
-                    img = self.get_sprite(sprite_id) # Decode current
-                    if img:
-                        # Resize
-                        img_resized = img.resize((target_sprite_size, target_sprite_size), Image.NEAREST)
-                        # Encode with new size context
-                        # We need to temporarily set self.sprite_size to target_size for correct encoding?
-                        # Or pass size to encode.
-                        # Let's adjust _encode methods to use image size.
-                        if self.transparency: 
-                             # 10.98+ typically (variable size support usually implies extended/transp)
-                             final_data = self._encode_1098_rgba(img_resized)
-                        else:
-                             # Standard
-                             final_data = self._encode_standard(img_resized)
-                    else:
-                        final_data = b""
-
-                if not final_data:
-                    final_offsets.append(0)
-                else:
-                    final_offsets.append(current_offset)
-                    f.write(final_data)
-                    current_offset += len(final_data)
+            # Unchanged sprites are copied from the source as-is
+            final_offsets = self.sprites_data.write_payloads(
+                f,
+                self.sprite_count,
+                8 + (self.sprite_count * 4),
+                records=records,
+                progress_callback=progress_callback,
+            )
 
             f.seek(offsets_start_pos)
-            for off in final_offsets:
-                f.write(struct.pack("<I", off))
+            f.write(final_offsets.astype("<u4").tobytes())
 
-    def get_sprite(self, sprite_id):
-        raw_data = self.sprites_data.get(sprite_id)
-        if not raw_data:
-            return None
+        if progress_callback:
+            progress_callback(self.sprite_count, self.sprite_count)
+
+        if overwrite_source:
+            self.sprites_data.close()
+            os.replace(write_path, output_path)
+
+            resized = target_sprite_size > 0 and target_sprite_size != self.sprite_size
+            if target_sprite_size > 0:
+                self.sprite_size = target_sprite_size
+            self.spr_source = output_path
+            self._reload(keep_hashes=not resized)
+            self.modified = False
+
+    def save_incremental(self, output_path=None, progress_callback=None):
+        """
+        Saves only the edited sprites into the loaded SPR: their payloads are
+        appended and their offset entries rewritten (see patch_spr_file).
+        Falls back to a full save() when that's not possible (other target
+        file, partitioned SPR, new sprites past the end of the file).
+        Returns True when the file was patched in place.
+        """
+        if output_path is None:
+            output_path = self.spr_source
 
-        start_idx = 0
         if (
-            len(raw_data) >= 3
-            and raw_data[0] == 0xFF
-            and raw_data[1] == 0x00
-            and raw_data[2] == 0xFF
+            isinstance(self.spr_source, list)
+            or not self._is_source_path(output_path)
+            or self.sprite_count > len(self.index)
+            or self.renumbered
         ):
-            start_idx = 3
+            self.save(output_path, progress_callback=progress_callback)
+            return False
+
+        records = {
+            sprite_id: bytes(self.sprites_data.overlay[sprite_id])
+            for sprite_id in self.sprites_data.dirty_ids()
+        }
+        if records:
+            # The mapping is dropped first: Windows can't grow a mapped file
+            self.sprites_data.close()
+            try:
+                patch_spr_file(self.spr_source, records, progress_callback)
+            finally:
+                self._reload()
+
+        self.modified = False
+        return True
+
+    def dead_space(self):
+        """Bytes of the loaded SPR no longer used by any sprite (single file only)."""
+        if isinstance(self.spr_source, list) or not os.path.exists(self.spr_source):
+            return 0
+
+        exact = self.sprites_data.record_lengths()
+        _, first = np.unique(self.index.offsets, return_index=True)
+        used = int(exact[first].sum(dtype=np.int64))
+        data_start = 8 + len(self.index) * 4
+        return max(0, os.path.getsize(self.spr_source) - data_start - used)
+
+    def compact(self, progress_callback=None):
+        """Rewrites the loaded SPR without dead space (temp file + rename)."""
+        self.save(self.spr_source, progress_callback=progress_callback)
+
+    def drop_sprites(self, sprite_ids):
+        """
+        Removes sprites and renumbers the rest densely, keeping their order.
+        Returns the old -> new lookup table (uint32, index = old ID, 0 for
+        dropped IDs) to pass to DatEditor.remap_sprites. Nothing is written
+        until the next save().
+        """
+        lookup = np.zeros(self.sprite_count + 1, dtype=np.uint32)
+        keep = np.ones(self.sprite_count + 1, dtype=bool)
+        keep[0] = False
+        drop = np.asarray(list(sprite_ids), dtype=np.int64)
+        keep[drop[(drop >= 1) & (drop <= self.sprite_count)]] = False
+
+        keep_ids = np.flatnonzero(keep)
+        lookup[keep_ids] = np.arange(1, len(keep_ids) + 1, dtype=np.uint32)
+        if len(keep_ids) == self.sprite_count:
+            return lookup
+
+        self.index = self.sprites_data.renumber(keep_ids)
+        if self.hash_index is not None:
+            self.hash_index.keep(keep_ids)
+        self.sprite_count = len(keep_ids)
+        self.part_ranges = [(1, self.sprite_count)] if self.part_ranges else []
+        self.cache.clear()
+        self.thumbnails = None
+        self.renumbered = True
+        self.modified = True
+        return lookup
+
+    def _converted_records(self, target_sprite_size, workers=None):
+        """
+        Yields every sprite record resized to target_sprite_size, in ID order.
+        Chunks of IDs are converted in a process pool (workers=0 converts in
+        this process).
+        """
+        convert = partial(
+            convert_sprite_records,
+            src_size=self.sprite_size,
+            dst_size=target_sprite_size,
+            transparency=self.transparency,
+        )
+
+        def chunks():
+            for start in range(1, self.sprite_count + 1, CONVERT_CHUNK):
+                end = min(start + CONVERT_CHUNK, self.sprite_count + 1)
+                yield [bytes(self.sprites_data.get(i, b"")) for i in range(start, end)]
+
+        if workers == 0 or self.sprite_count <= CONVERT_CHUNK:
+            for chunk in chunks():
+                yield from convert(chunk)
+            return
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for converted in ordered_map(executor, convert, chunks(), workers * 2):
+                yield from converted
+
+    def get_sprite(self, sprite_id):
+        img = self.cache.get(sprite_id)
+        if img is not None:
+            return img
+
+        img = self._thumbnail(sprite_id)
+        if img is None:
+            img = self._decode_raw(self.sprites_data.get(sprite_id))
+
+        # Cached images are shared: callers must copy before drawing on them
+        if img is not None:
+            self.cache.put(sprite_id, img)
+        return img
+
+    def get_sprites(self, sprite_ids, workers=0):
+        """
+        Decodes many sprites at once into an (N, S, S, 4) uint8 RGBA array,
+        in the order of sprite_ids. Empty/missing sprites are transparent.
+        workers > 0 (None = one per CPU) spreads large batches over a
+        process pool; the default decodes in this process.
+        """
+        sprite_ids = [int(i) for i in sprite_ids]
+        size = self.sprite_size
+        out = np.zeros((len(sprite_ids), size, size, 4), dtype=np.uint8)
+
+        pending = []
+        for n, sprite_id in enumerate(sprite_ids):
+            img = self.cache.get(sprite_id)
+            if img is not None and img.size == (size, size):
+                out[n] = np.asarray(img)
+            else:
+                pending.append(n)
+
+        if not pending:
+            return out
+
+        if workers == 0 or len(pending) <= CONVERT_CHUNK:
+            records = [self.sprites_data.get(sprite_ids[n]) for n in pending]
+            if len(pending) == len(sprite_ids):
+                decode_sprite_records(records, size, self.transparency, out=out)
+            else:
+                out[pending] = decode_sprite_records(records, size, self.transparency)
+            return out
+
+        decode = partial(decode_sprite_records, sprite_size=size, transparency=self.transparency)
+
+        def chunks():
+            for start in range(0, len(pending), CONVERT_CHUNK):
+                yield [
+                    bytes(self.sprites_data.get(sprite_ids[n], b""))
+                    for n in pending[start:start + CONVERT_CHUNK]
+                ]
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            start = 0
+            for decoded in ordered_map(executor, decode, chunks(), workers * 2):
+                out[pending[start:start + len(decoded)]] = decoded
+                start += len(decoded)
+        return out
+
+    def _map_unique_records(self, fn, workers=None, progress_callback=None):
+        """
+        Runs fn(records) over every distinct non-empty sprite record, in
+        chunks of CONVERT_CHUNK on a process pool (workers=0 or a single
+        CPU runs in this process). Sprites that share an offset share a
+        record and copies elsewhere in the file are matched by a digest,
+        so each record is mapped once. Records are never gathered here:
+        pool workers read their chunk from the file (map_spr_records) and
+        only unsaved edits are sent along. Returns (owners, results): the
+        chunk results in order, and owners[id - 1] = position of the
+        sprite's record in them (-1 for empty sprites).
+        """
+        count = self.sprite_count
+        store = self.sprites_data
+        index = store.index
+        owners = np.full(count, -1, dtype=np.int64)
+
+        # Sprites at the same (part, offset) share a record
+        rows = min(count, len(index))
+        offsets = index.offsets[:rows].astype(np.int64)
+        lengths = store.record_lengths()[:rows]
+        in_file = (offsets > 0) & (lengths > 0)
+        edited = np.array(
+            sorted(i for i, data in store.overlay.items() if data and i <= count), dtype=np.int64
+        )
+        in_file[[i - 1 for i in store.overlay if i <= rows]] = False
+        key = offsets
+        if index.parts is not None:
+            key = (index.parts[:rows].astype(np.int64) << 32) | offsets
+        _, first, by_offset = np.unique(key[in_file], return_index=True, return_inverse=True)
+        file_rows = np.flatnonzero(in_file)[first]
+
+        # Copies of one record at different offsets: a digest of its bytes,
+        # read through the file mapping, tells them apart
+        candidates = np.concatenate([file_rows + 1, edited])
+        digests = np.concatenate([
+            store.record_digests(file_rows, lengths[file_rows]),
+            np.array(
+                [hashlib.blake2b(store.overlay[i], digest_size=16).digest() for i in edited.tolist()],
+                dtype="S16",
+            ),
+        ])
+        _, first, by_digest = np.unique(digests, return_index=True, return_inverse=True)
+        order = np.argsort(first)  # records in file order, unsaved edits last
+        position = np.empty(len(first), dtype=np.int64)
+        position[order] = np.arange(len(first))
+        owner = position[by_digest]
+        owners[in_file] = owner[by_offset]
+        owners[edited - 1] = owner[len(file_rows):]
+
+        record_ids = candidates[first[order]].tolist()
+        record_rows = first[order]
+        file_rows = file_rows[record_rows[record_rows < len(file_rows)]]
+        total = len(record_ids)
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+        if workers <= 1 or total <= CONVERT_CHUNK:
+            executor = None
+            mapped = map(
+                fn,
+                (
+                    [store.get(i) for i in record_ids[start:start + CONVERT_CHUNK]]
+                    for start in range(0, total, CONVERT_CHUNK)
+                ),
+            )
+        else:
+            paths = self.spr_source if isinstance(self.spr_source, list) else [self.spr_source]
+            parts = index.parts[file_rows] if index.parts is not None else None
+
+            def jobs():
+                for start in range(0, total, CONVERT_CHUNK):
+                    end = start + CONVERT_CHUNK
+                    chunk = slice(start, min(end, len(file_rows)))
+                    extra = [bytes(store.overlay[i]) for i in record_ids[max(start, len(file_rows)):end]]
+                    yield (
+                        paths,
+                        parts[chunk] if parts is not None else None,
+                        offsets[file_rows[chunk]],
+                        lengths[file_rows[chunk]],
+                        extra,
+                    )
 
-        if start_idx + 2 <= len(raw_data):
-            start_idx += 2
+            executor = ProcessPoolExecutor(max_workers=workers)
+            mapped = ordered_map(executor, partial(map_spr_records, fn), jobs(), workers * 2)
 
-        sprite_content = raw_data[start_idx:]
+        results = []
+        try:
+            done = 0
+            for result in mapped:
+                results.append(result)
+                done = min(done + CONVERT_CHUNK, total)
+                if progress_callback:
+                    progress_callback(done, total)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return owners, results
+
+    def pixel_digests(self, workers=None, progress_callback=None):
+        """
+        Hashes the decoded pixels of every sprite (see hash_sprite_records).
+        Returns (empty, digests) indexed by sprite ID - 1; identical records
+        are decoded once (see _map_unique_records).
+        """
+        owners, results = self._map_unique_records(
+            partial(hash_sprite_records, sprite_size=self.sprite_size, transparency=self.transparency),
+            workers,
+            progress_callback,
+        )
+        empty = np.ones(self.sprite_count, dtype=bool)
+        digests = np.zeros(self.sprite_count, dtype="S16")
+        if results:
+            used = owners >= 0
+            empty[used] = np.concatenate([r[0] for r in results])[owners[used]]
+            digests[used] = np.concatenate([r[1] for r in results])[owners[used]]
+        return empty, digests
+
+    def perceptual_hashes(self, workers=None, progress_callback=None):
+        """
+        dHash/aHash of every sprite and its mirror, flip and 180 degree
+        variants (see sprite_clusters.perceptual_hash_records), indexed by
+        sprite ID - 1. Returns (dhash, ahash, visible): two (N, 4) uint64
+        arrays and the visible pixel count (0 for empty sprites).
+        """
+        owners, results = self._map_unique_records(
+            partial(perceptual_hash_records, sprite_size=self.sprite_size, transparency=self.transparency),
+            workers,
+            progress_callback,
+        )
+        dhash = np.zeros((self.sprite_count, len(TRANSFORMS)), dtype=np.uint64)
+        ahash = np.zeros((self.sprite_count, len(TRANSFORMS)), dtype=np.uint64)
+        visible = np.zeros(self.sprite_count, dtype=np.int32)
+        if results:
+            used = owners >= 0
+            dhash[used] = np.concatenate([r[0] for r in results])[owners[used]]
+            ahash[used] = np.concatenate([r[1] for r in results])[owners[used]]
+            visible[used] = np.concatenate([r[2] for r in results])[owners[used]]
+        return dhash, ahash, visible
+
+    def _hash_cache(self):
+        if isinstance(self.spr_source, list) or not os.path.exists(self.spr_source):
+            return None
+        try:
+            return SessionCache(
+                self.spr_source,
+                suffix=HASH_INDEX_SUFFIX,
+                sprite_size=self.sprite_size,
+                transparency=self.transparency,
+            )
+        except OSError as e:
+            print(f"Sprite hash cache unavailable: {e}")
+            return None
+
+    def sprite_hash_index(self, progress_callback=None):
+        """
+        Perceptual-hash index of the SPR (see SpriteHashIndex). Read from the
+        cache file next to the SPR when it still matches, else built in bulk
+        and saved there; later calls only re-hash sprites written since.
+        """
+        cache = None
+        if self.hash_index is None:
+            cache = self._hash_cache()
+            sections = cache.read() if cache else None
+            index = SpriteHashIndex.from_sections(sections) if sections else None
+            if cache:
+                cache.close()
+            if index is None or len(index) != len(self.index):
+                index = SpriteHashIndex.build(self, progress_callback=progress_callback)
+            else:
+                # Unsaved edits aren't in the file the cache was made from
+                for sprite_id in self.sprites_data.dirty_ids():
+                    index.mark_stale(sprite_id)
+            self.hash_index = index
+
+        index = self.hash_index
+        index.refresh(self)
+        if not index.persisted and not self.sprites_data.dirty_ids() and not self.renumbered:
+            cache = cache or self._hash_cache()
+            if cache and cache.write(index.sections()):
+                index.persisted = True
+        return index
+
+    def find_similar(self, image, limit=20, transforms=True):
+        """
+        Sprites that look like an image (PIL or RGBA array). Bigger images
+        are cut into sprite tiles (see image_tiles). Returns
+        [((row, column), [SearchMatch, ...]), ...], one entry per visible tile.
+        """
+        if isinstance(image, Image.Image):
+            image = np.asarray(image.convert("RGBA"))
+        tiles, positions = image_tiles(image, self.sprite_size)
+        index = self.sprite_hash_index()
+        return [
+            (position, index.search(tile, limit, transforms=transforms))
+            for position, tile in zip(positions, tiles)
+        ]
+
+    def put_sprites(self, sprite_ids, pixels, workers=0):
+        """
+        Encodes an (N, S, S, 4) RGBA array back into the sprites sprite_ids
+        (the batch version of replace_sprite). workers works as in get_sprites.
+        """
+        sprite_ids = [int(i) for i in sprite_ids]
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        size = self.sprite_size
+        if pixels.shape != (len(sprite_ids), size, size, 4):
+            raise ValueError(
+                f"Expected an array of shape {(len(sprite_ids), size, size, 4)}, got {pixels.shape}."
+            )
+        if sprite_ids and min(sprite_ids) < 1:
+            raise ValueError("Sprite IDs start at 1.")
+
+        if workers == 0 or len(sprite_ids) <= CONVERT_CHUNK:
+            records = encode_sprite_array(pixels, self.transparency)
+        else:
+            encode = partial(encode_sprite_array, transparency=self.transparency)
+            chunks = (
+                pixels[start:start + CONVERT_CHUNK]
+                for start in range(0, len(pixels), CONVERT_CHUNK)
+            )
+            workers = workers or os.cpu_count() or 1
+            records = []
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for encoded in ordered_map(executor, encode, chunks, workers * 2):
+                    records.extend(encoded)
+
+        last_id = max(sprite_ids, default=0)
+        if last_id > self.sprite_count:
+            for i in range(self.sprite_count + 1, last_id + 1):
+                self.sprites_data[i] = b""
+            self.sprite_count = last_id
+
+        for sprite_id, record in zip(sprite_ids, records):
+            self.sprites_data[sprite_id] = record
+        if sprite_ids:
+            self.modified = True
+
+    def _decode_raw(self, raw_data):
+        if not raw_data:
+            return None
+
+        _color_key, sprite_content = split_sprite_record(raw_data)
 
         if self.transparency:
             return self._decode_1098_rgba(sprite_content)
@@ -980,173 +960,35 @@ class SprEditor:
         self.modified = True
 
     def _decode_standard(self, data):
-        
         try:
-            w, h = self.sprite_size, self.sprite_size
-            img = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-            pixels = img.load()
-            p = 0
-            x = 0
-            y = 0
-            drawn = 0
-            total_pixels = w * h
-            while p < len(data) and drawn < total_pixels:
-                if p + 4 > len(data):
-                    break
-                trans, colored = struct.unpack_from("<HH", data, p)
-                p += 4
-                drawn += trans
-                current = y * w + x + trans
-                y, x = divmod(current, w)
-                if p + colored * 3 > len(data):
-                    break
-                for _ in range(colored):
-                    if y >= h:
-                        break
-                    pixels[x, y] = (data[p], data[p + 1], data[p + 2], 255)
-                    p += 3
-                    x += 1
-                    drawn += 1
-                    if x >= w:
-                        x = 0
-                        y += 1
-            return img
+            return self._array_to_image(decode_rle(data, self.sprite_size, 3))
         except:
             return None
 
     def _encode_standard(self, image):
-        
-        pixels = image.load()
-        width, height = image.size
-
-        output = bytearray()
-
-        transparent_count = 0
-        colored_pixels = []
-
-        for y in range(height):
-            for x in range(width):
-                r, g, b, a = pixels[x, y]
-
-                is_transparent = a < 10
-
-                if is_transparent:
-                    if colored_pixels:
-                        output.extend(
-                            struct.pack("<HH", transparent_count, len(colored_pixels))
-                        )
-                        for cr, cg, cb in colored_pixels:
-                            output.extend(bytes([cr, cg, cb]))
-
-                        transparent_count = 0
-                        colored_pixels = []
-
-                    transparent_count += 1
-                else:
-                    colored_pixels.append((r, g, b))
-
-        if colored_pixels or transparent_count > 0:
-            output.extend(struct.pack("<HH", transparent_count, len(colored_pixels)))
-            for cr, cg, cb in colored_pixels:
-                output.extend(bytes([cr, cg, cb]))
-
-        return output
+        return encode_rle(self._image_to_array(image), 3, 10)
 
     def _decode_1098_rgba(self, data):
-
         try:
-            w, h = self.sprite_size, self.sprite_size
-            img = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-            pixels = img.load()
-
-            x = 0
-            y = 0
-            p = 0
-            total_pixels = w * h
-            drawn = 0
-
-            while p + 4 <= len(data) and drawn < total_pixels:
-                transparent, colored = struct.unpack_from("<HH", data, p)
-                p += 4
-
-                drawn += transparent
-                for _ in range(transparent):
-                    x += 1
-                    if x >= w:
-                        x = 0
-                        y += 1
-                        if y >= h:
-                            break
-
-                if p + colored * 4 > len(data):
-                    break
-
-                for _ in range(colored):
-                    if y >= h:
-                        break
-
-                    r = data[p]
-                    g = data[p + 1]
-                    b = data[p + 2]
-                    a = data[p + 3]
-                    p += 4
-
-                    if a == 0 and (r != 0 or g != 0 or b != 0):
-                        a = 255
-
-                    pixels[x, y] = (r, g, b, a)
-
-                    x += 1
-                    drawn += 1
-                    if x >= w:
-                        x = 0
-                        y += 1
-                        if y >= h:
-                            break
-
-            return img
-
+            return self._array_to_image(decode_rle(data, self.sprite_size, 4))
         except Exception as e:
             print("DEBUG: error in _decode_1098_rgba:", e)
             return None
 
-    def _encode_1098_rgba(self, image):
-
-        pixels = image.load()
-        width, height = image.size
-
-        output = bytearray()
-
-        transparent_count = 0
-        colored_pixels = []
-
-        for y in range(height):
-            for x in range(width):
-                r, g, b, a = pixels[x, y]
-
-                is_transparent = a == 0
-
-                if is_transparent:
-                    if colored_pixels:
-                        output.extend(
-                            struct.pack("<HH", transparent_count, len(colored_pixels))
-                        )
-                        for cr, cg, cb, ca in colored_pixels:
-                            output.extend(bytes([cr, cg, cb, ca]))
-
-                        transparent_count = 0
-                        colored_pixels = []
-
-                    transparent_count += 1
-                else:
-                    colored_pixels.append((r, g, b, a))
+    @staticmethod
+    def _array_to_image(pixels):
+        # Shares the array memory; PIL copies it only if the image is modified
+        h, w = pixels.shape[:2]
+        return Image.frombuffer("RGBA", (w, h), pixels, "raw", "RGBA", 0, 1)
 
-        if colored_pixels or transparent_count > 0:
-            output.extend(struct.pack("<HH", transparent_count, len(colored_pixels)))
-            for cr, cg, cb, ca in colored_pixels:
-                output.extend(bytes([cr, cg, cb, ca]))
+    def _encode_1098_rgba(self, image):
+        return encode_rle(self._image_to_array(image), 4, 1)
 
-        return output
+    @staticmethod
+    def _image_to_array(image):
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        return np.asarray(image)
 
 
 def pil_to_qpixmap(pil_image):
@@ -1648,11 +1490,45 @@ class PropertiesDialog(QDialog):
         if self.parent_tab:
             self.parent_tab.apply_changes()
 
+class SpriteSearchWorker(QThread):
+    """Reverse image search off the UI thread: builds the hash index on first use, then searches."""
+
+    progress = pyqtSignal(int, int)
+    finished_search = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, spr_editor, image):
+        super().__init__()
+        self.spr = spr_editor
+        self.image = image
+
+    def run(self):
+        try:
+            self.spr.sprite_hash_index(progress_callback=lambda done, total: self.progress.emit(done, total))
+            results = self.spr.find_similar(self.image)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.finished_search.emit(results)
+
+
 class DatSprTab(QWidget):
+    # Background loading: worker threads -> main thread.
+    # Every load gets a generation number so results of an older load are dropped.
+    sig_load_progress = pyqtSignal(int, str, int, int)  # generation, "dat"/"spr", current, total
+    sig_dat_ready = pyqtSignal(int, object)
+    sig_spr_ready = pyqtSignal(int, object)
+    sig_load_failed = pyqtSignal(int, str, str)  # generation, "dat"/"spr", message
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.editor = None  #  DatEditor
         self.spr = None  #  SprEditor
+        self.load_generation = 0
+        self.spr_loading = False
+        self.session_cache = None
+        self.session_cache_hit = False
+        self.image_search_worker = None  # SpriteSearchWorker of find_sprite_by_image
         self._kept_image = None
         self.current_preview_sprite_list = []
         self.current_preview_index = 0
@@ -1685,6 +1561,11 @@ class DatSprTab(QWidget):
         self.properties_dialog = None # Initialize to None
         self.numeric_sliders = {}
         
+        self.sig_load_progress.connect(self.on_load_progress)
+        self.sig_dat_ready.connect(self.on_dat_ready)
+        self.sig_spr_ready.connect(self.on_spr_ready)
+        self.sig_load_failed.connect(self.on_load_failed)
+
         self.build_ui()
         self.settings = QSettings("TibiaItemManager", "DatSprEditor")
         self.load_settings()
@@ -1860,8 +1741,13 @@ class DatSprTab(QWidget):
         actions_layout.addWidget(lbl_id)
 
         self.id_entry = QLineEdit()
-        self.id_entry.setPlaceholderText("ID")
-        self.id_entry.setFixedWidth(60)
+        self.id_entry.setPlaceholderText("ID, 100-200 or query")
+        self.id_entry.setToolTip(
+            "IDs (100, 200-250) or a query, e.g.\n"
+            "Pickupable and not Stackable and GroundSpeed > 150\n"
+            "sprite in 1000..2000 or (HasLight and Width == 2)"
+        )
+        self.id_entry.setFixedWidth(220)
         self.id_entry.setStyleSheet("background-color: #3e3e50; border: 1px solid #5b9bd5; border-radius: 4px; color: white; padding: 2px; font-weight: bold;")
         self.id_entry.returnPressed.connect(self.load_ids_from_entry)
         actions_layout.addWidget(self.id_entry)
@@ -2319,6 +2205,14 @@ class DatSprTab(QWidget):
         sprite_go_btn.setStyleSheet("background-color: #4a90e2; color: white; border-radius: 4px; font-weight: bold;")
         sprite_go_btn.clicked.connect(self.goto_sprite_id)
         sprite_goto_layout.addWidget(sprite_go_btn)
+
+        sprite_find_btn = QPushButton("🔍")
+        sprite_find_btn.setFixedSize(36, 28)
+        sprite_find_btn.setCursor(Qt.CursorShape.PointingHandCursor)
+        sprite_find_btn.setToolTip("Find sprites that look like an image (PNG, single or multi-tile)")
+        sprite_find_btn.setStyleSheet("background-color: #4a90e2; color: white; border-radius: 4px; font-weight: bold;")
+        sprite_find_btn.clicked.connect(self.find_sprite_by_image)
+        sprite_goto_layout.addWidget(sprite_find_btn)
         
         sph_layout.addWidget(sprite_goto_frame)
         sprites_layout.addWidget(sprite_header)
@@ -2372,6 +2266,7 @@ class DatSprTab(QWidget):
         self.context_menu.addAction("Export", self.on_context_export)
         self.context_menu.addAction("Replace", self.on_context_replace)
         self.context_menu.addAction("Clear", self.on_context_delete)
+        self.context_menu.addAction("Where Used", self.on_context_where_used)
         self.right_click_target = None
 
         self.id_buttons = {}
@@ -2636,6 +2531,7 @@ class DatSprTab(QWidget):
             self.editor.things[current_cat_key][target_id]["texture_bytes"] = (
                 new_texture_bytes
             )
+            self.editor.mark_changed(current_cat_key, [target_id])
 
             self.prepare_preview_for_current_ids(current_cat_key)
             self.show_preview_at_index(self.current_preview_index)
@@ -2672,6 +2568,7 @@ class DatSprTab(QWidget):
             if target_id in self.editor.things[cat_key]:
                  current_props = self.editor.things[cat_key][target_id]["props"]
                  current_props.update(new_props)
+                 self.editor.mark_changed(cat_key, [target_id])
                  self.load_ids_from_entry() # Refresh props UI
 
         new_sprite_ids = []
@@ -2713,6 +2610,7 @@ class DatSprTab(QWidget):
              )
 
         self.editor.things[cat_key][target_id]["texture_bytes"] = new_texture_bytes
+        self.editor.mark_changed(cat_key, [target_id])
 
         if self.spr:
              self.sprite_page = (self.spr.sprite_count - 1) // self.sprites_per_page
@@ -2883,38 +2781,18 @@ class DatSprTab(QWidget):
         return cat_map.get(self.category_combo.currentText(), "items")
 
     def rebuild_texture_bytes(self, original_bytes, new_sprite_ids):
+        fmt = "<u4" if self.editor.extended else "<u2"
         if not original_bytes:
             header = b"\x01\x01\x01\x01\x01\x01\x01"
-        else:
-            offset = 0
-            width, height = struct.unpack_from("<BB", original_bytes, offset)
-            offset += 2
-
-            if width > 1 or height > 1:
-                offset += 1
-
-            layers, px, py, pz, frames = struct.unpack_from(
-                "<BBBBB", original_bytes, offset
-            )
-            offset += 5
-
-            anim_detail_size = 0
-            if frames > 1:
-                anim_detail_size = 1 + 4 + 1 + (frames * 8)
-
-            offset += anim_detail_size
-
-            header = original_bytes[:offset]
-
-        ids_data = bytearray()
-
-        is_extended = self.editor.extended
-        fmt = "<I" if is_extended else "<H"
-
-        for sid in new_sprite_ids:
-            ids_data.extend(struct.pack(fmt, int(sid)))
+            return header + np.asarray(new_sprite_ids, dtype=np.int64).astype(fmt).tobytes()
 
-        return header + ids_data
+        try:
+            texture = ThingTexture.parse(original_bytes, extended=self.editor.extended)
+            texture.set_group_ids(0, new_sprite_ids)
+            return texture.to_bytes()
+        except TextureError as e:
+            print(f"Could not rebuild texture: {e}")
+            return original_bytes
 
     def show_context_menu(self, event, item_id, context_type):
         self.right_click_target = {"id": item_id, "type": context_type}
@@ -3021,6 +2899,7 @@ class DatSprTab(QWidget):
                     "props": OrderedDict(),
                     "texture_bytes": minimal_texture,
                 }
+                self.editor.mark_changed(current_cat_key, [target_id])
 
                 self.refresh_id_list()
                 self.load_single_id(target_id)
@@ -3028,11 +2907,69 @@ class DatSprTab(QWidget):
                 self.status_label.setStyleSheet("color: green;")
 
         elif target_type == "sprite_list":
-            QMessageBox.information(
-                self,
-                "Not Implemented",
-                "Sprite clearing requires SPR write logic.\nImplement 'replace_sprite' first.",
-            )
+            if not self.spr or not 0 < target_id <= self.spr.sprite_count:
+                return
+
+            if self.editor:
+                users = self.editor.sprite_usage().where_used(target_id)
+                if users:
+                    reply = QMessageBox.warning(
+                        self,
+                        "Sprite In Use",
+                        f"Sprite {target_id} is used by {len(users)} thing(s):\n"
+                        f"{self.format_sprite_users(users)}\n\nClear it anyway?",
+                        QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                    )
+                    if reply != QMessageBox.StandardButton.Yes:
+                        return
+
+            self.spr.sprites_data[target_id] = b""
+            self.spr.modified = True
+
+            self.refresh_sprite_list()
+            if self.selected_sprite_id == target_id:
+                self.show_preview_at_index(self.current_preview_index)
+            self.status_label.setText(f"Sprite {target_id} cleared.")
+            self.status_label.setStyleSheet("color: green;")
+
+    def format_sprite_users(self, users, limit=20):
+        names = {"items": "Item", "outfits": "Outfit", "effects": "Effect", "missiles": "Missile"}
+        lines = [f"{names[category]} {thing_id}" for category, thing_id in users[:limit]]
+        if len(users) > limit:
+            lines.append(f"... and {len(users) - limit} more")
+        return "\n".join(lines)
+
+    def on_context_where_used(self):
+        if not self.right_click_target or not self.editor:
+            return
+
+        target_id = self.right_click_target["id"]
+        usage = self.editor.sprite_usage()
+
+        if self.right_click_target["type"] == "sprite_list":
+            users = usage.where_used(target_id)
+            if users:
+                text = f"Sprite {target_id} is used by {len(users)} thing(s):\n{self.format_sprite_users(users)}"
+            else:
+                text = f"Sprite {target_id} is not used by any thing."
+        else:
+            # Things sharing at least one sprite with the selected ID
+            cat_key = self.get_current_category_key()
+            thing = self.editor.things[cat_key].get(target_id)
+            if thing is None:
+                return
+            users = set()
+            for group in range(thing["props"].get("FrameGroupCount") or 1):
+                for sprite_id in np.unique(self.editor.thing_sprite_ids(cat_key, thing, group)).tolist():
+                    users.update(usage.where_used(sprite_id))
+            users.discard((cat_key, target_id))
+            users = sorted(users)
+            if users:
+                text = f"ID {target_id} shares sprites with {len(users)} thing(s):\n{self.format_sprite_users(users)}"
+            else:
+                text = f"No other thing uses the sprites of ID {target_id}."
+
+        QMessageBox.information(self, "Where Used", text)
 
     def insert_new_id(self):
         if not self.editor:
@@ -3051,6 +2988,7 @@ class DatSprTab(QWidget):
             "texture_bytes": b"\x01\x01\x01\x01\x01\x01\x01\x00\x00\x00\x00"
         }
         self.editor.counts[cat_key] = new_id
+        self.editor.mark_changed(cat_key, [new_id])
 
         self.refresh_id_list()
         self.load_single_id(new_id)
@@ -3080,6 +3018,7 @@ class DatSprTab(QWidget):
                 "props": OrderedDict(),
                 "texture_bytes": minimal_texture,
             }
+            self.editor.mark_changed(cat_key, [target_id])
             
             self.refresh_id_list()
             self.load_single_id(target_id)
@@ -3122,6 +3061,7 @@ class DatSprTab(QWidget):
         if new_props:
             current_props = self.editor.things[cat_key][target_id]["props"]
             current_props.update(new_props)
+            self.editor.mark_changed(cat_key, [target_id])
             self.load_ids_from_entry()
 
         new_sprite_ids = []
@@ -3161,6 +3101,7 @@ class DatSprTab(QWidget):
             )
 
         self.editor.things[cat_key][target_id]["texture_bytes"] = new_texture_bytes
+        self.editor.mark_changed(cat_key, [target_id])
 
         # Navigate to last sprite page to show the newly imported sprite
         self.sprite_page = (self.spr.sprite_count - 1) // self.sprites_per_page
@@ -3266,6 +3207,7 @@ class DatSprTab(QWidget):
                 self.editor.counts["items"] = new_id
 
         if inserted_count > 0:
+            self.editor.mark_changed("items", ids_to_insert)
             self.status_label.setText(f"{inserted_count} ID(s) successfully inserted.")
             self.status_label.setStyleSheet("color: green;")
             self.refresh_id_list()
@@ -3343,6 +3285,8 @@ class DatSprTab(QWidget):
                 }
                 emptied_count += 1
 
+        self.editor.mark_changed("items", ids_to_delete)
+
         status_message = ""
         if emptied_count > 0:
             status_message += f"{emptied_count} IDs were cleared. "
@@ -3546,14 +3490,11 @@ class DatSprTab(QWidget):
             if self.spr and item_id in self.editor.things[current_cat_key]:
                 item = self.editor.things[current_cat_key][item_id]
 
-                if current_cat_key == "outfits":
-                    sprite_ids = DatEditor.extract_sprite_ids_from_outfit_texture(item["texture_bytes"])
-                else:
-                    sprite_ids = DatEditor.extract_sprite_ids_from_texture_bytes(item["texture_bytes"])
+                sprite_ids = self.editor.thing_sprite_ids(current_cat_key, item)
 
-                if sprite_ids and sprite_ids[0] > 0:
+                if len(sprite_ids) and sprite_ids[0] > 0:
                     try:
-                        img = self.spr.get_sprite(sprite_ids[0])
+                        img = self.spr.get_sprite(int(sprite_ids[0]))
                         if img:
                             img_resized = img.resize((48, 48), Image.NEAREST)
                             pixmap = pil_to_qpixmap(img_resized)
@@ -3793,6 +3734,79 @@ class DatSprTab(QWidget):
         self.sprite_page = min(self.sprite_page + 10, max_page)
         self.refresh_sprite_list()
 
+    def find_sprite_by_image(self):
+        """
+        Reverse image search: ranked sprite IDs that look like a PNG, and
+        the things using them. Runs in a SpriteSearchWorker; the results
+        open in a dialog when it finishes.
+        """
+        if not self.spr or (self.image_search_worker and self.image_search_worker.isRunning()):
+            return
+
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Find Sprites by Image", "", "Image Files (*.png *.bmp)"
+        )
+        if not file_path:
+            return
+
+        try:
+            image = Image.open(file_path).convert("RGBA")
+        except Exception as e:
+            QMessageBox.critical(self, "Find by Image", f"Could not search the image:\n{e}")
+            return
+
+        # First search of this SPR: hashes come from the cache file or a bulk build
+        self.show_loading("Indexing sprites..." if self.spr.hash_index is None else "Searching...", progress_mode=True)
+        worker = SpriteSearchWorker(self.spr, image)
+        worker.progress.connect(self.update_progress)
+        worker.finished_search.connect(lambda results: self.show_image_search_results(file_path, results))
+        worker.failed.connect(self.on_image_search_failed)
+        worker.finished.connect(self.hide_loading)
+        self.image_search_worker = worker  # keeps the thread alive until it's done
+        worker.start()
+
+    def on_image_search_failed(self, message):
+        QMessageBox.critical(self, "Find by Image", f"Could not search the image:\n{message}")
+
+    def show_image_search_results(self, file_path, results):
+        usage = self.editor.sprite_usage() if self.editor else None
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"Sprites like {os.path.basename(file_path)}")
+        dialog.resize(520, 420)
+        layout = QVBoxLayout(dialog)
+        result_list = QListWidget()
+        layout.addWidget(result_list)
+
+        for (row, col), matches in results:
+            if len(results) > 1:
+                header = QListWidgetItem(f"Tile {row},{col}")
+                header.setFlags(Qt.ItemFlag.NoItemFlags)
+                result_list.addItem(header)
+            if not matches:
+                result_list.addItem(QListWidgetItem("  No similar sprite."))
+            for match in matches:
+                text = f"Sprite {match.sprite_id}  (distance {match.score}"
+                text += ")" if match.transform == "identity" else f", {match.transform})"
+                if usage is not None:
+                    users = usage.where_used(match.sprite_id)
+                    if users:
+                        text += "  -  " + self.format_sprite_users(users, limit=3).replace("\n", ", ")
+                item = QListWidgetItem(text)
+                item.setData(Qt.ItemDataRole.UserRole, match.sprite_id)
+                result_list.addItem(item)
+
+        if not results:
+            result_list.addItem(QListWidgetItem("The image has no visible pixels."))
+
+        def go_to(item):
+            sprite_id = item.data(Qt.ItemDataRole.UserRole)
+            if sprite_id:
+                self.select_sprite(sprite_id, from_preview_click=False)
+
+        result_list.itemDoubleClicked.connect(go_to)
+        dialog.show()
+        self.find_image_dialog = dialog
+
     def goto_sprite_id(self):
         """Navigate directly to a specific sprite ID"""
         if not self.spr:
@@ -4090,88 +4104,214 @@ class DatSprTab(QWidget):
         self.load_dat_file_from_path(filepath)
 
     def load_dat_file_from_path(self, filepath):
+        """
+        Loads the .dat and its .spr in two worker threads. The ID grid is
+        usable as soon as the DAT index is ready; sprites fill in when the
+        SPR finishes (progress in the status bar meanwhile).
+        """
         self.file_input.setText(filepath)
 
-        self.show_loading("Loading...\nPlease wait.")
+        self.show_loading("Loading...\nPlease wait.", progress_mode=True)
 
         is_extended = self.chk_extended.isChecked()
         is_transparency = self.chk_transparency.isChecked()
 
+        # Get Sprite Size
         try:
-            self.editor = DatEditor(filepath, extended=is_extended)
-            self.editor.load()
-            self.current_page = 0
+            size_str = self.combo_size.currentText().split("x")[0]
+            sprite_size = int(size_str)
+        except:
+            sprite_size = 32
+
+        self.load_generation += 1
+        generation = self.load_generation
+        self.editor = None
+        # The store's on_write callback keeps the old editor (and its mmap) alive
+        if self.spr is not None:
+            self.spr.close()
+        self.spr = None
+        if self.session_cache is not None:
+            self.session_cache.close()
+        self.refresh_sprite_list()
 
-            self.enable_editing()
+        spr_path = os.path.splitext(filepath)[0] + ".spr"
+        self.spr_loading = os.path.exists(spr_path)
 
-            base_path = os.path.splitext(filepath)[0]
-            spr_path = base_path + ".spr"
+        # Reopening an unchanged client: spans and offset tables come from the cache
+        try:
+            self.session_cache = SessionCache(
+                filepath, spr_path, extended=is_extended, transparency=is_transparency,
+                sprite_size=sprite_size,
+            )
+            cached = self.session_cache.read()
+        except OSError as e:
+            print(f"Session cache unavailable: {e}")
+            self.session_cache = cached = None
+        self.session_cache_hit = cached is not None
 
-            if os.path.exists(spr_path):
-                self.show_loading("Found .spr file.\nLoading sprites...", progress_mode=True)
+        def load_dat():
+            try:
+                editor = DatEditor(filepath, extended=is_extended, lazy=True)
+                editor.load(
+                    progress_callback=lambda cur, total: self.sig_load_progress.emit(
+                        generation, "dat", cur, total
+                    ),
+                    index=cached,
+                )
+                self.sig_dat_ready.emit(generation, editor)
+            except Exception as e:
+                print(e)
+                self.sig_load_failed.emit(generation, "dat", str(e))
 
-                if hasattr(self, "spr") and self.spr:
-                    pass
-                
-                # Get Sprite Size
-                try:
-                    size_str = self.combo_size.currentText().split("x")[0]
-                    sprite_size = int(size_str)
-                except:
-                    sprite_size = 32
+        def load_spr():
+            try:
+                spr = SprEditor(spr_path, transparency=is_transparency, sprite_size=sprite_size)
+                spr.load(
+                    progress_callback=lambda cur, total: self.sig_load_progress.emit(
+                        generation, "spr", cur, total
+                    ),
+                    index=cached,
+                )
+                if cached:
+                    spr.attach_thumbnails(cached)
+                self.sig_spr_ready.emit(generation, spr)
+            except Exception as e:
+                print(e)
+                self.sig_load_failed.emit(generation, "spr", str(e))
 
-                self.spr = SprEditor(spr_path, transparency=is_transparency, sprite_size=sprite_size)
-                
-                def update_spr_progress(current, total):
-                    self.update_progress(current, total, message=f"Loading Sprites...\n{current}/{total}")
-                    
-                self.spr.load(progress_callback=update_spr_progress)
+        threading.Thread(target=load_dat, daemon=True).start()
+        if self.spr_loading:
+            threading.Thread(target=load_spr, daemon=True).start()
 
-                self.preview_info.setText(
-                    f"SPR loaded: {os.path.basename(spr_path)}\nSprites: {self.spr.sprite_count}"
-                )
-                self.sprite_page = 0
+    def on_load_progress(self, generation, what, current, total):
+        if generation != self.load_generation:
+            return
+        if what == "dat" and self.editor is None:
+            self.update_progress(current, total, message=f"Loading DAT...\n{current}/{total}")
+        elif what == "spr" and self.editor is not None:
+            percentage = int(current / total * 100) if total else 0
+            self.status_label.setText(f"DAT ready. Loading sprites... {percentage}% ({current}/{total})")
+            self.status_label.setStyleSheet("color: cyan;")
+
+    def on_dat_ready(self, generation, editor):
+        if generation != self.load_generation:
+            return
+        self.editor = editor
+        self.current_page = 0
 
-                self.refresh_sprite_list()
+        self.enable_editing()
+        if self.spr_loading:
+            # Saving now would write the DAT without its sprites
+            self.save_button.setEnabled(False)
 
+        self.refresh_id_list()
+        self.hide_loading()
+        if self.spr_loading:
+            self.status_label.setText("DAT ready. Loading sprites...")
+            self.status_label.setStyleSheet("color: cyan;")
+        else:
+            self.show_loaded_status()
+            self.write_session_cache()
+
+    def on_spr_ready(self, generation, spr):
+        if generation != self.load_generation:
+            return
+        self.spr = spr
+        self.spr_loading = False
+
+        self.preview_info.setText(
+            f"SPR loaded: {os.path.basename(spr.spr_source)}\nSprites: {spr.sprite_count}"
+        )
+        self.sprite_page = 0
+        self.refresh_sprite_list()
+
+        if self.editor is None:
+            # refresh_sprite_list hid the overlay; the DAT is still loading
+            self.show_loading("Loading DAT...", progress_mode=True)
+        else:
+            # Redraw the current ID page, now with thumbnails
+            self.save_button.setEnabled(True)
             self.refresh_id_list()
+            self.show_loaded_status()
+            self.write_session_cache()
 
-        except Exception as e:
-            print(e)
-            
-            # Smart Error Hinting
-            hints = []
-            if not is_extended:
-                hints.append("- Try checking 'Extended' (Client 9.60+).")
-            if not is_transparency:
-                hints.append("- Try checking 'Transparency' (Client 10.50+).")
-            
-            hint_msg = ""
-            if hints:
-                hint_msg = "\n\n💡 Suggestion:\n" + "\n".join(hints)
-            
-            QMessageBox.critical(
-                self, "Load Error", f"Could not load the file.\n\nError: {e}{hint_msg}"
-            )
-            self.status_label.setText("Failed to load file.")
-            self.status_label.setStyleSheet("color: red;")
+    def on_load_failed(self, generation, what, message):
+        if generation != self.load_generation:
+            return
+        self.spr_loading = False
+        if what == "spr":
+            if self.editor is not None:
+                self.save_button.setEnabled(True)
+        else:
+            # Nothing usable without the DAT: drop the sprites still loading
+            self.load_generation += 1
+        self.hide_loading()
 
-        finally:
-            self.hide_loading()
+        # Smart Error Hinting
+        hints = []
+        if not self.chk_extended.isChecked():
+            hints.append("- Try checking 'Extended' (Client 9.60+).")
+        if not self.chk_transparency.isChecked():
+            hints.append("- Try checking 'Transparency' (Client 10.50+).")
 
-            spr_count = 0
-            if hasattr(self, "spr") and self.spr is not None:
-                spr_count = self.spr.sprite_count
+        hint_msg = ""
+        if hints:
+            hint_msg = "\n\n💡 Suggestion:\n" + "\n".join(hints)
 
-            self.status_label.setText(
-                f"Files loaded! "
-                f"Items: {self.editor.counts['items']}  /  "
-                f"Outfits: {self.editor.counts['outfits']}  /  "
-                f"Effects: {self.editor.counts['effects']}  /  "
-                f"Missiles: {self.editor.counts['missiles']}  /  "
-                f"Sprite Total: {spr_count}"
-            )
-            self.status_label.setStyleSheet("color: cyan;")
+        QMessageBox.critical(
+            self, "Load Error", f"Could not load the file.\n\nError: {message}{hint_msg}"
+        )
+        self.status_label.setText("Failed to load file.")
+        self.status_label.setStyleSheet("color: red;")
+
+    def write_session_cache(self):
+        """
+        After a load that missed the cache: store the indexes for the next
+        time. The sections are copied here, before any edit; only the
+        thumbnail decoding and the file write run in the background.
+        """
+        if self.session_cache is None or self.session_cache_hit:
+            return
+        cache, editor, spr = self.session_cache, self.editor, self.spr
+
+        thumb_ids = []
+        if SESSION_CACHE_THUMBNAILS and spr is not None:
+            items = editor.things["items"]
+            for item_id in range(100, 100 + self.ids_per_page):
+                if item_id in items:
+                    ids = editor.thing_sprite_ids("items", items[item_id])
+                    if len(ids) and ids[0] > 0:
+                        thumb_ids.append(int(ids[0]))
+
+        sections = editor.index_sections()
+        thumbs = None
+        if spr is not None:
+            sections.update(spr.index_sections())
+            if thumb_ids:
+                thumbs = spr.thumbnail_records(thumb_ids)
+
+        def write():
+            try:
+                if thumbs is not None:
+                    sections.update(spr.thumbnail_sections(*thumbs))
+                cache.write(sections)
+            except Exception as e:
+                print(f"Session cache: {e}")
+
+        self.session_cache_hit = True # once per load
+        threading.Thread(target=write, daemon=True).start()
+
+    def show_loaded_status(self):
+        spr_count = self.spr.sprite_count if self.spr is not None else 0
+        self.status_label.setText(
+            f"Files loaded! "
+            f"Items: {self.editor.counts['items']}  /  "
+            f"Outfits: {self.editor.counts['outfits']}  /  "
+            f"Effects: {self.editor.counts['effects']}  /  "
+            f"Missiles: {self.editor.counts['missiles']}  /  "
+            f"Sprite Total: {spr_count}"
+        )
+        self.status_label.setStyleSheet("color: cyan;")
 
     def parse_ids(self, id_string):
         ids = set()
@@ -4200,10 +4340,20 @@ class DatSprTab(QWidget):
             return
 
         id_string = self.id_entry.text()
-        self.current_ids = self.parse_ids(id_string)
+        if is_query(id_string):
+            try:
+                self.current_ids = select(self.editor, id_string, self.get_current_category_key())
+            except QueryError as e:
+                QMessageBox.warning(self, "Invalid Query", str(e))
+                return
+            if not self.current_ids:
+                self.status_label.setText("No IDs match the query.")
+                self.status_label.setStyleSheet("color: orange;")
+        else:
+            self.current_ids = self.parse_ids(id_string)
 
         if not self.current_ids:
-            if id_string:
+            if id_string and not is_query(id_string):
                 QMessageBox.warning(self, "Invalid IDs", "Incorrect format.")
             for cb in self.checkboxes.values():
                 cb.setChecked(False)
@@ -4272,20 +4422,27 @@ class DatSprTab(QWidget):
 
         things_dict = self.editor.things.get(category, {})
 
+        # One pass over the selection: how many of the things have each key
+        selected = 0
+        key_counts = {}
+        for item_id in self.current_ids:
+            thing = things_dict.get(item_id)
+            if thing is None:
+                continue
+            selected += 1
+            for key in thing["props"]:
+                key_counts[key] = key_counts.get(key, 0) + 1
+
         for attr_name, cb in self.checkboxes.items():
-            states = [
-                attr_name in things_dict[item_id]["props"]
-                for item_id in self.current_ids
-                if item_id in things_dict
-            ]
+            count = key_counts.get(attr_name, 0)
 
-            if not states:
+            if not selected:
                 cb.setChecked(False)
                 cb.setStyleSheet("color: gray;")
-            elif all(states):
+            elif count == selected:
                 cb.setChecked(True)
                 cb.setStyleSheet("color: white;")
-            elif not any(states):
+            elif not count:
                 cb.setChecked(False)
                 cb.setStyleSheet("color: white;")
             else:
@@ -4415,6 +4572,7 @@ class DatSprTab(QWidget):
             self.status_label.setStyleSheet("color: yellow;")
             return
 
+        self.editor.mark_changed(current_cat_key, self.current_ids)
         self.status_label.setText("Changes applied. Save with 'Compile as...'")
         self.status_label.setStyleSheet("color: green;")
 
@@ -4533,7 +4691,25 @@ class DatSprTab(QWidget):
                 base_path = os.path.splitext(filepath)[0]
                 spr_dest_path = base_path + ".spr"
 
-                self.spr.save(spr_dest_path, target_sprite_size=target_size)
+                self.show_loading("Saving sprites...", progress_mode=True)
+
+                def update_save_progress(current, total):
+                    self.update_progress(current, total, message=f"Saving Sprites...\n{current}/{total}")
+
+                try:
+                    if target_size > 0:
+                        self.spr.save(
+                            spr_dest_path,
+                            target_sprite_size=target_size,
+                            progress_callback=update_save_progress,
+                        )
+                    elif self.spr.save_incremental(spr_dest_path, update_save_progress):
+                        # Patched in place: rewrite once old payloads pile up
+                        spr_size = os.path.getsize(spr_dest_path)
+                        if self.spr.dead_space() > spr_size * SPR_COMPACT_RATIO:
+                            self.spr.compact(update_save_progress)
+                finally:
+                    self.hide_loading()
 
                 msg_extra = f"\nAnd the .spr file was compiled/saved to:\n{os.path.basename(spr_dest_path)}"
                 if target_size > 0:
@@ -4594,16 +4770,8 @@ class DatSprTab(QWidget):
             self.current_item_paty = props.get("PatternY", 1)
             self.current_item_patz = props.get("PatternZ", 1)            
 
-            if category == "outfits":
-                sprite_ids = DatEditor.extract_outfit_group_sprites(
-                    item["texture_bytes"],
-                    self.current_framegroup_index, 
-                    self.editor.extended                    
-                )
-            else:
-                sprite_ids = DatEditor.extract_sprite_ids_from_texture_bytes(
-                    item["texture_bytes"]
-                )
+            group = self.current_framegroup_index if category == "outfits" else 0
+            sprite_ids = self.editor.thing_sprite_ids(category, item, group).tolist()
 
             if sprite_ids:
                 self.current_preview_sprite_list = sprite_ids
@@ -5045,7 +5213,7 @@ class PartitionedSprTab(DatSprTab):
     def _load_thread_partitioned(self):
         try:
              # Load DAT
-             self.dat = DatEditor(self.dat_path)
+             self.dat = DatEditor(self.dat_path, lazy=True)
              # Helper to emit signal
              def progress_wrapper(current, total):
                 self.sig_progress.emit(current, total, "Loading DAT...")
@@ -5103,7 +5271,10 @@ class PartitionedSprTab(DatSprTab):
 
     def _save_thread_converted(self, path):
          try:
-             self.spr.save(path)
+             def progress_wrapper(current, total):
+                self.sig_progress.emit(current, total, "Saving SPR...")
+
+             self.spr.save(path, progress_callback=progress_wrapper)
              self.sig_hide_loading.emit()
          except Exception as e:
              print(f"Error saving: {e}")
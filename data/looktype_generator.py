@@ -15,6 +15,8 @@ import os
 import struct
 import re
 
+from dat_handler import thing_texture
+
 
 
 def prettify_xml(elem):
@@ -1351,35 +1353,12 @@ class LookTypeGeneratorWindow(QDialog):
         
         try:
             outfit_data = self.dat_editor.things['outfits'][outfit_id]
-            texture_bytes = outfit_data['texture_bytes']
-            
-            # Parse do framegroup Idle
-            offset = 1
-            fg_type = texture_bytes[offset]
-            offset += 1
-            
-            w, h = struct.unpack_from("BB", texture_bytes, offset)
-            offset += 2
-            
-            if w > 1 or h > 1:
-                offset += 1
-            
-            layers, px, py, pz, frames = struct.unpack_from("BBBBB", texture_bytes, offset)
-            offset += 5
-            
-            if frames > 1:
-                offset += 1 + 4 + 1 + (frames * 8)
-            
-            # Extrai sprite IDs
-            total_sprites = w * h * px * py * pz * layers * frames
-            spr_size = 4 if self.dat_editor.extended else 2
-            fmt = "I" if spr_size == 4 else "H"
-            
-            sprite_ids = []
-            for _ in range(total_sprites):
-                sprite_id = struct.unpack_from(fmt, texture_bytes, offset)[0]
-                sprite_ids.append(sprite_id)
-                offset += spr_size
+
+            # Framegroup Idle (parsed once per outfit and cached)
+            texture = thing_texture(outfit_data, outfit=True, extended=self.dat_editor.extended)
+            group = texture.groups[0]
+            w, h, layers, px = group.width, group.height, group.layers, group.pattern_x
+            sprite_ids = texture.group_ids(0).tolist()
             
             # CÁLCULO DA DIREÇÃO - CORRIGIDO!
             # Ordem: layers → width → height → patternX (direções aqui!)
@@ -994,7 +994,7 @@ class OtbEditorTab(QWidget):
         try:
             if "items" in self.datspr_module.editor.things and client_id in self.datspr_module.editor.things["items"]:
                 item = self.datspr_module.editor.things["items"][client_id]
-                from datspr import DatEditor
+                from dat_editor import DatEditor
                 sprite_ids = DatEditor.extract_sprite_ids_from_texture_bytes(item["texture_bytes"])
                 if sprite_ids and sprite_ids[0] > 0:
                     img = self.datspr_module.spr.get_sprite(sprite_ids[0])
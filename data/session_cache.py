@@ -0,0 +1,180 @@
+import hashlib
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# Binary cache of what opening a client computes: the DAT thing spans, the
+# SPR offset table and optional decoded thumbnails. One file per .dat/.spr
+# pair, valid only while both files keep their size, mtime and sampled hash.
+#
+# [Magic:8][Version:4][KeySize:4][Sections:4][Key][Section table][Data]
+# Section table entries: [Name:32][Dtype:8][Offset:8][Count:8][Ndim:4][Shape:4*4]
+# Data blocks are 8-byte aligned, so every section is read as a numpy view
+# of one mmap without copying.
+
+CACHE_MAGIC = b"IMCACHE\x00"
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".imcache"
+_HEADER = struct.Struct("<8sIII")
+_SECTION = struct.Struct("<32s8sQQI4I")
+_SAMPLE_SIZE = 64 * 1024  # bytes hashed at the start and end of a file
+_SAMPLE_BLOCKS = 64  # plus this many 4 KiB blocks spread over the file
+
+
+def default_cache_dir():
+    return os.path.join(os.path.expanduser("~"), ".cache", "ItemManager")
+
+
+def file_fingerprint(path):
+    """
+    size + mtime + blake2b of the head, tail and 64 blocks spread over the
+    file: reads ~400 KiB whatever the file size, but still catches edits
+    that keep size and mtime.
+    """
+    st = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(struct.pack("<QQ", st.st_size, st.st_mtime_ns))
+    with open(path, "rb") as f:
+        digest.update(f.read(_SAMPLE_SIZE))
+        if st.st_size > 2 * _SAMPLE_SIZE:
+            step = st.st_size // (_SAMPLE_BLOCKS + 1)
+            for n in range(1, _SAMPLE_BLOCKS + 1):
+                f.seek(n * step)
+                digest.update(f.read(4096))
+            f.seek(st.st_size - _SAMPLE_SIZE)
+            digest.update(f.read(_SAMPLE_SIZE))
+    return digest.digest()
+
+
+class SessionCache:
+    """
+    Cache file of one client (.dat + optional .spr, or an .spr alone for
+    the sprite hash index). `options` are the load settings the cached
+    data depends on (extended, transparency, ...); they are part of the
+    key, like the file fingerprints.
+
+        cache = SessionCache(dat_path, spr_path, extended=True)
+        sections = cache.read()  # {name: array} or None if missing/stale
+        ...
+        cache.write({"dat.starts.items": starts, ...})
+    """
+
+    def __init__(self, dat_path, spr_path=None, cache_dir=None, suffix=CACHE_SUFFIX, **options):
+        self.dat_path = dat_path
+        self.spr_path = spr_path if spr_path and os.path.exists(spr_path) else None
+        self.cache_dir = cache_dir
+        self.suffix = suffix  # other caches of the same files use their own suffix
+        self.key = self._make_key(options)
+        self._mm = None
+
+    def _make_key(self, options):
+        digest = hashlib.blake2b(digest_size=32)
+        digest.update(struct.pack("<I", CACHE_VERSION))
+        for path in (self.dat_path, self.spr_path):
+            if path:
+                digest.update(file_fingerprint(path))
+        for name in sorted(options):
+            digest.update(f"{name}={options[name]!r};".encode())
+        return digest.digest()
+
+    def paths(self):
+        """Candidate cache files: next to the .dat first, then the user cache dir."""
+        name = os.path.basename(self.dat_path) + self.suffix
+        candidates = [os.path.join(os.path.dirname(os.path.abspath(self.dat_path)), name)]
+        # Files of different folders can share a name: the folder hash tells them apart
+        folder = hashlib.blake2b(
+            os.path.abspath(self.dat_path).encode(), digest_size=8
+        ).hexdigest()
+        candidates.append(
+            os.path.join(self.cache_dir or default_cache_dir(), folder + "_" + name)
+        )
+        return candidates
+
+    def read(self):
+        """All sections as read-only numpy views of the mapped cache, or None."""
+        for path in self.paths():
+            sections = self._read(path)
+            if sections is not None:
+                return sections
+        return None
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            magic, version, key_size, count = _HEADER.unpack_from(mm, 0)
+            pos = _HEADER.size
+            if magic != CACHE_MAGIC or version != CACHE_VERSION or mm[pos:pos + key_size] != self.key:
+                mm.close()
+                return None
+            pos += key_size
+
+            sections = {}
+            for _ in range(count):
+                name, dtype, offset, items, ndim, *shape = _SECTION.unpack_from(mm, pos)
+                pos += _SECTION.size
+                array = np.frombuffer(
+                    mm, dtype=np.dtype(dtype.rstrip(b"\x00").decode()), count=items, offset=offset
+                )
+                sections[name.rstrip(b"\x00").decode()] = array.reshape(shape[:ndim])
+        except (struct.error, ValueError, TypeError):
+            mm.close()
+            return None
+
+        self._mm = mm  # the views keep using it
+        return sections
+
+    def write(self, sections):
+        """
+        Writes {name: array} under the current key. Goes next to the .dat if
+        that folder is writable, else to the cache dir. Returns the path or
+        None if nothing could be written.
+        """
+        arrays = [(name, np.ascontiguousarray(array)) for name, array in sections.items()]
+
+        table_end = _HEADER.size + len(self.key) + _SECTION.size * len(arrays)
+        offset = (table_end + 7) & ~7
+        table = bytearray()
+        for name, array in arrays:
+            shape = tuple(array.shape) + (0,) * (4 - array.ndim)
+            table += _SECTION.pack(
+                name.encode(), array.dtype.str.encode(), offset, array.size, array.ndim, *shape
+            )
+            offset = (offset + array.nbytes + 7) & ~7
+
+        for path in self.paths():
+            tmp_path = path + ".tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    f.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, len(self.key), len(arrays)))
+                    f.write(self.key)
+                    f.write(table)
+                    for _name, array in arrays:
+                        f.write(b"\x00" * (-f.tell() % 8))
+                        f.write(array.tobytes())
+                # A half-written cache never replaces a good one
+                os.replace(tmp_path, path)
+                return path
+            except OSError as e:
+                print(f"Session cache: could not write {path}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        return None
+
+    def close(self):
+        """Drops the mapping; arrays returned by read() must not be used afterwards."""
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                pass  # still referenced by live views; freed with them
+            self._mm = None
@@ -0,0 +1,846 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict, deque
+from functools import partial
+
+import numpy as np
+from PIL import Image
+
+SPR_HEADER_SIZE = 8  # [Signature:4][Count:4]
+SPR_COLOR_KEY = b"\xff\x00\xff"
+SAVE_BUFFER_SIZE = 8 * 1024 * 1024
+CONVERT_CHUNK = 2048  # sprites per process-pool task
+_RUN_HEADER = struct.Struct("<HH")
+
+SPR_JOURNAL_MAGIC = b"SPRJ"
+_JOURNAL_HEADER = struct.Struct("<4sQI")  # [Magic:4][OriginalSize:8][Count:4]
+
+
+class SprIndex:
+    """
+    Offset table of an SPR: one (part, offset, length) entry per sprite,
+    stored in flat numpy arrays instead of per-sprite objects.
+    Entry 0 is sprite ID 1, like the offset table on disk.
+    """
+
+    def __init__(self, offsets, lengths, parts=None):
+        self.offsets = offsets
+        self.lengths = lengths
+        self.parts = parts  # None for single-file SPRs
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32))
+
+    @classmethod
+    def read(cls, f, count, data_end):
+        """Reads the offset table of an open SPR (positioned right after the header)."""
+        raw = f.read(count * 4)
+        if len(raw) < count * 4:
+            raise ValueError("Invalid SPR file: truncated offset table.")
+
+        offsets = np.frombuffer(raw, dtype="<u4").astype(np.uint32)
+        return cls(offsets, compute_sprite_lengths(offsets, data_end))
+
+    @classmethod
+    def concat(cls, indexes):
+        """Merges the indexes of SPR parts into one global table (part = position in list)."""
+        if not indexes:
+            return cls.empty()
+
+        offsets = np.concatenate([idx.offsets for idx in indexes])
+        lengths = np.concatenate([idx.lengths for idx in indexes])
+        parts = np.concatenate(
+            [np.full(len(idx), i, dtype=np.uint16) for i, idx in enumerate(indexes)]
+        )
+        return cls(offsets, lengths, parts)
+
+    def span(self, sprite_id):
+        """Returns (part, offset, length) of a sprite, or None if out of range."""
+        i = sprite_id - 1
+        if i < 0 or i >= len(self.offsets):
+            return None
+        part = int(self.parts[i]) if self.parts is not None else 0
+        return part, int(self.offsets[i]), int(self.lengths[i])
+
+
+def compute_sprite_lengths(offsets, data_end):
+    """
+    Size of every sprite in one pass over the sorted offsets: each sprite
+    runs until the next larger offset in the file (or the end of the file).
+    Sorting keeps the spans right when payloads are not stored in ID order,
+    e.g. after an incremental save appended edited sprites at the end.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.zeros(len(offsets), dtype=np.uint32)
+
+    used = np.flatnonzero(offsets)
+    if used.size == 0:
+        return lengths
+
+    starts = offsets[used]
+    ordered = np.unique(starts)
+    next_start = np.append(ordered[1:], data_end)
+
+    ends = np.minimum(next_start[np.searchsorted(ordered, starts)], data_end)
+    lengths[used] = np.clip(ends - starts, 0, None)
+    return lengths
+
+
+def record_lengths(buffer, offsets, lengths):
+    """
+    Exact size of each sprite record from its own [ColorKey:3]?[Size:2]
+    header, capped by the span in `lengths`. Only the header bytes are
+    read, so a mapped file stays mostly untouched. Bytes between a record's
+    end and the next offset are dead space.
+    """
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    exact = np.where(offsets > 0, lengths, 0).astype(np.uint32)
+
+    used = np.flatnonzero((offsets > 0) & (lengths >= 2))
+    if used.size == 0:
+        return exact
+
+    starts = offsets[used]
+    spans = lengths[used]
+
+    def byte_at(pos):
+        return raw[np.minimum(pos, len(raw) - 1)].astype(np.int64)
+
+    # A record without color key may start with FF 00 FF by chance
+    # (Size = 255); it's kept whole when that reading fits the span exactly.
+    plain_size = 2 + (byte_at(starts) | (byte_at(starts + 1) << 8))
+    color_key = (
+        (spans >= 5)
+        & (byte_at(starts) == 0xFF)
+        & (byte_at(starts + 1) == 0x00)
+        & (byte_at(starts + 2) == 0xFF)
+        & (plain_size != spans)
+    )
+    header = np.where(color_key, 3, 0)
+    size = byte_at(starts + header) | (byte_at(starts + header + 1) << 8)
+
+    exact[used] = np.minimum(header + 2 + size, spans)
+    return exact
+
+
+def _record_size(view, offset, span):
+    """Single-sprite version of record_lengths."""
+    if span < 2:
+        return span
+    header = 0
+    if (
+        span >= 5
+        and view[offset] == 0xFF and view[offset + 1] == 0x00 and view[offset + 2] == 0xFF
+        and 2 + 255 != span
+    ):
+        header = 3
+    size = view[offset + header] | (view[offset + header + 1] << 8)
+    return min(header + 2 + size, span)
+
+
+def read_spr_header(f):
+    header = f.read(SPR_HEADER_SIZE)
+    if len(header) < SPR_HEADER_SIZE:
+        raise ValueError("Invalid SPR file.")
+    return struct.unpack("<II", header)
+
+
+def scan_spr_headers(paths):
+    """
+    Reads only the 8-byte header of every SPR part. Returns a list of
+    (signature, count, first_id): first_id is the global ID of the part's
+    sprite 1, so the total count and every ID range are known before any
+    offset table is read.
+    """
+    headers = []
+    first_id = 1
+    for path in paths:
+        with open(path, "rb") as f:
+            signature, count = read_spr_header(f)
+        headers.append((signature, count, first_id))
+        first_id += count
+    return headers
+
+
+def load_spr_part(path, count, use_mmap=True):
+    """Reads one part's offset table and opens its buffer: (SprIndex, buffer)."""
+    with open(path, "rb") as f:
+        f.seek(SPR_HEADER_SIZE)
+        file_size = os.fstat(f.fileno()).st_size
+        index = SprIndex.read(f, count, file_size)
+        return index, open_spr_buffer(f, use_mmap)
+
+
+def _rle_runs(data, total_pixels, bpp):
+    """
+    Walks the run headers of an RLE sprite ([Transparent:2][Colored:2][pixels])
+    and returns the drawable runs as parallel lists:
+    destination pixel, source byte offset and pixel count.
+    Runs are clipped to the sprite area; a run whose payload is cut short
+    stops decoding, same as the original per-pixel loops.
+    """
+    run_pos = []
+    run_src = []
+    run_len = []
+
+    unpack_from = _RUN_HEADER.unpack_from
+    size = len(data)
+    p = 0
+    pos = 0
+
+    while p + 4 <= size and pos < total_pixels:
+        transparent, colored = unpack_from(data, p)
+        p += 4
+        pos += transparent
+
+        if p + colored * bpp > size or pos >= total_pixels:
+            break
+
+        if colored:
+            run_pos.append(pos)
+            run_src.append(p)
+            run_len.append(min(colored, total_pixels - pos))
+
+        p += colored * bpp
+        pos += colored
+
+    return run_pos, run_src, run_len
+
+
+def split_sprite_record(raw_data):
+    """
+    Splits a raw sprite record ([ColorKey:3]?[Size:2][RLE data]) and returns
+    (has_color_key, rle_data).
+    """
+    start_idx = 0
+    has_color_key = (
+        len(raw_data) >= 3
+        and raw_data[0] == 0xFF
+        and raw_data[1] == 0x00
+        and raw_data[2] == 0xFF
+    )
+    if has_color_key:
+        start_idx = 3
+
+    if start_idx + 2 <= len(raw_data):
+        start_idx += 2
+
+    return has_color_key, raw_data[start_idx:]
+
+
+def make_sprite_record(encoded, color_key=False):
+    prefix = SPR_COLOR_KEY if color_key else b""
+    return prefix + struct.pack("<H", len(encoded)) + bytes(encoded)
+
+
+def decode_rle_into(out, data, bpp):
+    """
+    Decodes an RLE sprite into `out`, a zeroed (size * size, 4) uint8 array.
+    bpp=3 is the classic RGB format (alpha 255), bpp=4 the 10.98 RGBA one.
+    """
+    run_pos, run_src, run_len = _rle_runs(data, len(out), bpp)
+    if not run_len:
+        return out
+
+    counts = np.array(run_len, dtype=np.intp)
+    starts = np.cumsum(counts) - counts
+    step = np.arange(int(counts.sum()), dtype=np.intp)
+
+    dest = np.repeat(np.array(run_pos, dtype=np.intp) - starts, counts) + step
+    src = np.repeat(np.array(run_src, dtype=np.intp) - starts * bpp, counts) + step * bpp
+
+    raw = np.frombuffer(data, dtype=np.uint8)
+    pixels = raw[src[:, None] + np.arange(bpp)]
+
+    if bpp == 3:
+        out[dest, :3] = pixels
+        out[dest, 3] = 255
+    else:
+        # Colored pixels with alpha 0 are shown opaque (old client quirk)
+        alpha = pixels[:, 3]
+        alpha[(alpha == 0) & pixels[:, :3].any(axis=1)] = 255
+        out[dest] = pixels
+
+    return out
+
+
+def decode_rle(data, sprite_size, bpp):
+    """Decodes an RLE sprite into a new (sprite_size, sprite_size, 4) uint8 array."""
+    out = np.zeros((sprite_size * sprite_size, 4), dtype=np.uint8)
+    decode_rle_into(out, data, bpp)
+    return out.reshape(sprite_size, sprite_size, 4)
+
+
+def encode_rle(pixels, bpp, alpha_threshold):
+    """
+    Encodes (N, 4) uint8 RGBA pixels (row-major) as an RLE sprite.
+    Pixels with alpha below alpha_threshold are transparent; the others are
+    written with their first `bpp` channels. Byte-identical to the old
+    per-pixel encoders: one [Transparent:2][Colored:2] header per colored
+    run plus a final header for trailing transparent pixels.
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 4)
+    total = len(pixels)
+    if total == 0:
+        return bytearray()
+
+    transparent = pixels[:, 3] < alpha_threshold
+
+    # Colored runs [start, end) from the edges of the opaque mask
+    edges = np.diff(np.concatenate(([0], (~transparent).view(np.int8), [0])))
+    run_start = np.flatnonzero(edges == 1)
+    run_end = np.flatnonzero(edges == -1)
+
+    prev_end = np.concatenate(([0], run_end[:-1]))
+    headers = np.column_stack((run_start - prev_end, run_end - run_start))
+
+    if transparent[-1]:
+        last_end = run_end[-1] if len(run_end) else 0
+        headers = np.vstack((headers, [[total - last_end, 0]]))
+
+    if headers.size and headers.max() > 0xFFFF:
+        raise ValueError("Sprite too large for RLE encoding.")
+
+    header_bytes = headers.astype("<u2").view(np.uint8).reshape(-1, 4)
+    payload = pixels[~transparent, :bpp].reshape(-1)
+
+    # Header k sits after k headers and the payload of the k runs before it
+    colored_before = np.concatenate(([0], np.cumsum(headers[:-1, 1])))
+    header_pos = np.arange(len(headers)) * 4 + colored_before * bpp
+
+    out = np.empty(len(headers) * 4 + len(payload), dtype=np.uint8)
+    is_header = np.zeros(len(out), dtype=bool)
+    header_idx = header_pos[:, None] + np.arange(4)
+    is_header[header_idx] = True
+
+    out[header_idx] = header_bytes
+    out[~is_header] = payload
+    return bytearray(out)
+
+
+def convert_sprite_records(records, src_size, dst_size, transparency):
+    """
+    Process-pool worker for size conversion: decodes raw sprite records,
+    resizes them (nearest neighbour) and re-encodes them, keeping each
+    record's color key prefix.
+    """
+    bpp = 4 if transparency else 3
+    alpha_threshold = 1 if transparency else 10
+
+    converted = []
+    for raw_data in records:
+        if not raw_data:
+            converted.append(b"")
+            continue
+
+        color_key, content = split_sprite_record(raw_data)
+        pixels = decode_rle(content, src_size, bpp)
+        img = Image.frombuffer("RGBA", (src_size, src_size), pixels, "raw", "RGBA", 0, 1)
+        img = img.resize((dst_size, dst_size), Image.NEAREST)
+
+        encoded = encode_rle(np.asarray(img), bpp, alpha_threshold)
+        converted.append(make_sprite_record(encoded, color_key))
+
+    return converted
+
+
+def decode_sprite_records(records, sprite_size, transparency, out=None):
+    """
+    Decodes raw sprite records into one (N, S, S, 4) uint8 array (also a
+    process-pool worker). Empty or corrupt records stay fully transparent.
+    """
+    bpp = 4 if transparency else 3
+    if out is None:
+        out = np.zeros((len(records), sprite_size, sprite_size, 4), dtype=np.uint8)
+
+    flat = out.reshape(len(out), -1, 4)
+    for n, raw_data in enumerate(records):
+        if not raw_data:
+            continue
+        _color_key, content = split_sprite_record(raw_data)
+        try:
+            decode_rle_into(flat[n], content, bpp)
+        except Exception:
+            flat[n] = 0
+    return out
+
+
+def hash_sprite_records(records, sprite_size, transparency):
+    """
+    Decodes raw sprite records and hashes their canonical pixels (also a
+    process-pool worker). Transparent pixels are zeroed first, so sprites
+    that look the same hash the same whatever their RLE encoding.
+    Returns (empty, digests): a bool array, True for sprites without a
+    single visible pixel, and an 'S16' array of blake2b digests.
+    """
+    pixels = decode_sprite_records(records, sprite_size, transparency)
+    flat = pixels.reshape(len(records), -1, 4)
+    flat[flat[:, :, 3] == 0] = 0
+    empty = ~flat[:, :, 3].any(axis=1)
+
+    digests = np.empty(len(records), dtype="S16")
+    for n, sprite in enumerate(flat):
+        digests[n] = hashlib.blake2b(sprite.data, digest_size=16).digest()
+    return empty, digests
+
+
+def read_spr_records(paths, parts, offsets, lengths):
+    """
+    Reads sprite records straight from SPR files: lengths[n] bytes at
+    offsets[n] of paths[parts[n]] (parts=None: all from paths[0]).
+    """
+    records = [b""] * len(offsets)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ends = offsets + np.asarray(lengths, dtype=np.int64)
+    for part, path in enumerate(paths):
+        rows = np.arange(len(offsets)) if parts is None else np.flatnonzero(np.asarray(parts) == part)
+        if rows.size == 0:
+            continue
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for n, start, end in zip(rows.tolist(), offsets[rows].tolist(), ends[rows].tolist()):
+                records[n] = mm[start:end]
+    return records
+
+
+def map_spr_records(fn, job):
+    """
+    Process-pool worker: fn(records) for one chunk that it reads itself,
+    so the parent never copies file records. job = (paths, parts, offsets,
+    lengths, extra), see read_spr_records; the records in `extra` (unsaved
+    edits) follow the file ones.
+    """
+    paths, parts, offsets, lengths, extra = job
+    return fn(read_spr_records(paths, parts, offsets, lengths) + list(extra))
+
+
+def encode_sprite_array(pixels, transparency):
+    """
+    Encodes an (N, S, S, 4) uint8 array into sprite records ([Size:2][RLE],
+    like replace_sprite). Also a process-pool worker.
+    """
+    bpp = 4 if transparency else 3
+    alpha_threshold = 1 if transparency else 10
+    return [make_sprite_record(encode_rle(sprite, bpp, alpha_threshold)) for sprite in pixels]
+
+
+def ordered_map(executor, fn, iterable, window):
+    """
+    executor.map() that keeps at most `window` tasks in flight, so large
+    jobs don't pickle every chunk up front. Results come back in order.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def journal_path(path):
+    return path + ".journal"
+
+
+def patch_spr_file(path, records, progress_callback=None):
+    """
+    Saves edited sprites into an existing SPR without rewriting it: the new
+    payloads are appended at the end of the file and only their entries of
+    the offset table are rewritten. `records` maps sprite_id -> record
+    ([ColorKey:3]?[Size:2][RLE], or b"" to clear the sprite); every ID must
+    already exist in the file.
+
+    The old table entries and file size go to an undo journal first, so a
+    crash mid-way is rolled back by recover_spr_journal on the next load.
+    Returns the number of bytes appended.
+    """
+    ids = sorted(records)
+    journal = journal_path(path)
+
+    with open(path, "r+b") as f:
+        _, count = read_spr_header(f)
+        if ids and (ids[0] < 1 or ids[-1] > count):
+            raise ValueError("Sprite ID out of range for an in-place save.")
+
+        original_size = os.fstat(f.fileno()).st_size
+        table = np.frombuffer(f.read(count * 4), dtype="<u4")
+        old_offsets = table[np.asarray(ids, dtype=np.int64) - 1] if ids else table[:0]
+
+        # 1) Undo journal, published atomically through a rename
+        tmp_journal = journal + ".tmp"
+        with open(tmp_journal, "wb") as j:
+            j.write(_JOURNAL_HEADER.pack(SPR_JOURNAL_MAGIC, original_size, len(ids)))
+            entries = np.empty((len(ids), 2), dtype="<u4")
+            entries[:, 0] = ids
+            entries[:, 1] = old_offsets
+            j.write(entries.tobytes())
+            j.flush()
+            os.fsync(j.fileno())
+        os.replace(tmp_journal, journal)
+
+        # 2) Every payload in one append
+        new_offsets = np.zeros(len(ids), dtype=np.int64)
+        payload = bytearray()
+        pos = original_size
+        for n, sprite_id in enumerate(ids):
+            data = records[sprite_id]
+            if data:
+                new_offsets[n] = pos + len(payload)
+                payload += data
+        if new_offsets.size and new_offsets.max() > 0xFFFFFFFF:
+            raise ValueError("SPR file would exceed 4 GB.")
+
+        f.seek(original_size)
+        f.write(payload)
+
+        # 3) Only the affected offset table entries
+        for n, sprite_id in enumerate(ids):
+            if progress_callback and n % 5000 == 0:
+                progress_callback(n, len(ids))
+            f.seek(SPR_HEADER_SIZE + (sprite_id - 1) * 4)
+            f.write(struct.pack("<I", int(new_offsets[n])))
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.remove(journal)
+    return len(payload)
+
+
+def recover_spr_journal(path):
+    """
+    Rolls back an interrupted patch_spr_file: restores the offset entries
+    saved in the journal and cuts the appended payloads. Returns True when
+    a rollback happened.
+    """
+    journal = journal_path(path)
+    if os.path.exists(journal + ".tmp"):
+        # Crashed before the journal was published: the SPR was not touched
+        os.remove(journal + ".tmp")
+    if not os.path.exists(journal):
+        return False
+
+    with open(journal, "rb") as j:
+        raw = j.read()
+
+    if len(raw) < _JOURNAL_HEADER.size:
+        print(f"Ignoring invalid SPR journal: {journal}")
+        os.remove(journal)
+        return False
+
+    magic, original_size, n = _JOURNAL_HEADER.unpack_from(raw)
+    if magic != SPR_JOURNAL_MAGIC or len(raw) < _JOURNAL_HEADER.size + n * 8:
+        print(f"Ignoring invalid SPR journal: {journal}")
+        os.remove(journal)
+        return False
+
+    entries = np.frombuffer(raw, dtype="<u4", count=n * 2, offset=_JOURNAL_HEADER.size)
+
+    with open(path, "r+b") as f:
+        for sprite_id, offset in entries.reshape(-1, 2).tolist():
+            f.seek(SPR_HEADER_SIZE + (sprite_id - 1) * 4)
+            f.write(struct.pack("<I", offset))
+        f.truncate(original_size)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.remove(journal)
+    return True
+
+
+def open_spr_buffer(f, use_mmap=True):
+    """
+    Whole-file buffer of an open SPR: a read-only mmap (pages are only
+    loaded when touched) or, with use_mmap=False, one bytes copy.
+    """
+    if use_mmap:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.seek(0)
+    return f.read()
+
+
+class SpriteStore:
+    """
+    Dict-like access to raw sprite payloads (sprite_id -> bytes-like).
+    Unchanged sprites are zero-copy memoryview slices of the file buffers
+    through the SprIndex; sprites written through store[id] = data live in
+    an in-memory overlay that shadows the file.
+    """
+
+    def __init__(self, buffers, index):
+        self._buffers = buffers
+        self._views = [memoryview(b) for b in buffers]
+        self.index = index
+        self.overlay = {}
+        self.on_write = None  # callback(sprite_id), e.g. to drop cached images
+
+        self._offsets = index.offsets
+        self._lengths = index.lengths
+        self._parts = index.parts
+        self._count = len(index)
+
+    @classmethod
+    def empty(cls):
+        return cls([], SprIndex.empty())
+
+    def get(self, sprite_id, default=None):
+        data = self.overlay.get(sprite_id)
+        if data is not None:
+            return data
+
+        i = sprite_id - 1
+        if i < 0 or i >= self._count:
+            return default
+
+        offset = int(self._offsets[i])
+        if offset == 0:
+            return b""
+
+        part = int(self._parts[i]) if self._parts is not None else 0
+        view = self._views[part]
+        return view[offset:offset + _record_size(view, offset, int(self._lengths[i]))]
+
+    def __getitem__(self, sprite_id):
+        data = self.get(sprite_id)
+        if data is None:
+            raise KeyError(sprite_id)
+        return data
+
+    def __setitem__(self, sprite_id, data):
+        self.overlay[sprite_id] = data
+        if self.on_write:
+            self.on_write(sprite_id)
+
+    def __contains__(self, sprite_id):
+        return 1 <= sprite_id <= self._count or sprite_id in self.overlay
+
+    def __len__(self):
+        return max(self._count, max(self.overlay, default=0))
+
+    def __iter__(self):
+        return iter(range(1, len(self) + 1))
+
+    def dirty_ids(self):
+        """Sprite IDs whose payload no longer comes from the file."""
+        return sorted(self.overlay)
+
+    def renumber(self, keep_ids):
+        """
+        Keeps only the sprites keep_ids (old IDs, ascending), renumbered
+        1..len(keep_ids). File sprites still point into the same buffers;
+        overlay payloads move to their new IDs.
+        """
+        keep = np.asarray(keep_ids, dtype=np.int64)
+        rows = keep - 1
+        in_file = rows < self._count
+
+        offsets = np.zeros(len(keep), dtype=np.uint32)
+        lengths = np.zeros(len(keep), dtype=np.uint32)
+        offsets[in_file] = self._offsets[rows[in_file]]
+        lengths[in_file] = self._lengths[rows[in_file]]
+        parts = None
+        if self._parts is not None:
+            parts = np.zeros(len(keep), dtype=np.uint16)
+            parts[in_file] = self._parts[rows[in_file]]
+
+        new_ids = {old_id: new_id for new_id, old_id in enumerate(keep.tolist(), 1)}
+        self.overlay = {
+            new_ids[old_id]: data for old_id, data in self.overlay.items() if old_id in new_ids
+        }
+
+        self.index = SprIndex(offsets, lengths, parts)
+        self._offsets = offsets
+        self._lengths = lengths
+        self._parts = parts
+        self._count = len(keep)
+        return self.index
+
+    def record_lengths(self):
+        """Exact record size of every file sprite (see record_lengths)."""
+        if self._parts is None:
+            if not self._views:
+                return np.zeros(self._count, dtype=np.uint32)
+            return record_lengths(self._views[0], self._offsets, self._lengths)
+
+        exact = np.zeros(self._count, dtype=np.uint32)
+        for part, view in enumerate(self._views):
+            mask = self._parts == part
+            exact[mask] = record_lengths(view, self._offsets[mask], self._lengths[mask])
+        return exact
+
+    def record_digests(self, rows, lengths):
+        """
+        16-byte blake2b digests of the file records at rows (sprite ID - 1)
+        with the given exact lengths, hashed in place in the file buffers.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        digests = np.zeros(len(rows), dtype="S16")
+        starts = self._offsets[rows].astype(np.int64)
+        ends = starts + np.asarray(lengths, dtype=np.int64)
+        parts = self._parts[rows] if self._parts is not None else np.zeros(len(rows), dtype=np.uint16)
+        for part, view in enumerate(self._views):
+            picked = np.flatnonzero(parts == part)
+            digests[picked] = [
+                hashlib.blake2b(view[start:end], digest_size=16).digest()
+                for start, end in zip(starts[picked].tolist(), ends[picked].tolist())
+            ]
+        return digests
+
+    def write_payloads(self, f, count, base_offset, records=None, progress_callback=None):
+        """
+        Writes the payloads of sprites 1..count back to back, starting at
+        file offset base_offset, and returns the new offset table
+        (0 = empty sprite).
+        Clean sprites that follow each other in the source file are copied
+        as a single slice of the mapped file; only overlay sprites are
+        written one by one. `records` replaces every payload, in ID order
+        (used by size conversion).
+        """
+        offsets = np.zeros(count, dtype=np.uint32)
+        pos = base_offset
+
+        if records is not None:
+            for i, data in enumerate(records):
+                if progress_callback and i % 5000 == 0:
+                    progress_callback(i, count)
+                if data:
+                    offsets[i] = pos
+                    f.write(data)
+                    pos += len(data)
+            return offsets
+
+        # Exact record sizes: dead bytes left by incremental saves are dropped
+        src_offsets = self._offsets.tolist()
+        src_lengths = self.record_lengths().tolist()
+        src_parts = self._parts.tolist() if self._parts is not None else None
+        overlay = self.overlay
+
+        run_part = 0
+        run_start = run_end = -1
+
+        for i in range(count):
+            if progress_callback and i % 5000 == 0:
+                progress_callback(i, count)
+
+            data = overlay.get(i + 1)
+            if data is None and i < self._count:
+                offset = src_offsets[i]
+                length = src_lengths[i]
+                if offset == 0 or length == 0:
+                    continue
+
+                part = src_parts[i] if src_parts is not None else 0
+                if part == run_part and offset == run_end:
+                    run_end += length
+                else:
+                    if run_end > run_start:
+                        f.write(self._views[run_part][run_start:run_end])
+                    run_part, run_start, run_end = part, offset, offset + length
+
+                offsets[i] = pos
+                pos += length
+                continue
+
+            if data:
+                if run_end > run_start:
+                    f.write(self._views[run_part][run_start:run_end])
+                    run_start = run_end = -1
+                offsets[i] = pos
+                f.write(data)
+                pos += len(data)
+
+        if run_end > run_start:
+            f.write(self._views[run_part][run_start:run_end])
+
+        return offsets
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+
+        for buffer in self._buffers:
+            if isinstance(buffer, mmap.mmap):
+                try:
+                    buffer.close()
+                except BufferError:
+                    # A sprite slice is still referenced somewhere; the map
+                    # is released when it gets garbage collected.
+                    pass
+        self._buffers = []
+
+
+class SpriteCache:
+    """
+    LRU cache of decoded sprite images bounded by a memory budget in bytes
+    (a sprite costs width * height * 4). budget=0 disables caching.
+    """
+
+    def __init__(self, budget=64 * 1024 * 1024):
+        self.budget = budget
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sprite_id):
+        with self._lock:
+            entry = self._items.get(sprite_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(sprite_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, sprite_id, image):
+        cost = image.size[0] * image.size[1] * 4
+        if cost > self.budget:
+            return
+
+        with self._lock:
+            old = self._items.pop(sprite_id, None)
+            if old is not None:
+                self.used -= old[1]
+
+            self._items[sprite_id] = (image, cost)
+            self.used += cost
+
+            while self.used > self.budget:
+                _sid, (_img, old_cost) = self._items.popitem(last=False)
+                self.used -= old_cost
+                self.evictions += 1
+
+    def invalidate(self, sprite_id):
+        with self._lock:
+            old = self._items.pop(sprite_id, None)
+            if old is not None:
+                self.used -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.used = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "used": self.used,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
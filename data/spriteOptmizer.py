@@ -1,128 +1,149 @@
 import sys
 import struct
-import hashlib
+
+import numpy as np
 from PyQt6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
     QProgressBar, QTextEdit, QMessageBox, QGroupBox, QCheckBox
 )
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 
+from spr_handler import hash_sprite_records
+from sprite_clusters import cluster_remap_table, cluster_sprites, write_cluster_report
+
 class OptimizerWorker(QThread):
     progress = pyqtSignal(int)
     log = pyqtSignal(str)
     finished_scan = pyqtSignal(dict, int, int)
+    finished_clusters = pyqtSignal(object, dict)
 
     def __init__(self, spr_editor, dat_editor, clean_empty=True):
         super().__init__()
         self.spr = spr_editor
         self.dat = dat_editor
         self.clean_empty = clean_empty
+        self.compact = False
+        self.cluster_distance = 2  # max dHash/aHash bits apart to call sprites similar
+        self.merge_distance = 0  # similar sprites merged when "near duplicates" is on
         self.mode = "SCAN"
         self.remap_table = {}
-        self.empty_ids = [] 
+        self.empty_ids = []
+        self.empty_slots = []
 
     def run(self):
         if self.mode == "SCAN":
             self.scan_sprites()
         elif self.mode == "APPLY":
             self.apply_optimization()
+        elif self.mode == "CLUSTER":
+            self.find_similar()
 
     def is_visually_empty(self, data):
-        if not data or len(data) == 0:
-            return True
-
-        if len(data) < 10:
-
+        """True if a sprite record has no visible pixel (empty or fully transparent)."""
+        if not data:
             return True
-
-        try:
-
-            offset = 0
-            if len(data) > 64: 
-                return False
-
-            return False
-        except:
-            return False
+        empty, _digests = hash_sprite_records(
+            [bytes(data)], self.spr.sprite_size, self.spr.transparency
+        )
+        return bool(empty[0])
 
     def scan_sprites(self):
         self.log.emit("Starting scan...")
-        
+        self.empty_ids = []
+        self.empty_slots = []
+
+        total_sprites = self.spr.sprite_count
+        # Decoded pixels, not the RLE bytes: encodings differ for the same image
+        empty, digests = self.spr.pixel_digests(
+            progress_callback=lambda done, total: self.progress.emit(int(done * 95 / max(total, 1)))
+        )
+
         hashes = {}
         remap = {}
-        
+
         duplicates_count = 0
         empty_found_count = 0
-        
-        master_empty_id = None 
-        
-        total_sprites = self.spr.sprite_count
-        
-        for sprite_id in range(1, total_sprites + 1):
-            if sprite_id % 2000 == 0:
-                self.progress.emit(int((sprite_id / total_sprites) * 100))
-            
-            data = self.spr.sprites_data.get(sprite_id, b'')
-            
-            if len(data) == 0:
+        transparent_count = 0
+
+        master_empty_id = None
+
+        for index, digest in enumerate(digests.tolist()):
+            sprite_id = index + 1
+
+            if empty[index]:
+                self.empty_slots.append(sprite_id)
+                if self.spr.sprites_data.get(sprite_id):
+                    transparent_count += 1
                 if master_empty_id is None:
                     master_empty_id = sprite_id
-                  
                 else:
-
                     remap[sprite_id] = master_empty_id
                     self.empty_ids.append(sprite_id)
                     empty_found_count += 1
                 continue
 
-            md5 = hashlib.md5(data).hexdigest()
-
-            if md5 in hashes:
-
-                original_id = hashes[md5]
+            original_id = hashes.setdefault(digest, sprite_id)
+            if original_id != sprite_id:
                 remap[sprite_id] = original_id
-                
-                self.empty_ids.append(sprite_id) 
+                self.empty_ids.append(sprite_id)
                 duplicates_count += 1
-            else:
-                hashes[md5] = sprite_id
 
         self.log.emit("-" * 30)
         self.log.emit("-" * 30)
         self.log.emit("Scan completed.")
         self.log.emit(f"Total sprites: {total_sprites}")
-        self.log.emit(f"Empty merged: {empty_found_count}")
+        self.log.emit(f"Empty merged: {empty_found_count} ({transparent_count} fully transparent)")
         self.log.emit(f"Visual duplicates: {duplicates_count}")
         self.log.emit(f"Total to optimize: {len(remap)}")
 
         self.progress.emit(100)
         self.finished_scan.emit(remap, duplicates_count, empty_found_count)
 
-    def apply_optimization(self):
-        if not self.remap_table:
-            self.log.emit("Nothing to do.")
-            return
+    def find_similar(self):
+        """Clusters near-duplicate, mirrored and flipped sprites and writes a CSV report."""
+        self.log.emit("Hashing sprites (dHash / aHash)...")
+        dhash, ahash, visible = self.spr.perceptual_hashes(
+            progress_callback=lambda done, total: self.progress.emit(int(done * 70 / max(total, 1)))
+        )
+        self.log.emit("Grouping similar sprites...")
+        clusters = cluster_sprites(
+            dhash, ahash, visible, self.cluster_distance,
+            progress_callback=lambda step, steps: self.progress.emit(70 + int(step * 29 / max(steps, 1))),
+        )
 
-        self.log.emit("Updating references in the DAT...")
+        self.log.emit("Comparing the pixels of near duplicates...")
+        merge = cluster_remap_table(clusters, self.spr.get_sprites, self.merge_distance)
+        transformed = sum(
+            1 for cluster in clusters for member in cluster[1:] if member.transform != "identity"
+        )
+        self.log.emit("-" * 30)
+        self.log.emit(f"Similar groups: {len(clusters)} ({sum(len(c) for c in clusters)} sprites)")
+        self.log.emit(f"Near duplicates (mergeable): {len(merge)}")
+        self.log.emit(f"Mirrored / flipped matches: {transformed}")
 
-        categories = ['items', 'outfits', 'effects', 'missiles']
-        updated_things = 0
-        total_steps = sum(len(self.dat.things[cat]) for cat in categories)
-        current_step = 0
+        source = self.spr.spr_source
+        report_path = (source[0] if isinstance(source, list) else source) + ".clusters.csv"
+        try:
+            write_cluster_report(clusters, report_path, merge)
+            self.log.emit(f"Report: {report_path}")
+        except OSError as e:
+            self.log.emit(f"Could not write the report: {e}")
 
-        for cat in categories:
-            for thing_id, thing in self.dat.things[cat].items():
-                current_step += 1
-                if current_step % 1000 == 0:
-                     self.progress.emit(int((current_step / total_steps) * 90))
+        self.progress.emit(100)
+        self.finished_clusters.emit(clusters, merge)
 
-                texture_bytes = thing.get('texture_bytes', b'')
-                if not texture_bytes: continue
+    def apply_optimization(self):
+        # Compaction also drops empty slots that have nothing to merge into
+        if not self.remap_table and not (self.compact and self.empty_slots):
+            self.log.emit("Nothing to do.")
+            return
+        if self.compact:
+            self.apply_compaction()
+            return
 
-                new_bytes, changed = self.replace_sprites_in_texture(texture_bytes, self.remap_table)
-                if changed:
-                    thing['texture_bytes'] = new_bytes
-                    updated_things += 1
+        self.log.emit("Updating references in the DAT...")
+        updated_things = self.dat.remap_sprites(self.remap_table)
+        self.progress.emit(90)
 
         self.log.emit(f"Updated references: {updated_things}")
 
@@ -136,55 +157,28 @@ class OptimizerWorker(QThread):
         self.log.emit("Optimization Complete! Save the DAT and SPR.")
         self.progress.emit(100)
 
-    def replace_sprites_in_texture(self, texture_bytes, remap_table):
-        """Mesma lógica de byte-patching anterior"""
-        try:
-            if not texture_bytes or len(texture_bytes) < 2: return texture_bytes, False
-            offset = 0
-            width, height = struct.unpack_from('<BB', texture_bytes, offset)
-            offset += 2
-            if width > 1 or height > 1: offset += 1 
-            if offset + 5 > len(texture_bytes): return texture_bytes, False
-            layers, px, py, pz, frames = struct.unpack_from('<BBBBB', texture_bytes, offset)
-            offset += 5
-            if frames > 1:
-                anim_size = 1 + 4 + 1 + (frames * 8)
-                offset += anim_size
-
-            total_sprites = width * height * px * py * pz * layers * frames
-            remaining_bytes = len(texture_bytes) - offset
-            if total_sprites == 0: return texture_bytes, False
-            sprite_id_size = remaining_bytes // total_sprites
-            if sprite_id_size not in (2, 4): return texture_bytes, False
-
-            fmt = '<I' if sprite_id_size == 4 else '<H'
-            
-            current_ids = []
-            read_offset = offset
-            for _ in range(total_sprites):
-                val = struct.unpack_from(fmt, texture_bytes, read_offset)[0]
-                current_ids.append(val)
-                read_offset += sprite_id_size
-
-            has_changes = False
-            new_ids = []
-            for sid in current_ids:
-                if sid in remap_table:
-                    new_ids.append(remap_table[sid])
-                    has_changes = True
-                else:
-                    new_ids.append(sid)
+    def apply_compaction(self):
+        """
+        Drops duplicate and empty sprites from the SPR, renumbers the rest
+        densely and rewrites every thing with one old -> new lookup table.
+        Duplicates point at their original's new ID, empty sprites become 0.
+        """
+        old_count = self.spr.sprite_count
+        self.log.emit("Removing freed sprites from the SPR...")
+        lookup = self.spr.drop_sprites(set(self.remap_table) | set(self.empty_slots))
+        self.progress.emit(30)
 
-            if not has_changes: return texture_bytes, False
+        keys = np.fromiter(self.remap_table.keys(), dtype=np.int64, count=len(self.remap_table))
+        values = np.fromiter(self.remap_table.values(), dtype=np.int64, count=len(self.remap_table))
+        lookup[keys] = lookup[values]
 
-            header_part = texture_bytes[:offset]
-            ids_part = bytearray()
-            for nid in new_ids:
-                ids_part.extend(struct.pack(fmt, nid))
+        self.log.emit("Renumbering references in the DAT...")
+        updated_things = self.dat.remap_sprites(lookup)
 
-            return header_part + ids_part, True
-        except:
-            return texture_bytes, False
+        self.log.emit(f"Updated references: {updated_things}")
+        self.log.emit(f"Sprites: {old_count} -> {self.spr.sprite_count}")
+        self.log.emit("Compaction Complete! Save the DAT and SPR.")
+        self.progress.emit(100)
 
 class SpriteOptimizerWindow(QDialog):
     def __init__(self, spr_editor, dat_editor, parent=None):
@@ -192,6 +186,8 @@ class SpriteOptimizerWindow(QDialog):
         self.spr = spr_editor
         self.dat = dat_editor
         self.remap_table = {}
+        self.clusters = []
+        self.near_remap = {}  # near duplicates from Find Similar, pixel-checked
         
         self.setWindowTitle("Sprite Optimizer & Cleaner")
         self.resize(650, 550)
@@ -234,6 +230,7 @@ class SpriteOptimizerWindow(QDialog):
         self.worker.progress.connect(self.update_progress)
         self.worker.log.connect(self.add_log)
         self.worker.finished_scan.connect(self.on_scan_finished)
+        self.worker.finished_clusters.connect(self.on_clusters_finished)
 
     def init_ui(self):
         layout = QVBoxLayout(self)
@@ -246,7 +243,8 @@ class SpriteOptimizerWindow(QDialog):
             "1. Identifies duplicate sprites (same hash).\n"
             "2. Identifies empty sprites.\n"
             "3. Redirects references in the DAT to save IDs.\n"
-            "4. Clears the content of unused sprites in the SPR."
+            "4. Clears the content of unused sprites in the SPR.\n"
+            "Find Similar groups near-duplicate, mirrored and flipped sprites in a CSV report."
         )
 
         info_lbl.setWordWrap(True)
@@ -259,6 +257,12 @@ class SpriteOptimizerWindow(QDialog):
         self.chk_clean = QCheckBox("Wipe optimized sprites data (Save space)")
         self.chk_clean.setChecked(True)
         opt_layout.addWidget(self.chk_clean)
+        self.chk_compact = QCheckBox("Compact SPR (remove freed sprites, renumber IDs)")
+        self.chk_compact.setChecked(False)
+        opt_layout.addWidget(self.chk_compact)
+        self.chk_near = QCheckBox("Merge near duplicates (Find Similar)")
+        self.chk_near.setChecked(False)
+        opt_layout.addWidget(self.chk_near)
         opt_group.setLayout(opt_layout)
         layout.addWidget(opt_group)
 
@@ -325,6 +329,14 @@ class SpriteOptimizerWindow(QDialog):
         self.btn_scan.clicked.connect(self.start_scan)
         btn_layout.addWidget(self.btn_scan)
 
+        self.btn_similar = QPushButton("FIND SIMILAR")
+        self.btn_similar.setFixedHeight(45)
+        self.btn_similar.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.btn_similar.setStyleSheet(self.btn_scan.styleSheet().replace("#4a90e2", "#8e44ad"))
+        self.btn_similar.setToolTip("Groups near-duplicate, mirrored and flipped sprites into a CSV report.")
+        self.btn_similar.clicked.connect(self.start_similar)
+        btn_layout.addWidget(self.btn_similar)
+
         self.btn_apply = QPushButton("2. OPTIMIZE & CLEAN")
         self.btn_apply.setFixedHeight(45)
         self.btn_apply.setCursor(Qt.CursorShape.PointingHandCursor)
@@ -365,15 +377,35 @@ class SpriteOptimizerWindow(QDialog):
 
     def start_scan(self):
         self.btn_scan.setEnabled(False)
+        self.btn_similar.setEnabled(False)
         self.btn_apply.setEnabled(False)
         self.log_area.clear()
         self.progress_bar.setValue(0)
         self.worker.mode = "SCAN"
         self.worker.start()
 
+    def start_similar(self):
+        self.btn_scan.setEnabled(False)
+        self.btn_similar.setEnabled(False)
+        self.btn_apply.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.worker.mode = "CLUSTER"
+        self.worker.start()
+
+    def on_clusters_finished(self, clusters, merge):
+        self.clusters = clusters
+        self.near_remap = merge
+        self.btn_scan.setEnabled(True)
+        self.btn_similar.setEnabled(True)
+        if self.remap_table or merge:
+            self.btn_apply.setEnabled(True)
+        if clusters:
+            self.add_log("Check 'Merge near duplicates' to include them when optimizing.")
+
     def on_scan_finished(self, remap_dict, dup_count, empty_count):
         self.remap_table = remap_dict
         self.btn_scan.setEnabled(True)
+        self.btn_similar.setEnabled(True)
         
         total = dup_count + empty_count
         if total > 0:
@@ -381,15 +413,31 @@ class SpriteOptimizerWindow(QDialog):
             self.add_log(f"\n--- RESULT ---")
             self.add_log(f"Potential savings: {total} sprites.")
             self.add_log("Click 'Optimize' to apply.")
+        elif self.worker.empty_slots:
+            self.btn_apply.setEnabled(True)
+            self.add_log(f"\nEmpty slots: {len(self.worker.empty_slots)}. Check 'Compact SPR' to remove them.")
         else:
             self.add_log("\nNo optimization needed.")
 
 
     def start_apply(self):
         self.worker.clean_empty = self.chk_clean.isChecked()
-        self.worker.remap_table = self.remap_table
+        self.worker.compact = self.chk_compact.isChecked()
+        remap = dict(self.remap_table)
+        if self.chk_near.isChecked():
+            for sprite_id, head in self.near_remap.items():
+                remap.setdefault(sprite_id, head)
+        # Scan and cluster entries chain (5 -> 3 -> 1): point each at its final sprite
+        for sprite_id, target in remap.items():
+            while remap.get(target, target) != target:
+                target = remap[target]
+            remap[sprite_id] = target
+        self.worker.remap_table = remap
+        # Every remapped sprite is freed: rebuilt on each run, never appended to
+        self.worker.empty_ids = list(remap)
         self.worker.mode = "APPLY"
         
         self.btn_scan.setEnabled(False)
+        self.btn_similar.setEnabled(False)
         self.btn_apply.setEnabled(False)
         self.worker.start()
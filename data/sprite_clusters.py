@@ -0,0 +1,445 @@
+# Perceptual hashing and clustering of sprites: finds near duplicates (a
+# pixel or two apart) and mirrored / flipped copies, which the exact pixel
+# digests of the optimizer scan can't see.
+#
+# Each sprite is reduced to a grid of gray cell means (composited on mid
+# gray, so transparent and black pixels differ) and gets two 64-bit hashes
+# for itself and its mirror, flip and 180 degree variants:
+#   dHash: 8 rows of 9 cells, one bit per left < right comparison
+#   aHash: 8x8 cells, one bit per cell above the sprite's mean
+# Grid bins are symmetric, so a variant's hash is the hash of the flipped
+# grid and the sprite is decoded only once.
+#
+# Candidates come from multi-index hashing: the 64 bits are cut into
+# max_distance + 1 chunks, and two hashes at most max_distance bits apart
+# agree exactly on at least one chunk, so only same-chunk buckets are
+# compared instead of every pair.
+#
+# SpriteHashIndex keeps the hashes of a whole SPR for reverse image search
+# (find the sprites that look like a PNG).
+
+import csv
+from collections import namedtuple
+
+import numpy as np
+
+from spr_handler import decode_sprite_records
+
+TRANSFORMS = ("identity", "mirror", "flip", "rotate180")
+HASH_BITS = 64
+CLUSTER_BATCH = 65536  # queries per candidate join, bounds memory
+HASH_INDEX_SUFFIX = ".phash"
+SEARCH_DISTANCE = 24  # max dHash + aHash bits apart for find_similar results
+MERGE_PIXELS = 2  # max RGBA pixels a near duplicate may differ by to be merged
+MERGE_BATCH = 4096  # sprite pairs decoded at once by cluster_remap_table
+
+# One sprite of a cluster: how it relates to the cluster's first sprite
+# (distance / ahash_distance = dHash / aHash bits apart under transform)
+ClusterMember = namedtuple("ClusterMember", "sprite_id transform distance ahash_distance")
+# One find_similar result: score = dHash + aHash bits apart (0 = same hashes)
+SearchMatch = namedtuple("SearchMatch", "sprite_id score transform")
+
+_POPCOUNT = np.array([bin(n).count("1") for n in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """Set bits of every uint64 in an array (numpy < 2 has no bitwise_count)."""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return _POPCOUNT[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1, dtype=np.int32)
+
+
+# numpy >= 2 counts bits natively, much faster for whole-index searches
+_bit_distance = getattr(np, "bitwise_count", popcount)
+
+
+def _bin_edges(size, bins):
+    return np.round(np.linspace(0, size, bins + 1)).astype(np.intp)
+
+
+def _cell_means(gray, row_bins, col_bins):
+    rows = _bin_edges(gray.shape[1], row_bins)
+    cols = _bin_edges(gray.shape[2], col_bins)
+    sums = np.add.reduceat(np.add.reduceat(gray, rows[:-1], axis=1), cols[:-1], axis=2)
+    return sums / np.outer(np.diff(rows), np.diff(cols))
+
+
+def _pack_bits(bits):
+    """(N, 64) bools -> (N,) uint64, first bit highest."""
+    return np.packbits(bits, axis=1).view(">u8").reshape(-1).astype(np.uint64)
+
+
+def _variants(grid):
+    """grid in TRANSFORMS order: as is, mirrored, flipped, rotated 180."""
+    return (grid, grid[:, :, ::-1], grid[:, ::-1, :], grid[:, ::-1, ::-1])
+
+
+def perceptual_hashes(pixels):
+    """
+    dHash and aHash of (N, S, S, 4) RGBA sprites and their variants.
+    Returns (dhash, ahash, visible): (N, 4) uint64 arrays in TRANSFORMS
+    order and the number of visible pixels of each sprite.
+    """
+    pixels = np.asarray(pixels)
+    alpha = pixels[..., 3].astype(np.float32) / 255
+    luma = pixels[..., :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    gray = luma * alpha + 128 * (1 - alpha)
+    visible = np.count_nonzero(pixels[..., 3], axis=(1, 2)).astype(np.int32)
+
+    count = len(pixels)
+    dhash = np.empty((count, len(TRANSFORMS)), dtype=np.uint64)
+    ahash = np.empty((count, len(TRANSFORMS)), dtype=np.uint64)
+    for n, grid in enumerate(_variants(_cell_means(gray, 8, 9))):
+        dhash[:, n] = _pack_bits((grid[:, :, :-1] < grid[:, :, 1:]).reshape(count, -1))
+    for n, grid in enumerate(_variants(_cell_means(gray, 8, 8))):
+        flat = grid.reshape(count, -1)
+        ahash[:, n] = _pack_bits(flat > flat.mean(axis=1, keepdims=True))
+    return dhash, ahash, visible
+
+
+def perceptual_hash_records(records, sprite_size, transparency):
+    """Decodes raw sprite records and hashes them (also a process-pool worker)."""
+    return perceptual_hashes(decode_sprite_records(records, sprite_size, transparency))
+
+
+class MultiIndexHash:
+    """
+    Index of 64-bit hashes for Hamming distance searches up to
+    max_distance. One sorted table per chunk of bits; a search only looks
+    at the hashes that share a chunk with the query.
+    """
+
+    def __init__(self, hashes, max_distance=2):
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        self.max_distance = max_distance
+        chunks = max_distance + 1
+        widths = [HASH_BITS // chunks + (n < HASH_BITS % chunks) for n in range(chunks)]
+        self.chunks = []  # (shift, mask)
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self.chunks.append((np.uint64(shift), np.uint64((1 << width) - 1)))
+
+        self.tables = []  # (sorted chunk values, hash positions)
+        for shift, mask in self.chunks:
+            keys = (self.hashes >> shift) & mask
+            order = np.argsort(keys, kind="stable")
+            self.tables.append((keys[order], order))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def candidates(self, queries, max_bucket=None):
+        """
+        (query position, hash position) pairs that share at least one
+        chunk, possibly repeated. Buckets over max_bucket entries (flat,
+        featureless hashes) are skipped.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.uint64)
+        found_queries = []
+        found_hashes = []
+        for (shift, mask), (keys, order) in zip(self.chunks, self.tables):
+            values = (queries >> shift) & mask
+            lo = np.searchsorted(keys, values, "left")
+            hi = np.searchsorted(keys, values, "right")
+            sizes = hi - lo
+            if max_bucket is not None:
+                sizes[sizes > max_bucket] = 0
+            total = int(sizes.sum())
+            if not total:
+                continue
+            first = np.cumsum(sizes) - sizes
+            query_pos = np.repeat(np.arange(len(queries)), sizes)
+            slot = np.repeat(lo - first, sizes) + np.arange(total)
+            found_queries.append(query_pos)
+            found_hashes.append(order[slot])
+        if not found_queries:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(found_queries), np.concatenate(found_hashes)
+
+    def search(self, query, max_distance=None, max_bucket=None):
+        """Positions of the hashes within max_distance bits of one query, and their distances."""
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        _, found = self.candidates(np.array([query], dtype=np.uint64), max_bucket)
+        found = np.unique(found)
+        distance = popcount(self.hashes[found] ^ np.uint64(query))
+        keep = distance <= max_distance
+        return found[keep], distance[keep]
+
+
+def _components(count, left, right):
+    """Connected component label (smallest member) of every node, by min-label propagation."""
+    labels = np.arange(count, dtype=np.int64)
+    while len(left):
+        low = np.minimum(labels[left], labels[right])
+        before = labels.copy()
+        np.minimum.at(labels, left, low)
+        np.minimum.at(labels, right, low)
+        labels = labels[labels]
+        if np.array_equal(labels, before):
+            break
+    return labels
+
+
+def cluster_sprites(dhash, ahash, visible, max_distance=2, min_pixels=16, max_bucket=512,
+                    progress_callback=None):
+    """
+    Groups sprites whose dHash and aHash (of the sprite or one of its
+    variants) are at most max_distance bits apart. dhash/ahash/visible
+    come from SprEditor.perceptual_hashes (row = sprite ID - 1); sprites
+    with fewer than min_pixels visible pixels are left out.
+
+    Returns clusters sorted by size, each a list of ClusterMember with the
+    lowest sprite ID first; the others tell which transform of that first
+    sprite they match and at what dHash and aHash distance.
+    """
+    dhash = np.asarray(dhash, dtype=np.uint64)
+    ahash = np.asarray(ahash, dtype=np.uint64)
+    sprite_ids = np.flatnonzero(np.asarray(visible) >= min_pixels) + 1
+    if not len(sprite_ids):
+        return []
+
+    # Equal hashes (exact duplicates, mostly) are clustered as one key
+    keys = np.stack((dhash[sprite_ids - 1, 0], ahash[sprite_ids - 1, 0]), axis=1)
+    keys, key_of = np.unique(keys, axis=0, return_inverse=True)
+    key_of = key_of.reshape(-1)
+    first_sprite = np.full(len(keys), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first_sprite, key_of, sprite_ids)
+    key_dhash = dhash[first_sprite - 1]
+    key_ahash = ahash[first_sprite - 1]
+
+    index = MultiIndexHash(key_dhash[:, 0], max_distance)
+    lefts = []
+    rights = []
+    steps = len(TRANSFORMS) * ((len(keys) + CLUSTER_BATCH - 1) // CLUSTER_BATCH)
+    step = 0
+    for variant in range(len(TRANSFORMS)):
+        for start in range(0, len(keys), CLUSTER_BATCH):
+            queries = np.arange(start, min(start + CLUSTER_BATCH, len(keys)))
+            query_pos, found = index.candidates(key_dhash[queries, variant], max_bucket)
+            query = queries[query_pos]
+            keep = query < found  # variants are their own inverse: one side is enough
+            query, found = query[keep], found[keep]
+            close = (
+                (popcount(key_dhash[query, variant] ^ key_dhash[found, 0]) <= max_distance)
+                & (popcount(key_ahash[query, variant] ^ key_ahash[found, 0]) <= max_distance)
+            )
+            lefts.append(query[close])
+            rights.append(found[close])
+            step += 1
+            if progress_callback:
+                progress_callback(step, steps)
+
+    left = np.concatenate(lefts) if lefts else np.zeros(0, dtype=np.int64)
+    right = np.concatenate(rights) if rights else np.zeros(0, dtype=np.int64)
+    labels = _components(len(keys), left, right)[key_of]
+
+    order = np.lexsort((sprite_ids, labels))
+    labels, members = labels[order], sprite_ids[order]
+    bounds = np.flatnonzero(np.diff(labels)) + 1
+    clusters = []
+    for group in np.split(members, bounds):
+        if len(group) < 2:
+            continue
+        head = int(group[0])
+        # Relation of each member to the head: the closest of the head's variants
+        distance = popcount(dhash[head - 1][None, :] ^ dhash[group - 1, 0][:, None])
+        transform = distance.argmin(axis=1)
+        rows = np.arange(len(group))
+        distance = distance[rows, transform]
+        ahash_distance = popcount(ahash[head - 1][transform] ^ ahash[group - 1, 0])
+        clusters.append(
+            [
+                ClusterMember(sprite_id, TRANSFORMS[t], d, a)
+                for sprite_id, t, d, a in zip(
+                    group.tolist(), transform.tolist(), distance.tolist(), ahash_distance.tolist()
+                )
+            ]
+        )
+    clusters.sort(key=lambda cluster: (-len(cluster), cluster[0].sprite_id))
+    return clusters
+
+
+def cluster_remap_table(clusters, sprite_pixels, max_distance=0, max_pixels=MERGE_PIXELS):
+    """
+    {sprite_id: first sprite of its cluster} for the members a sprite
+    optimizer can merge into it: untransformed, dHash and aHash within
+    max_distance bits, and at most max_pixels RGBA pixels different.
+    The hashes are grayscale, so only the pixels tell a red potion from
+    a green one. sprite_pixels(ids) returns (N, S, S, 4) RGBA arrays
+    (e.g. SprEditor.get_sprites). Mirrored / flipped matches are only
+    reported, a DAT can't reference a flipped sprite.
+    """
+    pairs = [
+        (member.sprite_id, cluster[0].sprite_id)
+        for cluster in clusters
+        for member in cluster[1:]
+        if member.transform == "identity"
+        and member.distance <= max_distance
+        and member.ahash_distance <= max_distance
+    ]
+    remap = {}
+    for start in range(0, len(pairs), MERGE_BATCH):
+        batch = np.array(pairs[start:start + MERGE_BATCH], dtype=np.int64)
+        members = sprite_pixels(batch[:, 0])
+        heads = sprite_pixels(batch[:, 1])
+        # Fully transparent pixels match whatever their color bytes
+        members[members[..., 3] == 0] = 0
+        heads[heads[..., 3] == 0] = 0
+        changed = (members != heads).any(axis=-1).sum(axis=(1, 2))
+        for sprite_id, head in batch[changed <= max_pixels].tolist():
+            remap[sprite_id] = head
+    return remap
+
+
+def write_cluster_report(clusters, path, merge=()):
+    """
+    Writes the clusters as CSV for review: one row per sprite with its
+    cluster, the cluster's first sprite, transform, dHash and aHash
+    distance and the suggested action (merge = in `merge`, the
+    cluster_remap_table; review = the rest, hash matches included).
+    """
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["cluster", "sprite_id", "representative", "transform", "distance", "ahash_distance", "action"]
+        )
+        for number, cluster in enumerate(clusters, 1):
+            head = cluster[0].sprite_id
+            for member in cluster:
+                if member.sprite_id == head:
+                    action = "keep"
+                else:
+                    action = "merge" if member.sprite_id in merge else "review"
+                writer.writerow(
+                    [
+                        number, member.sprite_id, head, member.transform,
+                        member.distance, member.ahash_distance, action,
+                    ]
+                )
+    return path
+
+
+def image_tiles(pixels, sprite_size):
+    """
+    Cuts an (H, W, 4) RGBA image into sprite_size tiles, row by row.
+    Images that don't fill whole tiles are padded on the top / left, like
+    a multi-tile thing drawn from its bottom-right corner. Returns
+    (tiles, positions): an (N, S, S, 4) array and the (row, column) of
+    each tile; fully transparent tiles are left out.
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    height, width = pixels.shape[:2]
+    rows = max(1, -(-height // sprite_size))
+    cols = max(1, -(-width // sprite_size))
+    canvas = np.zeros((rows * sprite_size, cols * sprite_size, 4), dtype=np.uint8)
+    canvas[rows * sprite_size - height:, cols * sprite_size - width:] = pixels
+
+    tiles = canvas.reshape(rows, sprite_size, cols, sprite_size, 4).swapaxes(1, 2)
+    tiles = tiles.reshape(rows * cols, sprite_size, sprite_size, 4)
+    positions = [(row, col) for row in range(rows) for col in range(cols)]
+    visible = tiles[..., 3].any(axis=(1, 2))
+    return tiles[visible], [pos for pos, keep in zip(positions, visible) if keep]
+
+
+class SpriteHashIndex:
+    """
+    Perceptual hashes of every sprite of an SPR (row = sprite ID - 1), for
+    "is this image already in the SPR?" searches. Built in bulk by
+    SprEditor.perceptual_hashes and kept in a SessionCache file next to
+    the SPR; sprites written afterwards are marked stale and re-hashed
+    before the next search. A search compares the query with every row at
+    once, which takes a few milliseconds even for hundreds of thousands
+    of sprites.
+    """
+
+    def __init__(self, dhash, ahash, visible):
+        self.dhash = np.array(dhash, dtype=np.uint64)
+        self.ahash = np.array(ahash, dtype=np.uint64)
+        self.visible = np.array(visible, dtype=np.int32)
+        self.stale = set()
+        self.persisted = False  # matches the cache file of the SPR on disk
+
+    @classmethod
+    def build(cls, spr, workers=None, progress_callback=None):
+        return cls(*spr.perceptual_hashes(workers, progress_callback))
+
+    @classmethod
+    def from_sections(cls, sections):
+        """Index from SessionCache sections (copied: the cache is read-only), or None."""
+        try:
+            index = cls(sections["phash.dhash"], sections["phash.ahash"], sections["phash.visible"])
+        except KeyError:
+            return None
+        index.persisted = True
+        return index
+
+    def sections(self):
+        return {"phash.dhash": self.dhash, "phash.ahash": self.ahash, "phash.visible": self.visible}
+
+    def __len__(self):
+        return len(self.visible)
+
+    def mark_stale(self, sprite_id):
+        self.stale.add(sprite_id)
+        self.persisted = False
+
+    def keep(self, sprite_ids):
+        """Keeps the rows of sprite_ids, renumbered 1..n (after SprEditor.drop_sprites)."""
+        rows = np.asarray(sprite_ids, dtype=np.int64) - 1
+        rows = rows[rows < len(self)]
+        self.dhash, self.ahash, self.visible = self.dhash[rows], self.ahash[rows], self.visible[rows]
+        self.stale = set()
+        self.persisted = False
+
+    def refresh(self, spr):
+        """Re-hashes the stale sprites and the ones added past the end."""
+        count = spr.sprite_count
+        if count > len(self):
+            grow = count - len(self)
+            self.stale.update(range(len(self) + 1, count + 1))
+            self.dhash = np.concatenate((self.dhash, np.zeros((grow, len(TRANSFORMS)), dtype=np.uint64)))
+            self.ahash = np.concatenate((self.ahash, np.zeros((grow, len(TRANSFORMS)), dtype=np.uint64)))
+            self.visible = np.concatenate((self.visible, np.zeros(grow, dtype=np.int32)))
+            self.persisted = False
+        ids = sorted(sprite_id for sprite_id in self.stale if 1 <= sprite_id <= len(self))
+        self.stale = set()
+        if ids:
+            rows = np.array(ids, dtype=np.int64) - 1
+            self.dhash[rows], self.ahash[rows], self.visible[rows] = perceptual_hashes(spr.get_sprites(ids))
+
+    def search(self, pixels, limit=20, max_score=SEARCH_DISTANCE, transforms=True):
+        """
+        Sprites that look like one (S, S, 4) RGBA tile, best first, as
+        SearchMatch. With transforms, mirrored / flipped copies match too
+        (transform = how the sprite was turned to look like the query).
+        """
+        dhash, ahash, visible = perceptual_hashes(np.asarray(pixels, dtype=np.uint8)[None])
+        if not visible[0]:
+            return []
+        variants = range(len(TRANSFORMS)) if transforms else range(1)
+
+        score = None
+        for n in variants:
+            # Query variant n == sprite means sprite turned by n == query (all are involutions)
+            variant_score = _bit_distance(self.dhash[:, 0] ^ dhash[0, n]).astype(np.uint8)
+            variant_score += _bit_distance(self.ahash[:, 0] ^ ahash[0, n]).astype(np.uint8)
+            if score is None:
+                score, transform = variant_score, np.zeros(len(self), dtype=np.uint8)
+            else:
+                better = variant_score < score
+                np.copyto(score, variant_score, where=better)
+                transform[better] = n
+
+        candidates = np.flatnonzero((score <= max_score) & (self.visible > 0))
+        # Best score first, then lowest sprite ID
+        rank = score[candidates].astype(np.int64) * (len(self) + 1) + candidates
+        if len(candidates) > limit:
+            keep = np.argpartition(rank, limit - 1)[:limit]
+            candidates, rank = candidates[keep], rank[keep]
+        candidates = candidates[np.argsort(rank)]
+        return [
+            SearchMatch(int(row) + 1, int(score[row]), TRANSFORMS[transform[row]])
+            for row in candidates.tolist()
+        ]
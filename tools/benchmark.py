@@ -0,0 +1,312 @@
+# Performance benchmarks for the Spr/Dat editor backend.
+#
+#   py tools/benchmark.py spr-load
+#   py tools/benchmark.py dat-load
+#   py tools/benchmark.py dat-memory [--dat Tibia.dat]
+#   py tools/benchmark.py decode
+#   py tools/benchmark.py encode
+#   py tools/benchmark.py query
+#
+# Every benchmark runs on synthetic files written to a temp folder, so no
+# client files are needed (dat-memory can also measure a real client .dat).
+
+import argparse
+import gc
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data_path = os.path.join(base_path, "data")
+if data_path not in sys.path:
+    sys.path.append(data_path)
+
+from dat_editor import DatEditor
+from dat_handler import METADATA_FLAGS
+from dat_query import select
+from datspr import SprEditor
+
+
+def make_sprite_payload(rng, size=32, transparency=False):
+    """Random RLE sprite: alternating transparent / colored runs."""
+    total = size * size
+    bpp = 4 if transparency else 3
+    out = bytearray()
+    drawn = 0
+    while drawn < total:
+        trans = min(rng.randint(0, 40), total - drawn)
+        drawn += trans
+        colored = min(rng.randint(0, 40), total - drawn)
+        drawn += colored
+        out += struct.pack("<HH", trans, colored)
+        out += bytes(rng.getrandbits(8) for _ in range(colored * bpp))
+    return bytes(out)
+
+
+def write_spr(path, count, transparency=False, empty_ratio=0.1, seed=1):
+    rng = random.Random(seed)
+    # A small pool keeps generation fast; offsets are still unique per sprite.
+    pool = [make_sprite_payload(rng, transparency=transparency) for _ in range(64)]
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<II", 0x12345678, count))
+        table_pos = f.tell()
+        f.write(b"\x00" * (count * 4))
+
+        offsets = []
+        for _ in range(count):
+            if rng.random() < empty_ratio:
+                offsets.append(0)
+                continue
+            payload = rng.choice(pool)
+            offsets.append(f.tell())
+            if not transparency:
+                f.write(b"\xff\x00\xff")
+            f.write(struct.pack("<H", len(payload)))
+            f.write(payload)
+
+        f.seek(table_pos)
+        f.write(struct.pack(f"<{count}I", *offsets))
+
+
+def make_thing(rng, outfit=False, extended=False):
+    """Random DAT thing: some flags, then one texture (or frame groups for outfits)."""
+    out = bytearray()
+    for flag in sorted(rng.sample(range(0x34), rng.randint(0, 6))):
+        name, fmt = METADATA_FLAGS[flag]
+        out.append(flag)
+        if name == "MarketItem":
+            market_name = b"item%d" % rng.randint(0, 9999)
+            out += struct.pack("<HHHH", 1, 2, 3, len(market_name)) + market_name + b"\x00\x00\x01\x00"
+        elif fmt:
+            out += bytes(rng.getrandbits(8) for _ in range(struct.calcsize(fmt)))
+    out.append(0xFF)
+
+    groups = rng.randint(1, 3) if outfit else 1
+    if outfit:
+        out.append(groups)
+    for group in range(groups):
+        if outfit:
+            out.append(group)
+        w, h = rng.choice([(1, 1), (1, 1), (2, 2), (1, 2)])
+        out += bytes((w, h))
+        if w > 1 or h > 1:
+            out.append(64)
+        layers, px, py, pz = (2, 4, 1, 1) if outfit else (1, rng.randint(1, 2), 1, 1)
+        frames = rng.choice([1, 1, 3])
+        out += bytes((layers, px, py, pz, frames))
+        if frames > 1:
+            out += struct.pack("<BIB", 1, 0, 0)
+            for _ in range(frames):
+                out += struct.pack("<II", 100, 200)
+        total = w * h * layers * px * py * pz * frames
+        fmt = "I" if extended else "H"
+        out += struct.pack(f"<{total}{fmt}", *(rng.randint(1, 60000) for _ in range(total)))
+    return bytes(out)
+
+
+def write_dat(path, items, outfits=0, effects=0, missiles=0, extended=False, seed=1):
+    rng = random.Random(seed)
+    pool = [make_thing(rng, extended=extended) for _ in range(256)]
+    outfit_pool = [make_thing(rng, outfit=True, extended=extended) for _ in range(64)]
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHHH", 0x12345678, items + 99, outfits, effects, missiles))
+        for _ in range(items):
+            f.write(rng.choice(pool))
+        for _ in range(outfits):
+            f.write(rng.choice(outfit_pool))
+        for _ in range(effects + missiles):
+            f.write(rng.choice(pool))
+
+
+def bench_dat_load(args):
+    print(f"{'things':>10} {'load (s)':>10} {'us/thing':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.counts:
+            path = os.path.join(tmp, f"bench_{count}.dat")
+            write_dat(path, count, outfits=count // 20, effects=count // 50, missiles=count // 100)
+            things = count + count // 20 + count // 50 + count // 100
+
+            best = None
+            for _ in range(args.repeat):
+                dat = DatEditor(path)
+                start = time.perf_counter()
+                dat.load()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            print(f"{things:>10} {best:>10.3f} {best / things * 1e6:>10.2f}")
+
+
+def bench_dat_memory(args):
+    """Python heap held by a loaded DAT (tracemalloc), on a client file or a synthetic one."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.dat
+        if not path:
+            path = os.path.join(tmp, "bench.dat")
+            write_dat(path, args.items, outfits=args.items // 20, effects=args.items // 50,
+                      missiles=args.items // 100)
+
+        gc.collect()
+        tracemalloc.start()
+        dat = DatEditor(path, extended=args.extended)
+        dat.load()
+        used, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        things = sum(len(things) for things in dat.things.values())
+        print(f"{'things':>10} {'MB':>10} {'bytes/thing':>12}")
+        print(f"{things:>10} {used / 2**20:>10.1f} {used / max(things, 1):>12.0f}")
+
+
+def bench_spr_load(args):
+    print(f"{'sprites':>10} {'load (s)':>10} {'us/sprite':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.counts:
+            path = os.path.join(tmp, f"bench_{count}.spr")
+            write_spr(path, count)
+
+            best = None
+            for _ in range(args.repeat):
+                spr = SprEditor(path, use_mmap=not args.in_memory)
+                start = time.perf_counter()
+                spr.load()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            print(f"{count:>10} {best:>10.3f} {best / count * 1e6:>10.2f}")
+
+
+def bench_decode(args):
+    rng = random.Random(1)
+    print(f"{'format':>8} {'size':>5} {'sprites/s':>12}")
+    for transparency in (False, True):
+        for size in args.sizes:
+            spr = SprEditor("", transparency=transparency, sprite_size=size)
+            payloads = [make_sprite_payload(rng, size, transparency) for _ in range(args.sprites)]
+            decode = spr._decode_1098_rgba if transparency else spr._decode_standard
+
+            start = time.perf_counter()
+            for data in payloads:
+                decode(data)
+            elapsed = time.perf_counter() - start
+
+            fmt = "rgba" if transparency else "rgb"
+            print(f"{fmt:>8} {size:>5} {args.sprites / elapsed:>12.0f}")
+
+
+def bench_encode(args):
+    rng = random.Random(1)
+    print(f"{'format':>8} {'size':>5} {'sprites/s':>12}")
+    for transparency in (False, True):
+        for size in args.sizes:
+            spr = SprEditor("", transparency=transparency, sprite_size=size)
+            payloads = [make_sprite_payload(rng, size, transparency) for _ in range(200)]
+            decode = spr._decode_1098_rgba if transparency else spr._decode_standard
+            encode = spr._encode_1098_rgba if transparency else spr._encode_standard
+            images = [decode(data) for data in payloads]
+
+            start = time.perf_counter()
+            for i in range(args.sprites):
+                encode(images[i % len(images)])
+            elapsed = time.perf_counter() - start
+
+            fmt = "rgba" if transparency else "rgb"
+            print(f"{fmt:>8} {size:>5} {args.sprites / elapsed:>12.0f}")
+
+
+def bench_query(args):
+    """
+    select() against a plain walk over the props, before and after things
+    are edited outside apply_changes (as the OBD/image imports do), so a
+    stale FlagIndex shows up as a mismatch.
+    """
+    query = "Pickupable and not Stackable"
+
+    def walk(dat):
+        return [
+            thing_id for thing_id, thing in sorted(dat.things["items"].items())
+            if "Pickupable" in thing["props"] and "Stackable" not in thing["props"]
+        ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.dat")
+        write_dat(path, args.items)
+        dat = DatEditor(path)
+        dat.load()
+
+        start = time.perf_counter()
+        ids = select(dat, query)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        ids = select(dat, query)
+        warm = time.perf_counter() - start
+        if ids != walk(dat):
+            sys.exit("select() doesn't match the props")
+
+        rng = random.Random(1)
+        edited = rng.sample(sorted(dat.things["items"]), min(args.edits, len(dat.things["items"])))
+        for thing_id in edited:
+            props = dat.things["items"][thing_id]["props"]
+            if "Pickupable" in props:
+                del props["Pickupable"]
+            else:
+                props["Pickupable"] = True
+            props.pop("Stackable", None)
+        dat.mark_changed("items", edited)
+        after = select(dat, query)
+
+        print(f"{'items':>10} {'matches':>10} {'build (s)':>10} {'query (ms)':>11}")
+        print(f"{args.items:>10} {len(ids):>10} {first:>10.3f} {warm * 1e3:>11.2f}")
+        if after != walk(dat):
+            sys.exit(f"select() is stale after editing {len(edited)} things outside apply_changes")
+        print(f"ok: select() matches the props after {len(edited)} outside edits")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Item Manager backend benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("spr-load", help="SprEditor.load time as the sprite count grows")
+    p.add_argument("--counts", type=int, nargs="+", default=[10000, 50000, 100000, 200000])
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--in-memory", action="store_true", help="copy the file into RAM instead of mmap")
+    p.set_defaults(func=bench_spr_load)
+
+    p = sub.add_parser("dat-load", help="DatEditor.load time as the thing count grows")
+    p.add_argument("--counts", type=int, nargs="+", default=[10000, 30000, 60000])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_dat_load)
+
+    p = sub.add_parser("dat-memory", help="memory held by a loaded DAT")
+    p.add_argument("--dat", help="client .dat to measure (default: synthetic)")
+    p.add_argument("--extended", action="store_true")
+    p.add_argument("--items", type=int, default=60000)
+    p.set_defaults(func=bench_dat_memory)
+
+    p = sub.add_parser("decode", help="RLE decoder throughput in sprites/sec")
+    p.add_argument("--sizes", type=int, nargs="+", default=[32, 64])
+    p.add_argument("--sprites", type=int, default=5000)
+    p.set_defaults(func=bench_decode)
+
+    p = sub.add_parser("encode", help="RLE encoder throughput in sprites/sec")
+    p.add_argument("--sizes", type=int, nargs="+", default=[32, 64])
+    p.add_argument("--sprites", type=int, default=5000)
+    p.set_defaults(func=bench_encode)
+
+    p = sub.add_parser("query", help="DAT query time, checked against the props")
+    p.add_argument("--items", type=int, default=60000)
+    p.add_argument("--edits", type=int, default=500)
+    p.set_defaults(func=bench_query)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Headless DAT queries and mass edits.
+#
+#   py tools/dat_mass_edit.py Tibia.dat "Pickupable and not Stackable and GroundSpeed > 150"
+#   py tools/dat_mass_edit.py Tibia.dat "sprite in 1000..2000" --category outfits
+#   py tools/dat_mass_edit.py Tibia.dat "Hangable and not HookVertical" --set HookVertical \
+#       --unset Rotatable --columns "LightLevel=3, LightColor=215" -o Tibia_new.dat
+#
+# Without -o the matching IDs are printed; with -o the edits are applied as
+# one batch and the DAT is saved to the given path.
+
+import argparse
+import os
+import sys
+
+base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data_path = os.path.join(base_path, "data")
+if data_path not in sys.path:
+    sys.path.append(data_path)
+
+from dat_editor import DatEditor
+from dat_handler import THING_CATEGORIES
+from dat_query import QueryError, mass_edit, parse_assignments, select
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and mass edit a .dat file")
+    parser.add_argument("dat", help="client .dat file")
+    parser.add_argument("query", help='e.g. "Pickupable and GroundSpeed > 150"')
+    parser.add_argument("--category", choices=THING_CATEGORIES, default="items")
+    parser.add_argument("--extended", action="store_true", help="u32 sprite IDs")
+    parser.add_argument("--set", nargs="+", default=[], metavar="FLAG")
+    parser.add_argument("--unset", nargs="+", default=[], metavar="FLAG")
+    parser.add_argument("--columns", default="", help='e.g. "GroundSpeed=200, Elevation=8"')
+    parser.add_argument("-o", "--output", help="save the edited .dat here")
+    args = parser.parse_args()
+
+    editor = DatEditor(args.dat, extended=args.extended, lazy=True)
+    editor.load()
+
+    try:
+        if not args.output:
+            ids = select(editor, args.query, args.category)
+            print(f"{len(ids)} match(es)")
+            print(", ".join(str(i) for i in ids))
+            return
+
+        ids = mass_edit(
+            editor,
+            args.query,
+            args.set,
+            args.unset,
+            parse_assignments(args.columns),
+            category=args.category,
+        )
+    except QueryError as e:
+        sys.exit(f"Error: {e}")
+
+    editor.save(args.output)
+    print(f"{len(ids)} {args.category} edited, saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
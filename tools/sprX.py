@@ -12,6 +12,13 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from PyQt6.QtGui import QPixmap
 
+base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data_path = os.path.join(base_path, "data")
+if data_path not in sys.path:
+    sys.path.append(data_path)
+
+from spr_handler import compute_sprite_lengths
+
 class SPRExtractorWorker(QThread):
     log_signal = pyqtSignal(str)
     progress_signal = pyqtSignal(int)
@@ -55,6 +62,8 @@ class SPRExtractorWorker(QThread):
                 offsets.append(struct.unpack('I', f.read(4))[0])
 
             file_size = os.path.getsize(self.spr_path)
+            # Records aren't always in ID order (incremental saves append at EOF)
+            lengths = compute_sprite_lengths(offsets, file_size)
             total_steps = self.sprite_count + 1
             current_step = 0
             extracted_count = 0
@@ -75,20 +84,8 @@ class SPRExtractorWorker(QThread):
                         self.progress_signal.emit(int((current_step / total_steps) * 100))
                         continue
 
-                  
-                    next_offset = 0
-                    for j in range(sprite_id, len(offsets)):
-                        if offsets[j] != 0:
-                            next_offset = offsets[j]
-                            break
-                    
-                    if next_offset == 0:
-                        size = file_size - offset
-                    else:
-                        size = next_offset - offset
-
                     f.seek(offset)
-                    raw_data = f.read(size)
+                    raw_data = f.read(int(lengths[sprite_id - 1]))
                     
          
                     img = self.decode_sprite(raw_data, self.params.get('transparency', False))